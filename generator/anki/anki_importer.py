@@ -1,63 +1,213 @@
+import asyncio
 import json
 import logging
+from typing import TYPE_CHECKING
 
-from .anki_operations import invoke
+from . import deck_index
+from .anki_operations import invoke, invoke_async
 from ..anki import card_formatter
-from ..config import Config, RECOGNITION, PRODUCTION, BOTH, INCLUDE_CLOZE
+from ..config import Config, RECOGNITION, PRODUCTION, BOTH, INCLUDE_CLOZE, POLICY_ABORT, POLICY_ASK, POLICY_UPDATE
 from ..entities import CardRawDataV1, CardRawDataV2, WordWithContext
 from ..input.confirm import confirm_action
-from ..input.file_operations import copy_to_media_directory
+from ..run_report import run_report, PHASE_IMPORT
+from .media_transfer import transfer_media_files
+
+if TYPE_CHECKING:
+    import httpx
+
+# description of the cloze notes, their import failures are only logged
+CLOZE_CARD = "Cloze card"
 
 
 def import_card_collection(cards: dict[WordWithContext, CardRawDataV2]):
+    """
+    Format the notes of all cards first and import them with chunked addNotes calls.
+    Every note remembers its word and card type, so failed notes are reported per word.
+    """
+    notes: list[dict] = []
+    note_owners: list[tuple[WordWithContext, str]] = []
+    media_files: list[str] = []
     for word in cards:
         card_raw_data = cards[word]
         if card_raw_data is None:
             raise ValueError(f"No object for word [{word}]. Data structure: [{json.dumps(cards)}]")
 
-        # Copy media files (only once per word, regardless of card direction)
-        copy_to_media_directory(card_raw_data.image_path)
-        copy_to_media_directory(card_raw_data.audio_path)
-
-        # Determine which card types to create
-        card_types = []
-        if Config.CARD_DIRECTION == BOTH:
-            card_types = [RECOGNITION, PRODUCTION]
-        elif Config.CARD_DIRECTION == PRODUCTION:
-            card_types = [PRODUCTION]
-        else:
-            card_types = [RECOGNITION]
+        # Media files are transferred once per word, regardless of card direction
+        media_files += [card_raw_data.image_path, card_raw_data.audio_path]
 
         # Create cards based on direction setting
-        for card_type in card_types:
-            import_result = format_and_import_card(card_raw_data, card_type)
-            if import_result['error']:
-                logging.error(f"Error occurred during import of {card_type} card for word [{word.word}]. Import error: [{import_result['error']}]")
-                abort = confirm_action("Do you want to abort processing? If no, the processing will be resumed and this card will be skipped")
-                if abort:
-                    raise Exception(f"Aborting processing after error: [{import_result['error']}]")
-                else:
-                    continue
-            logging.info(f"{card_type.capitalize()} card for word [{word.word}] imported in deck [{Config.DECK_NAME}]")
+        for card_type in card_types_for_direction():
+            notes.append(card_formatter.format(card_raw_data, Config.DECK_NAME, card_type))
+            note_owners.append((word, f"{card_type.capitalize()} card"))
 
         # Import cloze cards if enabled
         if Config.INCLUDE_CLOZE and card_raw_data.cloze_sentences:
-            import_cloze_cards(card_raw_data, word)
+            for i, cloze_card in enumerate(card_formatter.format_cloze_cards(card_raw_data, Config.DECK_NAME)):
+                notes.append(cloze_card)
+                note_owners.append((word, f"{CLOZE_CARD} {i+1}"))
+
+    transfer_media_files(media_files)
+
+    chunk_size = Config.IMPORT_CHUNK_SIZE
+    failed_notes = 0
+    updated_notes = 0
+    if Config.ON_EXISTING == POLICY_UPDATE:
+        updates, notes, note_owners = split_existing_notes(notes, note_owners)
+        for start in range(0, len(updates), chunk_size):
+            failures = update_notes(updates[start:start + chunk_size])
+            failed_notes += len(failures)
+            updated_notes += len(updates[start:start + chunk_size]) - len(failures)
+            handle_import_failures(failures)
+    for start in range(0, len(notes), chunk_size):
+        failures = add_notes(notes[start:start + chunk_size], note_owners[start:start + chunk_size])
+        failed_notes += len(failures)
+        handle_import_failures(failures)
+    logging.info(f"[{len(notes) + updated_notes - failed_notes}] of [{len(notes) + updated_notes}] notes for [{len(cards)}] words imported in deck "
+                 f"[{Config.DECK_NAME}] with chunks of [{chunk_size}] notes, [{updated_notes}] existing notes updated")
+
+
+def handle_import_failures(failures: list[tuple[object, str]]):
+    """
+    Report the failed notes and abort if Config.ON_ERROR says so. Rejected notes are not retried, they fail again.
+    Cloze notes are optional, their failures are logged and the word is imported without them.
+    """
+    for (word, description), error in failures:
+        logging.error(f"Error occurred during import of {description} for word [{word.word}]. Import error: [{error}]")
+        if description.startswith(CLOZE_CARD):
+            run_report.add_failure(word.word, PHASE_IMPORT, error, "skipped", description)
+    failures = [((word, description), error) for (word, description), error in failures if not description.startswith(CLOZE_CARD)]
+    if not failures:
+        return
+    if Config.ON_ERROR == POLICY_ASK:
+        abort = confirm_action("Do you want to abort processing? If no, the processing will be resumed and these cards will be skipped")
+    else:
+        abort = Config.ON_ERROR == POLICY_ABORT
+    for (word, description), error in failures:
+        run_report.add_failure(word.word, PHASE_IMPORT, error, "aborted" if abort else "skipped", description)
+    if abort:
+        raise Exception(f"Aborting processing after error: [{failures[0][1]}]")
+
+
+def split_existing_notes(notes: list[dict], note_owners: list) -> tuple[list[tuple[dict, object, int]], list[dict], list]:
+    """
+    (note, owner, existing note id) of the notes that replace the fields of an existing note of the same word and card type,
+    and the notes and owners that are added as new notes.
+    """
+    index = deck_index.get_deck_index(Config.DECK_NAME)
+    updates, new_notes, new_note_owners = [], [], []
+    for note, owner in zip(notes, note_owners):
+        word, _ = owner
+        # the last tag is the card type, e.g. recognition or cloze-2
+        note_id = index.note_id_for_word_and_tag(word.word, note['tags'][-1])
+        if note_id is not None:
+            updates.append((note, owner, note_id))
+        else:
+            new_notes.append(note)
+            new_note_owners.append(owner)
+    return updates, new_notes, new_note_owners
 
 
-def format_and_import_card(card_data: CardRawDataV2, card_type: str = RECOGNITION):
-    note = card_formatter.format(card_data, Config.DECK_NAME, card_type)
-    result = invoke('addNote', {'note': note})
-    return result
+def update_notes(updates: list[tuple[dict, object, int]]) -> list[tuple[object, str]]:
+    """Update the fields of existing notes with one multi call, their scheduling and review history are kept."""
+    actions = [{'action': 'updateNoteFields', 'params': {'note': {'id': note_id, 'fields': note['fields']}}} for note, _, note_id in updates]
+    result = invoke('multi', {'actions': actions})
+    if result.get('error') is not None:
+        return [(owner, result.get('error')) for _, owner, _ in updates]
+    failures: list[tuple[object, str]] = []
+    index = deck_index.loaded_deck_index(Config.DECK_NAME)
+    for (note, owner, note_id), action_result in zip(updates, result['result']):
+        error = action_result.get('error') if isinstance(action_result, dict) else None
+        if error is not None:
+            failures.append((owner, error))
+        elif index is not None:
+            index.add_note(note_id, note['tags'], note['fields'])
+    return failures
 
 
-def import_cloze_cards(card_data: CardRawDataV2, word: WordWithContext):
-    """Import cloze deletion cards for the given word."""
-    cloze_cards = card_formatter.format_cloze_cards(card_data, Config.DECK_NAME)
+def add_notes(notes: list[dict], note_owners: list) -> list[tuple[object, str]]:
+    """
+    Add the notes with one addNotes call and return (owner, error) of every note that was not added.
+    Notes are checked with canAddNotesWithErrorDetail first: newer AnkiConnect versions fail the whole addNotes call
+    with a list of errors that can not be mapped back to the notes, the check keeps the mapping exact.
+    """
+    failures: list[tuple[object, str]] = []
+    check_result = invoke('canAddNotesWithErrorDetail', {'notes': notes})
+    if check_result.get('error') is None:
+        addable = []
+        for note, owner, check in zip(notes, note_owners, check_result['result']):
+            if check['canAdd']:
+                addable.append((note, owner))
+            else:
+                failures.append((owner, check.get('error')))
+    else:
+        # older AnkiConnect without the check, addNotes returns null for every failed note
+        addable = list(zip(notes, note_owners))
+    if not addable:
+        return failures
 
-    for i, cloze_card in enumerate(cloze_cards):
-        import_result = invoke('addNote', {'note': cloze_card})
-        if import_result['error']:
-            logging.error(f"Error importing cloze card {i+1} for word [{word.word}]: {import_result['error']}")
+    import_result = invoke('addNotes', {'notes': [note for note, _ in addable]})
+    note_ids = import_result.get('result')
+    if not isinstance(note_ids, list):
+        # the whole call failed, but Anki may have added some of the notes before the error
+        added = added_before_error([note for note, _ in addable])
+        for (note, owner), was_added in zip(addable, added):
+            if was_added:
+                word, description = owner
+                logging.info(f"{description} for word [{word.word}] was added before the error of the import")
+            else:
+                failures.append((owner, import_result.get('error')))
+        return failures
+    for (note, owner), note_id in zip(addable, note_ids):
+        if note_id is None:
+            failures.append((owner, import_result.get('error') or "note was not added"))
         else:
-            logging.info(f"Cloze card {i+1} for word [{word.word}] imported in deck [{Config.DECK_NAME}]")
+            word, description = owner
+            logging.debug(f"{description} for word [{word.word}] imported with note id [{note_id}]")
+            record_added_note(note, note_id)
+    return failures
+
+
+def added_before_error(notes: list[dict]) -> list[bool]:
+    """
+    Whether each note was added by a failed addNotes call. The notes passed the canAddNotesWithErrorDetail check
+    before the call, so a note that can not be added any more is in the deck now. If the check fails, every note counts as not added.
+    """
+    check_result = invoke('canAddNotes', {'notes': notes})
+    can_add = check_result.get('result')
+    if check_result.get('error') is not None or not isinstance(can_add, list) or len(can_add) != len(notes):
+        return [False] * len(notes)
+    return [not note_can_be_added for note_can_be_added in can_add]
+
+
+def record_added_note(note: dict, note_id: int):
+    index = deck_index.loaded_deck_index(note['deckName'])
+    if index is not None:
+        index.add_note(note_id, note['tags'], note['fields'])
+
+
+def card_types_for_direction() -> list[str]:
+    if Config.CARD_DIRECTION == BOTH:
+        return [RECOGNITION, PRODUCTION]
+    elif Config.CARD_DIRECTION == PRODUCTION:
+        return [PRODUCTION]
+    else:
+        return [RECOGNITION]
+
+
+async def import_card_async(card_raw_data: CardRawDataV2, http_client: 'httpx.AsyncClient' = None) -> list[int]:
+    """Import all notes of one card with a single addNotes call. Returns the ids of the created notes."""
+    await asyncio.to_thread(transfer_media_files, [card_raw_data.image_path, card_raw_data.audio_path])
+
+    notes = [card_formatter.format(card_raw_data, Config.DECK_NAME, card_type) for card_type in card_types_for_direction()]
+    if Config.INCLUDE_CLOZE and card_raw_data.cloze_sentences:
+        notes += card_formatter.format_cloze_cards(card_raw_data, Config.DECK_NAME)
+
+    import_result = await invoke_async('addNotes', {'notes': notes}, http_client)
+    note_ids = import_result.get('result') or []
+    if import_result.get('error') or None in note_ids:
+        raise Exception(f"Error occurred during import of word [{card_raw_data.word}]. Import error: [{import_result.get('error')}]")
+    for note, note_id in zip(notes, note_ids):
+        record_added_note(note, note_id)
+    logging.info(f"[{len(note_ids)}] notes for word [{card_raw_data.word}] imported in deck [{Config.DECK_NAME}]")
+    return note_ids
+
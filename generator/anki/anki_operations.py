@@ -1,9 +1,17 @@
 import logging
+from typing import TYPE_CHECKING
 
 import requests
 
+from generator.anki import deck_index
 from generator.config import Config
 
+if TYPE_CHECKING:
+    import httpx
+
+# actions per multi request, keeps the request size reasonable for large word lists
+MULTI_CHUNK_SIZE = 500
+
 
 def check_deck_exists(deck_name: str) -> bool:
     # Check existing decks
@@ -29,8 +37,7 @@ def create_deck(deck_name):
 
 def check_card_exists(deck_name, word):
     tag = word_to_tag(word)
-    existing_cards = find_all_cards_with_tag(deck_name, tag)
-    if len(existing_cards) >= 1:
+    if note_ids_for_word(deck_name, word):
         logging.info(f"Card with tag [{tag}] exists in deck [{deck_name}]")
         return True
     else:
@@ -38,22 +45,63 @@ def check_card_exists(deck_name, word):
         return False
 
 
+def note_ids_for_word(deck_name: str, word: str) -> list[int]:
+    """Notes of the word from the deck index if it is loaded, otherwise with a findNotes request by the word tag."""
+    index = deck_index.loaded_deck_index(deck_name)
+    if index is not None:
+        return index.note_ids_for_word(word)
+    return find_notes(f'"deck:{deck_name}" tag:"{word_to_tag(word)}"')
+
+
+def find_notes_by_words(deck_name: str, words: list[str]) -> dict[str, list[int]]:
+    """
+    Note ids of every word in the deck, found by the word tag. They are taken from the deck index if it is loaded,
+    otherwise the findNotes queries are sent in chunked multi actions, so the whole list needs only a few requests
+    to AnkiConnect. Words without notes map to an empty list.
+    """
+    unique_words = list(dict.fromkeys(words))
+    index = deck_index.loaded_deck_index(deck_name)
+    if index is not None:
+        return {word: index.note_ids_for_word(word) for word in unique_words}
+    notes_by_word: dict[str, list[int]] = {}
+    for start in range(0, len(unique_words), MULTI_CHUNK_SIZE):
+        chunk = unique_words[start:start + MULTI_CHUNK_SIZE]
+        actions = [{'action': 'findNotes', 'version': 6, 'params': {'query': f'"deck:{deck_name}" tag:"{word_to_tag(word)}"'}}
+                   for word in chunk]
+        response = invoke('multi', {'actions': actions})
+        if response.get('error') is not None:
+            raise Exception(f"Failed to find notes in deck [{deck_name}]: {response.get('error')}")
+        for word, result in zip(chunk, response['result']):
+            # actions with a version return their own result and error
+            if isinstance(result, dict):
+                if result.get('error') is not None:
+                    raise Exception(f"Failed to find notes for word [{word}] in deck [{deck_name}]: {result.get('error')}")
+                result = result['result']
+            notes_by_word[word] = result
+    logging.info(f"Checked [{len(unique_words)}] words in deck [{deck_name}] with [{-(-len(unique_words) // MULTI_CHUNK_SIZE)}] requests, "
+                 f"[{sum(1 for note_ids in notes_by_word.values() if note_ids)}] of them have notes")
+    return notes_by_word
+
+
 def delete_card_from_deck(deck_name: str, word: str) -> bool:
     tag = word_to_tag(word)
     logging.info(f"Deleting card [{word}] from deck [{deck_name}] using tag [{tag}]")
-    card_ids = find_all_cards_with_tag(deck_name, tag)
-    if not card_ids:
+    index = deck_index.loaded_deck_index(deck_name)
+    note_ids = note_ids_for_word(deck_name, word)
+    if not note_ids:
         logging.warning("No cards found with the specified term in the given deck.")
         return True
-    delete_result = delete_cards_by_id(card_ids)
+    delete_result = delete_cards_by_id(note_ids)
     if delete_result.get('error') is None:
         # sometimes cards are not deleted -> retry
-        remaining_cards = find_all_cards_with_tag(deck_name, tag)
-        if len(remaining_cards) == 0:
+        remaining_notes = find_notes(f"nid:{','.join(map(str, note_ids))}")
+        if index is not None:
+            index.remove_notes([note_id for note_id in note_ids if note_id not in remaining_notes])
+        if len(remaining_notes) == 0:
             logging.info(f"Successfully deleted card for [{word}]")
             return True
         else:
-            logging.error(f"Deletion returned no error, but some cards with tag [{tag}] are still in the deck - {remaining_cards}."
+            logging.error(f"Deletion returned no error, but some notes with tag [{tag}] are still in the deck - {remaining_notes}."
                           f" This happens, if a card is in review process. Restart Anki and try again.")
             return False
 
@@ -69,6 +117,10 @@ def find_all_cards_with_tag(deck_name, tag):
     return card_ids
 
 
+def find_notes(query):
+    return invoke('findNotes', {'query': query})['result']
+
+
 def find_cards(query):
     return invoke('findCards', {'query': query})['result']
 
@@ -106,6 +158,19 @@ def invoke(action, params=None):
     return response.json()
 
 
+async def invoke_async(action, params=None, http_client: 'httpx.AsyncClient' = None):
+    if params is None:
+        params = {}
+    request = {'action': action, 'version': 6, 'params': params}
+    if http_client is None:
+        import httpx
+        async with httpx.AsyncClient() as client:
+            response = await client.post(Config.ANKI_CONNECT_URL, json=request)
+    else:
+        response = await http_client.post(Config.ANKI_CONNECT_URL, json=request)
+    return response.json()
+
+
 def word_to_tag(word: str) -> str:
     formatted_word = word.replace(' ', '_').lower()  # Format word for consistent tagging
     return formatted_word
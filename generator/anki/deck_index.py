@@ -0,0 +1,116 @@
+import logging
+import threading
+import time
+
+from . import anki_operations
+
+# notes per notesInfo request while the index is loaded
+NOTES_INFO_PAGE_SIZE = 500
+
+
+class DeckIndex:
+    """
+    Snapshot of the notes of one deck: tag -> note ids and note id -> fields.
+    It is loaded with one findNotes and a few paginated notesInfo requests, answers existence lookups locally
+    and is updated after the notes added and deleted by this tool.
+    """
+
+    def __init__(self, deck_name: str):
+        self.deck_name = deck_name
+        self.note_ids_by_tag: dict[str, set[int]] = {}
+        self.fields_by_note_id: dict[int, dict[str, str]] = {}
+        self.tags_by_note_id: dict[int, list[str]] = {}
+        self._lock = threading.Lock()
+
+    def load(self, note_ids: list[int] = None):
+        """Loads the notes of the deck, note_ids are the notes of the deck if they are known already."""
+        started_at = time.monotonic()
+        requests = 0
+        if note_ids is None:
+            note_ids = find_deck_note_ids(self.deck_name)
+            requests += 1
+        for start in range(0, len(note_ids), NOTES_INFO_PAGE_SIZE):
+            page = anki_operations.invoke('notesInfo', {'notes': note_ids[start:start + NOTES_INFO_PAGE_SIZE]})
+            requests += 1
+            if page.get('error') is not None:
+                raise Exception(f"Failed to load notes of deck [{self.deck_name}]: {page.get('error')}")
+            for note_info in page['result']:
+                # notes deleted while the index is loaded have no id
+                if note_info.get('noteId') is not None:
+                    self.add_note(note_info['noteId'], note_info['tags'],
+                                  {name: field['value'] for name, field in note_info['fields'].items()})
+        logging.info(f"Deck index for [{self.deck_name}] loaded: [{len(self.fields_by_note_id)}] notes, [{len(self.note_ids_by_tag)}] tags, "
+                     f"[{requests}] requests in [{time.monotonic() - started_at:.1f}] seconds")
+        return self
+
+    def note_ids_for_word(self, word: str) -> list[int]:
+        with self._lock:
+            return sorted(self.note_ids_by_tag.get(anki_operations.word_to_tag(word), ()))
+
+    def note_id_for_word_and_tag(self, word: str, tag: str) -> int | None:
+        """Existing note of the word with the tag, e.g. its recognition card."""
+        with self._lock:
+            note_ids = self.note_ids_by_tag.get(anki_operations.word_to_tag(word), set()) & self.note_ids_by_tag.get(tag.lower(), set())
+            return min(note_ids) if note_ids else None
+
+    def contains(self, word: str) -> bool:
+        return len(self.note_ids_for_word(word)) >= 1
+
+    def fields(self, note_id: int) -> dict[str, str] | None:
+        with self._lock:
+            return self.fields_by_note_id.get(note_id)
+
+    def add_note(self, note_id: int, tags: list[str], fields: dict[str, str]):
+        with self._lock:
+            self.fields_by_note_id[note_id] = fields
+            self.tags_by_note_id[note_id] = [tag.lower() for tag in tags]
+            for tag in tags:
+                # Anki matches tags case insensitively
+                self.note_ids_by_tag.setdefault(tag.lower(), set()).add(note_id)
+
+    def remove_notes(self, note_ids: list[int]):
+        with self._lock:
+            for note_id in note_ids:
+                self.fields_by_note_id.pop(note_id, None)
+                for tag in self.tags_by_note_id.pop(note_id, []):
+                    tag_note_ids = self.note_ids_by_tag.get(tag, set())
+                    tag_note_ids.discard(note_id)
+                    if not tag_note_ids:
+                        self.note_ids_by_tag.pop(tag, None)
+
+
+_deck_indexes: dict[str, DeckIndex] = {}
+_deck_indexes_lock = threading.Lock()
+
+
+def find_deck_note_ids(deck_name: str) -> list[int]:
+    result = anki_operations.invoke('findNotes', {'query': f'"deck:{deck_name}"'})
+    if result.get('error') is not None:
+        raise Exception(f"Failed to find notes in deck [{deck_name}]: {result.get('error')}")
+    return result['result']
+
+
+def index_is_cheaper(deck_notes: int, words: int) -> bool:
+    """
+    The index needs a notesInfo request per page of the deck, the lookup of the words a multi request per chunk of words.
+    A large deck and a short word list are checked with the multi requests.
+    """
+    index_requests = -(-deck_notes // NOTES_INFO_PAGE_SIZE)
+    lookup_requests = -(-words // anki_operations.MULTI_CHUNK_SIZE)
+    return index_requests <= lookup_requests
+
+
+def get_deck_index(deck_name: str, note_ids: list[int] = None) -> DeckIndex:
+    """Index of the deck, loaded from AnkiConnect on first use."""
+    with _deck_indexes_lock:
+        index = _deck_indexes.get(deck_name)
+        if index is None:
+            index = DeckIndex(deck_name).load(note_ids)
+            _deck_indexes[deck_name] = index
+        return index
+
+
+def loaded_deck_index(deck_name: str) -> DeckIndex | None:
+    """Index of the deck if it is loaded already, used to record changes without loading it."""
+    with _deck_indexes_lock:
+        return _deck_indexes.get(deck_name)
@@ -0,0 +1,119 @@
+import base64
+import logging
+import os
+import shutil
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from .anki_operations import invoke
+from ..config import Config, MEDIA_TRANSFER_ANKI_CONNECT
+from ..cache.blob_store import file_sha256
+
+LINKED = "linked"
+CLONED = "cloned"
+COPIED = "copied"
+SKIPPED = "skipped"
+STORED = "stored"
+
+# ioctl request of Linux to share the blocks of a file on copy-on-write file systems (btrfs, xfs)
+_FICLONE = 0x40049409
+
+
+def transfer_media_files(file_paths: list[str]):
+    """
+    Transfer images and audio files to Anki in parallel. Files that are already in the media directory are skipped,
+    new files are hard linked, cloned or copied into it, or stored via AnkiConnect if the media directory is not local.
+    """
+    unique_file_paths = list(dict.fromkeys(file_paths))
+    transfer = store_media_file if Config.MEDIA_TRANSFER == MEDIA_TRANSFER_ANKI_CONNECT else transfer_to_media_directory
+    with ThreadPoolExecutor(max_workers=Config.MEDIA_TRANSFER_WORKERS, thread_name_prefix="media-transfer") as executor:
+        outcomes = Counter(executor.map(transfer, unique_file_paths))
+    if unique_file_paths:
+        logging.info(f"Media files transferred to Anki: {dict(outcomes)}")
+
+
+def transfer_to_media_directory(file_path: str) -> str:
+    target_file_path = os.path.join(Config.ANKI_MEDIA_DIRECTORY, os.path.basename(file_path))
+    if os.path.exists(target_file_path) and files_are_identical(file_path, target_file_path):
+        logging.debug(f"File [{file_path}] is already in [{Config.ANKI_MEDIA_DIRECTORY}]")
+        return SKIPPED
+
+    # the file is replaced atomically, Anki never sees a partly written file
+    temporary_path = os.path.join(Config.ANKI_MEDIA_DIRECTORY, f".{uuid.uuid4().hex}.tmp")
+    try:
+        outcome = link_clone_or_copy(file_path, temporary_path)
+        os.replace(temporary_path, target_file_path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+    logging.debug(f"File [{file_path}] {outcome} to [{Config.ANKI_MEDIA_DIRECTORY}]")
+    return outcome
+
+
+def files_are_identical(file_path: str, other_file_path: str) -> bool:
+    source = os.stat(file_path)
+    target = os.stat(other_file_path)
+    if source.st_size != target.st_size:
+        return False
+    if os.path.samestat(source, target) or source.st_mtime_ns == target.st_mtime_ns:
+        return True
+    # same size but different modification time, e.g. the processing directory was copied
+    return file_sha256(file_path) == file_sha256(other_file_path)
+
+
+def link_clone_or_copy(source_path: str, target_path: str) -> str:
+    """Use the cheapest transfer the file systems support: hard link, copy-on-write clone or in-kernel copy."""
+    try:
+        os.link(source_path, target_path)
+        return LINKED
+    except OSError:
+        pass
+    with open(source_path, 'rb') as source, open(target_path, 'wb') as target:
+        if _clone(source, target):
+            outcome = CLONED
+        else:
+            _copy(source, target)
+            outcome = COPIED
+    # equal modification times let the next run skip the file without hashing it
+    shutil.copystat(source_path, target_path)
+    return outcome
+
+
+def _clone(source, target) -> bool:
+    try:
+        import fcntl
+        fcntl.ioctl(target.fileno(), _FICLONE, source.fileno())
+        return True
+    except (ImportError, OSError):
+        return False
+
+
+def _copy(source, target):
+    if hasattr(os, "copy_file_range"):
+        try:
+            remaining = os.fstat(source.fileno()).st_size
+            while remaining > 0:
+                written = os.copy_file_range(source.fileno(), target.fileno(), remaining)
+                if written == 0:
+                    break
+                remaining -= written
+            if remaining == 0:
+                return
+        except OSError:
+            # not supported between these file systems
+            pass
+        source.seek(0)
+        target.seek(0)
+        target.truncate()
+    shutil.copyfileobj(source, target)
+
+
+def store_media_file(file_path: str) -> str:
+    with open(file_path, 'rb') as file:
+        data = base64.b64encode(file.read()).decode("ascii")
+    result = invoke('storeMediaFile', {'filename': os.path.basename(file_path), 'data': data})
+    if result.get('error') is not None:
+        raise IOError(f"Failed to store media file [{file_path}] via AnkiConnect: {result.get('error')}")
+    logging.debug(f"File [{file_path}] stored via AnkiConnect")
+    return STORED
@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import threading
+from typing import TYPE_CHECKING
+
+from ..config import Config, REPLICATE
+
+# openai, replicate and httpx take most of the startup time of the tool,
+# they are imported when the first client is created and not when this module is imported
+if TYPE_CHECKING:
+    import httpx
+    import replicate
+    from openai import AsyncOpenAI, OpenAI
+
+# Connections are kept open between words, so every call after the first one skips the TCP and TLS handshake
+MAX_CONNECTIONS = 32
+MAX_KEEPALIVE_CONNECTIONS = 32
+KEEPALIVE_EXPIRY_SECONDS = 120.0
+TIMEOUT_SECONDS = 120.0
+CONNECT_TIMEOUT_SECONDS = 10.0
+
+_lock = threading.Lock()
+_openai_client: 'OpenAI' = None
+_openai_http_client: 'httpx.Client' = None
+_async_openai_clients: dict[asyncio.AbstractEventLoop, 'AsyncOpenAI'] = {}
+_replicate_client: 'replicate.Client' = None
+
+
+def connection_limits() -> 'httpx.Limits':
+    import httpx
+    return httpx.Limits(max_connections=MAX_CONNECTIONS,
+                        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                        keepalive_expiry=KEEPALIVE_EXPIRY_SECONDS)
+
+
+def timeout() -> 'httpx.Timeout':
+    import httpx
+    return httpx.Timeout(TIMEOUT_SECONDS, connect=CONNECT_TIMEOUT_SECONDS)
+
+
+def get_openai_client() -> 'OpenAI':
+    """Process wide OpenAI client, created on first use."""
+    global _openai_client, _openai_http_client
+    with _lock:
+        if _openai_client is None:
+            import httpx
+            from openai import OpenAI
+            _openai_http_client = httpx.Client(limits=connection_limits(), timeout=timeout())
+            _openai_client = OpenAI(
+                api_key=Config.OPENAI_API_KEY,
+                base_url=Config.OPENAI_BASE_URL,
+                max_retries=0,  # 429 responses are handled by the rate limiter, other failures by the retries module
+                http_client=_openai_http_client,
+            )
+            logging.debug("OpenAI client created")
+        return _openai_client
+
+
+def get_async_openai_client() -> 'AsyncOpenAI':
+    """AsyncOpenAI client of the running event loop. Async connections can not be shared between loops."""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        client = _async_openai_clients.get(loop)
+        if client is None:
+            import httpx
+            from openai import AsyncOpenAI
+            for closed_loop in [known for known in _async_openai_clients if known.is_closed()]:
+                del _async_openai_clients[closed_loop]
+            client = AsyncOpenAI(
+                api_key=Config.OPENAI_API_KEY,
+                base_url=Config.OPENAI_BASE_URL,
+                max_retries=0,  # 429 responses are handled by the rate limiter, other failures by the retries module
+                http_client=httpx.AsyncClient(limits=connection_limits(), timeout=timeout()),
+            )
+            _async_openai_clients[loop] = client
+            logging.debug("AsyncOpenAI client created")
+        return client
+
+
+def get_replicate_client() -> 'replicate.Client':
+    global _replicate_client
+    with _lock:
+        if _replicate_client is None:
+            import httpx
+            import replicate
+            _replicate_client = replicate.Client(api_token=Config.REPLICATE_API_KEY,
+                                                 transport=httpx.HTTPTransport(limits=connection_limits()))
+            logging.debug("Replicate client created")
+        return _replicate_client
+
+
+def prewarm_connections() -> threading.Thread:
+    """
+    Open connections to the providers in the background, e.g. while the input file is read.
+    Only a HEAD request to the API root is sent, it does not count against any quota.
+    """
+    def prewarm():
+        try:
+            client = get_openai_client()
+            _openai_http_client.head(str(client.base_url))
+            if Config.IMAGE_GENERATION_MODE == REPLICATE:
+                get_replicate_client()
+            logging.debug("Provider connections are pre-warmed")
+        except Exception as e:
+            # pre-warming is only an optimization
+            logging.debug(f"Pre-warming of provider connections failed: [{e}]")
+
+    thread = threading.Thread(target=prewarm, name="prewarm-connections", daemon=True)
+    thread.start()
+    return thread
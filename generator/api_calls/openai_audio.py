@@ -1,21 +1,30 @@
-import logging
+from generator.api_calls import clients, rate_limiter
+from generator.cache import audio_cache
+from generator.cache.blob_store import detach_file
+from generator.config import ENDPOINT_OPENAI_AUDIO
 
-from openai import OpenAI
 
-from generator.config import Config
-from generator.entities import WordWithContext
+TTS_MODEL = "tts-1-hd"
+TTS_VOICE = "nova"
+TTS_FORMAT = "mp3"
 
 
 def chat_generate_and_save_audio(word: str, target_file_path: str):
-    client = OpenAI(
-        api_key=Config.OPENAI_API_KEY
-    )
+    if audio_cache.copy_cached_audio(word, TTS_MODEL, TTS_VOICE, TTS_FORMAT, target_file_path):
+        return
+    client = clients.get_openai_client()
+
+    raw_response = rate_limiter.call_with_rate_limit(ENDPOINT_OPENAI_AUDIO, lambda: client.audio.speech.with_raw_response.create(
+            model=TTS_MODEL,
+            voice=TTS_VOICE,
+            input=speech_input(word),
+            response_format=TTS_FORMAT,
+    ))
+    detach_file(target_file_path)
+    raw_response.parse().write_to_file(target_file_path)
+    audio_cache.add_audio(target_file_path, word, TTS_MODEL, TTS_VOICE, TTS_FORMAT)
 
-    # use period for pause
-    with client.audio.speech.with_streaming_response.create(
-            model="tts-1-hd",
-            voice="nova",
-            input=". " + word + ". ",
 
-    ) as response:
-        response.stream_to_file(target_file_path)
+def speech_input(word: str) -> str:
+    # use period for pause
+    return ". " + word + ". "
@@ -0,0 +1,196 @@
+import json
+import logging
+import os
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Callable
+
+from ..cache import llm_cache
+from ..cache.llm_cache import LlmCache
+from ..config import Config
+from ..entities import WordWithContext
+from . import clients, openai_image_prompt, openai_text, prompt_cache_metrics, retries
+
+BATCH_STATE_FILE_NAME = ".openai_batches.json"
+BATCH_ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+# limit of the Batch API for one input file
+MAX_REQUESTS_PER_BATCH = 50000
+FINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+# circuit of the file and batch calls, separate from the chat endpoint
+RETRY_PROVIDER = "openai_batch"
+
+PHASE_TEXT = "text"
+PHASE_IMAGE_PROMPT = "image_prompt"
+
+
+@dataclass
+class BatchRequest:
+    # custom_id of the request in the batch, the LLM cache key, so a restarted run builds the same ids
+    key: str
+    parameters: dict
+    messages: list[dict]
+
+    def to_jsonl_line(self) -> str:
+        return json.dumps({"custom_id": self.key, "method": "POST", "url": BATCH_ENDPOINT,
+                           "body": {**self.parameters, "messages": self.messages}}, ensure_ascii=False)
+
+
+class BatchState:
+    """
+    Batches submitted for a processing directory. The file is written before a batch is polled,
+    so a run that is interrupted while waiting continues with the same batches instead of submitting them again.
+    """
+
+    def __init__(self, processing_directory: str):
+        self.path = os.path.join(processing_directory, BATCH_STATE_FILE_NAME)
+        self.batches: dict[str, list[dict]] = {PHASE_TEXT: [], PHASE_IMAGE_PROMPT: []}
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as file:
+                self.batches.update(json.load(file))
+            logging.info(f"Batch state loaded from [{self.path}]: { {phase: len(batches) for phase, batches in self.batches.items()} } submitted batches")
+
+    def submitted_batches(self, phase: str) -> list[dict]:
+        return self.batches[phase]
+
+    def add(self, phase: str, batch_id: str, keys: list[str]):
+        self.batches[phase].append({"batch_id": batch_id, "keys": keys})
+        self.save()
+
+    def save(self):
+        temporary_path = f"{self.path}.{uuid.uuid4().hex}.tmp"
+        with open(temporary_path, 'w', encoding='utf-8') as file:
+            json.dump(self.batches, file)
+        os.replace(temporary_path, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def batch_structured_texts(words: list[WordWithContext], state: BatchState) -> dict[WordWithContext, dict]:
+    """Structured card texts of all words. Words without valid result are missing, their text is requested as usual."""
+    requests = {word_with_context: BatchRequest(LlmCache.make_key(openai_text.STRUCTURED_TEXT_PARAMETERS, messages),
+                                                openai_text.STRUCTURED_TEXT_PARAMETERS, messages)
+                for word_with_context in words
+                for messages in [openai_text.build_structured_text_messages(word_with_context)]}
+    responses = run_batches(PHASE_TEXT, list(requests.values()), state,
+                            validate=lambda content: openai_text.validate_structured_data(json.loads(content)))
+    return {word_with_context: openai_text.parse_structured_text(word_with_context, responses[request.key])
+            for word_with_context, request in requests.items() if request.key in responses}
+
+
+def batch_dalle_prompts(words_and_definitions: list[tuple[WordWithContext, str]], state: BatchState) -> dict[WordWithContext, str]:
+    requests = {word_with_context: BatchRequest(LlmCache.make_key(openai_image_prompt.DALLE_PROMPT_PARAMETERS, messages),
+                                                openai_image_prompt.DALLE_PROMPT_PARAMETERS, messages)
+                for word_with_context, definition in words_and_definitions
+                for messages in [openai_image_prompt.build_dalle_prompt_messages(word_with_context, definition)]}
+    responses = run_batches(PHASE_IMAGE_PROMPT, list(requests.values()), state, validate=None)
+    return {word_with_context: responses[request.key] for word_with_context, request in requests.items() if request.key in responses}
+
+
+def run_batches(phase: str, requests: list[BatchRequest], state: BatchState, validate: Callable[[str], object] | None) -> dict[str, str]:
+    """
+    Response content by request key. Cached responses are used directly, requests that are part of a batch
+    of an earlier run are taken from that batch, only the remaining requests are submitted.
+    validate raises for invalid responses, they are neither returned nor cached.
+    """
+    cache = llm_cache.get_llm_cache()
+    responses: dict[str, str] = {}
+    pending: dict[str, BatchRequest] = {}
+    for request in requests:
+        cached = cache.get(request.key) if cache is not None else None
+        if cached is not None:
+            responses[request.key] = cached
+        else:
+            pending[request.key] = request
+
+    submitted = [batch for batch in state.submitted_batches(phase) if pending.keys() & set(batch["keys"])]
+    resumed_keys = {key for batch in submitted for key in batch["keys"]}
+    new_requests = [request for key, request in pending.items() if key not in resumed_keys]
+    logging.info(f"Batch phase [{phase}]: [{len(responses)}] cached responses, [{len(pending) - len(new_requests)}] requests in [{len(submitted)}] "
+                 f"batches of an earlier run, [{len(new_requests)}] requests to submit")
+    for start in range(0, len(new_requests), MAX_REQUESTS_PER_BATCH):
+        submitted.append(submit_batch(phase, new_requests[start:start + MAX_REQUESTS_PER_BATCH], state))
+    if not submitted:
+        return responses
+
+    invalid = 0
+    for batch in wait_for_batches([batch["batch_id"] for batch in submitted]):
+        for key, content in read_batch_output(batch):
+            request = pending.get(key)
+            if request is None or key in responses:
+                continue
+            try:
+                if validate is not None:
+                    validate(content)
+            except ValueError as e:
+                invalid += 1
+                logging.warning(f"Invalid response for request [{key}] in batch [{batch.id}]: [{e}]")
+                continue
+            responses[key] = content
+            if cache is not None:
+                cache.put(key, request.parameters["model"], content)
+    missing = len([key for key in pending if key not in responses])
+    logging.info(f"Batch phase [{phase}] completed: [{len(pending) - missing}] responses, [{invalid}] invalid, "
+                 f"[{missing}] requests without valid response are sent without batch")
+    return responses
+
+
+def submit_batch(phase: str, requests: list[BatchRequest], state: BatchState) -> dict:
+    client = clients.get_openai_client()
+    content = "\n".join(request.to_jsonl_line() for request in requests).encode("utf-8")
+    # an upload that is repeated after a network error leaves an unused file, a repeated batch would be paid twice
+    input_file = retries.call_with_retries(RETRY_PROVIDER, lambda: client.files.create(file=(f"anki-cards-{phase}.jsonl", content), purpose="batch"))
+    batch = client.batches.create(input_file_id=input_file.id, endpoint=BATCH_ENDPOINT, completion_window=COMPLETION_WINDOW,
+                                  metadata={"phase": phase})
+    keys = [request.key for request in requests]
+    state.add(phase, batch.id, keys)
+    logging.info(f"Batch [{batch.id}] with [{len(requests)}] requests submitted for phase [{phase}]")
+    return {"batch_id": batch.id, "keys": keys}
+
+
+def wait_for_batches(batch_ids: list[str]) -> list:
+    """Poll the batches until all of them are finished. Interrupting is safe, the next run continues polling."""
+    client = clients.get_openai_client()
+    finished = {}
+    while True:
+        for batch_id in batch_ids:
+            if batch_id in finished:
+                continue
+            batch = retries.call_with_retries(RETRY_PROVIDER, lambda: client.batches.retrieve(batch_id))
+            counts = batch.request_counts
+            progress = f"[{counts.completed + counts.failed}/{counts.total}]" if counts is not None else "[unknown]"
+            logging.info(f"Batch [{batch_id}] is [{batch.status}], {progress} requests processed")
+            if batch.status in FINAL_STATUSES:
+                finished[batch_id] = batch
+        if len(finished) == len(batch_ids):
+            return [finished[batch_id] for batch_id in batch_ids]
+        time.sleep(Config.BATCH_POLL_SECONDS)
+
+
+def read_batch_output(batch) -> list[tuple[str, str]]:
+    """Request key and response content of the successful requests. Expired and cancelled batches have partial output."""
+    if batch.status != "completed":
+        logging.warning(f"Batch [{batch.id}] is [{batch.status}], only its completed requests are used")
+    client = clients.get_openai_client()
+    if batch.error_file_id is not None:
+        for line in retries.call_with_retries(RETRY_PROVIDER, lambda: client.files.content(batch.error_file_id)).text.splitlines():
+            if line.strip():
+                entry = json.loads(line)
+                logging.warning(f"Request [{entry.get('custom_id')}] of batch [{batch.id}] failed: [{entry.get('error') or entry.get('response')}]")
+    if batch.output_file_id is None:
+        return []
+    results = []
+    for line in retries.call_with_retries(RETRY_PROVIDER, lambda: client.files.content(batch.output_file_id)).text.splitlines():
+        if not line.strip():
+            continue
+        entry = json.loads(line)
+        response = entry.get("response") or {}
+        if entry.get("error") is not None or response.get("status_code") != 200:
+            logging.warning(f"Request [{entry.get('custom_id')}] of batch [{batch.id}] failed: [{entry.get('error') or response.get('body')}]")
+            continue
+        prompt_cache_metrics.record_usage(response["body"].get("usage"))
+        results.append((entry["custom_id"], response["body"]["choices"][0]["message"]["content"]))
+    return results
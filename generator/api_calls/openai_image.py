@@ -1,22 +1,26 @@
 import logging
-from openai import OpenAI
 
-from ..config import Config
-from ..entities import WordWithContext
+from ..config import ENDPOINT_OPENAI_IMAGE
+from . import clients, rate_limiter
 
-client = OpenAI()
+
+IMAGE_PARAMETERS = {
+    "model": "dall-e-3",
+    "size": "1024x1024",
+    "quality": "standard",
+    "n": 1,
+}
 
 
 def chat_generate_image(prompt: str) -> str:
     logging.debug(f"DALLE image generation prompt [{prompt}]")
 
-    response = client.images.generate(
-        model="dall-e-3",
+    client = clients.get_openai_client()
+    raw_response = rate_limiter.call_with_rate_limit(ENDPOINT_OPENAI_IMAGE, lambda: client.images.with_raw_response.generate(
         prompt=prompt,
-        size="1024x1024",
-        quality="standard",
-        n=1,
-    )
+        **IMAGE_PARAMETERS
+    ))
+    response = raw_response.parse()
 
     image_url = response.data[0].url
     logging.debug(f"DALLE generated image URL: {image_url}")
@@ -1,10 +1,9 @@
 import logging
-from openai import OpenAI
 
-from ..config import Config
+from ..cache import llm_cache
+from ..config import ENDPOINT_OPENAI_CHAT
 from ..entities import WordWithContext
-
-client = OpenAI()
+from . import clients, prompt_cache_metrics, rate_limiter
 
 anki_prompt_preamble = """I want you to act like a professional Anki card maker, able to create DALLE 3 prompts for the words I provide.
 Each image prompt should be detailed and specific to ensure that the resulting image accurately represents the concept or item you need to portray. 
@@ -50,31 +49,44 @@ Bad example: A wise owl perched on a tree branch, with a serene forest backgroun
 """
 
 
+# Model parameters of the image prompt generation
+DALLE_PROMPT_PARAMETERS = {
+    "model": "gpt-4o",
+    "temperature": 0.2,
+    "max_tokens": 256,
+    "n": 1,
+    "presence_penalty": 0,
+    "frequency_penalty": 0.1,
+}
+
+
 def chat_generate_dalle_prompt(word_with_context: WordWithContext, card_text) -> str:
     logging.info(f"DALLE prompt generation: processing word [{word_with_context.word}]")
     logging.debug(f"DALLE prompt generation: processing card text [{card_text}]")
 
-    messages = [
-        {"role": "system", "content": f"{anki_prompt_preamble}"},
-        {"role": "user", "content": f"WORD: [{word_with_context.word}]; CARD TEXT: [{card_text}]"},
-    ]
-    client = OpenAI(
-        api_key=Config.OPENAI_API_KEY
-    )
+    messages = build_dalle_prompt_messages(word_with_context, card_text)
+    client = clients.get_openai_client()
 
     logging.debug(f"DALLE prompt generation messages {messages}")
-    response = client.chat.completions.create(
-        # input prompt
-        messages=messages,
-        # model parameters
-        model="gpt-4o",
-        temperature=0.2,
-        max_tokens=256,
-        n=1,
-        presence_penalty=0,
-        frequency_penalty=0.1,
-    )
-
-    generated_text = response.choices[0].message.content
+
+    def request() -> str:
+        estimated_tokens = rate_limiter.estimate_chat_tokens(messages, DALLE_PROMPT_PARAMETERS["max_tokens"])
+        raw_response = rate_limiter.call_with_rate_limit(ENDPOINT_OPENAI_CHAT, lambda: client.chat.completions.with_raw_response.create(
+            messages=messages,
+            **DALLE_PROMPT_PARAMETERS
+        ), estimated_tokens)
+        response = raw_response.parse()
+        rate_limiter.get_limiter(ENDPOINT_OPENAI_CHAT).record_token_usage(estimated_tokens, response.usage.total_tokens if response.usage else None)
+        prompt_cache_metrics.record_usage(response.usage)
+        return response.choices[0].message.content
+
+    generated_text = llm_cache.cached_completion(DALLE_PROMPT_PARAMETERS, messages, request)
     logging.info(f"Generated DALLE prompt: {generated_text}")
     return generated_text
+
+
+def build_dalle_prompt_messages(word_with_context: WordWithContext, card_text) -> list[dict]:
+    return [
+        {"role": "system", "content": f"{anki_prompt_preamble}"},
+        {"role": "user", "content": f"WORD: [{word_with_context.word}]; CARD TEXT: [{card_text}]"},
+    ]
@@ -1,13 +1,13 @@
 import json
 import logging
-from openai import OpenAI
 
-from ..config import Config
+from ..cache import llm_cache
+from ..config import Config, ENDPOINT_OPENAI_CHAT
 from ..entities import WordWithContext
+from . import clients, prompt_cache_metrics, rate_limiter
 from .text_prompt_by_language import prompt_by_language
 
 
-
 def chat_generate_text(word_with_context: WordWithContext) -> str:
     logging.info(f"ChatGPT card text: processing word [{word_with_context.word}] with context [{word_with_context.context}] in language [{Config.LANGUAGE}]")
 
@@ -18,23 +18,26 @@ def chat_generate_text(word_with_context: WordWithContext) -> str:
         {"role": "user", "content": f"WORD: [{word_with_context.word}]; CONTEXT: [{word_with_context.context}]"},
     ]
 
-    client = OpenAI(
-        api_key=Config.OPENAI_API_KEY
-    )
+    client = clients.get_openai_client()
 
     logging.debug(f"ChatGPT card generation messages {messages}")
 
-    response = client.chat.completions.create(
+    max_tokens = 512
+    estimated_tokens = rate_limiter.estimate_chat_tokens(messages, max_tokens)
+    raw_response = rate_limiter.call_with_rate_limit(ENDPOINT_OPENAI_CHAT, lambda: client.chat.completions.with_raw_response.create(
         # input prompt
         messages=messages,
         # model parameters
         model="gpt-4o",
         temperature=0.2,  # keep low for conservative answers
-        max_tokens=512,
+        max_tokens=max_tokens,
         n=1,
         presence_penalty=0,
         frequency_penalty=0.1,
-    )
+    ), estimated_tokens)
+    response = raw_response.parse()
+    rate_limiter.get_limiter(ENDPOINT_OPENAI_CHAT).record_token_usage(estimated_tokens, response.usage.total_tokens if response.usage else None)
+    prompt_cache_metrics.record_usage(response.usage)
 
     generated_text = response.choices[0].message.content
     logging.debug(f"ChatGPT generated card text for word {word_with_context.word}")
@@ -42,6 +45,18 @@ def chat_generate_text(word_with_context: WordWithContext) -> str:
     return generated_text
 
 
+# Model parameters of the structured card generation
+STRUCTURED_TEXT_PARAMETERS = {
+    "model": "gpt-4o",
+    "temperature": 0.2,
+    "max_tokens": 512,
+    "n": 1,
+    "presence_penalty": 0,
+    "frequency_penalty": 0.1,
+    "response_format": {"type": "json_object"},  # Enable structured JSON output
+}
+
+
 def chat_generate_structured_text(word_with_context: WordWithContext) -> dict:
     """
     Generate structured vocabulary card data using OpenAI with JSON output.
@@ -49,66 +64,135 @@ def chat_generate_structured_text(word_with_context: WordWithContext) -> dict:
     """
     logging.info(f"ChatGPT structured card generation: processing word [{word_with_context.word}] with context [{word_with_context.context}] in language [{Config.LANGUAGE}]")
 
-    system_prompt = prompt_by_language.get_system_prompt_by_language()
+    messages = build_structured_text_messages(word_with_context)
 
-    messages = [
+    client = clients.get_openai_client()
+
+    logging.debug(f"ChatGPT structured card generation messages: {messages}")
+
+    def request() -> str:
+        estimated_tokens = rate_limiter.estimate_chat_tokens(messages, STRUCTURED_TEXT_PARAMETERS["max_tokens"])
+        raw_response = rate_limiter.call_with_rate_limit(ENDPOINT_OPENAI_CHAT, lambda: client.chat.completions.with_raw_response.create(
+            messages=messages,
+            **STRUCTURED_TEXT_PARAMETERS
+        ), estimated_tokens)
+        response = raw_response.parse()
+        rate_limiter.get_limiter(ENDPOINT_OPENAI_CHAT).record_token_usage(estimated_tokens, response.usage.total_tokens if response.usage else None)
+        prompt_cache_metrics.record_usage(response.usage)
+        generated_text = response.choices[0].message.content
+        # invalid responses must not be cached
+        parse_structured_text(word_with_context, generated_text)
+        return generated_text
+
+    generated_text = llm_cache.cached_completion(STRUCTURED_TEXT_PARAMETERS, messages, request)
+    return parse_structured_text(word_with_context, generated_text)
+
+
+def chat_generate_structured_texts_packed(words: list[WordWithContext]) -> dict[WordWithContext, dict]:
+    """
+    Generate the structured card data of several words with one request, the system prompt is sent once for all of them.
+    Each card is validated separately. Words without valid card are missing in the result and should be generated one by one.
+    """
+    cache = llm_cache.get_llm_cache()
+    structured_texts: dict[WordWithContext, dict] = {}
+    for word_with_context in words:
+        # cards are cached per word, so packed and single requests reuse each other's responses
+        cached = cache.get(single_word_cache_key(word_with_context)) if cache is not None else None
+        if cached is not None:
+            structured_texts[word_with_context] = parse_structured_text(word_with_context, cached)
+    # cards are matched by word, a word with several contexts is packed once and the others are generated one by one
+    packed_words: dict[str, WordWithContext] = {}
+    for word_with_context in words:
+        if word_with_context not in structured_texts:
+            packed_words.setdefault(normalize_packed_word(word_with_context.word), word_with_context)
+    words_to_generate = list(packed_words.values())
+    if not words_to_generate:
+        return structured_texts
+
+    logging.info(f"ChatGPT packed structured card generation: processing words {[word.word for word in words_to_generate]} in language [{Config.LANGUAGE}]")
+    messages = build_packed_structured_text_messages(words_to_generate)
+    parameters = {**STRUCTURED_TEXT_PARAMETERS, "max_tokens": STRUCTURED_TEXT_PARAMETERS["max_tokens"] * len(words_to_generate)}
+    client = clients.get_openai_client()
+
+    estimated_tokens = rate_limiter.estimate_chat_tokens(messages, parameters["max_tokens"])
+    raw_response = rate_limiter.call_with_rate_limit(ENDPOINT_OPENAI_CHAT, lambda: client.chat.completions.with_raw_response.create(
+        messages=messages,
+        **parameters
+    ), estimated_tokens)
+    response = raw_response.parse()
+    rate_limiter.get_limiter(ENDPOINT_OPENAI_CHAT).record_token_usage(estimated_tokens, response.usage.total_tokens if response.usage else None)
+    prompt_cache_metrics.record_usage(response.usage)
+
+    cards_by_word = packed_cards_by_word(response.choices[0].message.content)
+    for word_with_context in words_to_generate:
+        card = cards_by_word.get(normalize_packed_word(word_with_context.word))
+        if card is None:
+            logging.warning(f"Packed response has no card for word [{word_with_context.word}]")
+            continue
+        # cached as generated, validation adds missing optional fields
+        generated_text = json.dumps(card, ensure_ascii=False)
+        try:
+            structured_texts[word_with_context] = validate_structured_data(card)
+        except ValueError as e:
+            logging.warning(f"Packed card for word [{word_with_context.word}] is invalid: [{e}]")
+            continue
+        if cache is not None:
+            cache.put(single_word_cache_key(word_with_context), parameters["model"], generated_text)
+    logging.info(f"Packed request created [{len(structured_texts)}/{len(words)}] cards")
+    return structured_texts
+
+
+def build_packed_structured_text_messages(words: list[WordWithContext]) -> list[dict]:
+    system_prompt = prompt_by_language.get_system_prompt_by_language()
+    word_lines = "\n".join(f"WORD: [{word_with_context.word}]; CONTEXT: [{word_with_context.context}]" for word_with_context in words)
+    return [
         {"role": "system", "content": f"{system_prompt}"},
-        {"role": "user", "content": f"WORD: [{word_with_context.word}]; CONTEXT: [{word_with_context.context}]"},
+        {"role": "user", "content": f"Create one card for each of the following {len(words)} words. "
+                                    f'Return a JSON object {{"cards": [...]}} with one element per word in the same order. '
+                                    f'Each element has the field "word" with the word exactly as given and all fields of the JSON structure above.\n'
+                                    f"{word_lines}"},
     ]
 
-    client = OpenAI(
-        api_key=Config.OPENAI_API_KEY
-    )
 
-    logging.debug(f"ChatGPT structured card generation messages: {messages}")
+def packed_cards_by_word(generated_text: str) -> dict[str, dict]:
+    logging.debug(f"ChatGPT raw packed JSON response: {generated_text}")
+    try:
+        cards = json.loads(generated_text).get("cards")
+    except (ValueError, AttributeError) as e:
+        logging.warning(f"Packed response is not a JSON object: [{e}]")
+        return {}
+    if not isinstance(cards, list):
+        logging.warning("Packed response has no list of cards")
+        return {}
+    cards_by_word = {}
+    for card in cards:
+        if isinstance(card, dict) and isinstance(card.get("word"), str):
+            cards_by_word[normalize_packed_word(card.pop("word"))] = card
+    return cards_by_word
 
-    response = client.chat.completions.create(
-        messages=messages,
-        model="gpt-4o",
-        temperature=0.2,
-        max_tokens=512,
-        n=1,
-        presence_penalty=0,
-        frequency_penalty=0.1,
-        response_format={"type": "json_object"}  # Enable structured JSON output
-    )
 
-    generated_text = response.choices[0].message.content
+def normalize_packed_word(word: str) -> str:
+    return " ".join(word.split()).lower()
+
+
+def single_word_cache_key(word_with_context: WordWithContext) -> str:
+    return llm_cache.LlmCache.make_key(STRUCTURED_TEXT_PARAMETERS, build_structured_text_messages(word_with_context))
+
+
+def build_structured_text_messages(word_with_context: WordWithContext) -> list[dict]:
+    system_prompt = prompt_by_language.get_system_prompt_by_language()
+    return [
+        {"role": "system", "content": f"{system_prompt}"},
+        {"role": "user", "content": f"WORD: [{word_with_context.word}]; CONTEXT: [{word_with_context.context}]"},
+    ]
+
+
+def parse_structured_text(word_with_context: WordWithContext, generated_text: str) -> dict:
     logging.debug(f"ChatGPT raw JSON response: {generated_text}")
 
     # Parse JSON response
     try:
-        structured_data = json.loads(generated_text)
-
-        # Validate required fields
-        required_fields = ["definition", "russian_translation", "context_sentences", "notes"]
-        for field in required_fields:
-            if field not in structured_data:
-                raise ValueError(f"Missing required field: {field}")
-
-        if not isinstance(structured_data["context_sentences"], list):
-            raise ValueError("context_sentences must be a list")
-
-        if len(structured_data["context_sentences"]) < 2:
-            raise ValueError("At least 2 context sentences required")
-
-        # Ensure russian_speaker_tips exists (can be null)
-        if "russian_speaker_tips" not in structured_data:
-            structured_data["russian_speaker_tips"] = None
-
-        # Handle cloze_sentences if present (optional field)
-        if "cloze_sentences" in structured_data:
-            if not isinstance(structured_data["cloze_sentences"], list):
-                raise ValueError("cloze_sentences must be a list")
-            # Validate each cloze sentence has required fields
-            for i, cloze in enumerate(structured_data["cloze_sentences"]):
-                if not isinstance(cloze, dict):
-                    raise ValueError(f"cloze_sentences[{i}] must be an object")
-                if "sentence" not in cloze or "hint" not in cloze:
-                    raise ValueError(f"cloze_sentences[{i}] must have 'sentence' and 'hint' fields")
-        else:
-            structured_data["cloze_sentences"] = None
-
+        structured_data = validate_structured_data(json.loads(generated_text))
         logging.info(f"Successfully generated structured card for word [{word_with_context.word}]")
         return structured_data
 
@@ -119,3 +203,38 @@ def chat_generate_structured_text(word_with_context: WordWithContext) -> dict:
     except ValueError as e:
         logging.error(f"Validation error for word [{word_with_context.word}]: {e}")
         raise
+
+
+def validate_structured_data(structured_data: dict) -> dict:
+    if not isinstance(structured_data, dict):
+        raise ValueError("Structured card data must be an object")
+
+    # Validate required fields
+    required_fields = ["definition", "russian_translation", "context_sentences", "notes"]
+    for field in required_fields:
+        if field not in structured_data:
+            raise ValueError(f"Missing required field: {field}")
+
+    if not isinstance(structured_data["context_sentences"], list):
+        raise ValueError("context_sentences must be a list")
+
+    if len(structured_data["context_sentences"]) < 2:
+        raise ValueError("At least 2 context sentences required")
+
+    # Ensure russian_speaker_tips exists (can be null)
+    if "russian_speaker_tips" not in structured_data:
+        structured_data["russian_speaker_tips"] = None
+
+    # Handle cloze_sentences if present (optional field)
+    if "cloze_sentences" in structured_data:
+        if not isinstance(structured_data["cloze_sentences"], list):
+            raise ValueError("cloze_sentences must be a list")
+        # Validate each cloze sentence has required fields
+        for i, cloze in enumerate(structured_data["cloze_sentences"]):
+            if not isinstance(cloze, dict):
+                raise ValueError(f"cloze_sentences[{i}] must be an object")
+            if "sentence" not in cloze or "hint" not in cloze:
+                raise ValueError(f"cloze_sentences[{i}] must have 'sentence' and 'hint' fields")
+    else:
+        structured_data["cloze_sentences"] = None
+    return structured_data
@@ -0,0 +1,54 @@
+import logging
+import threading
+
+
+class PromptCacheMetrics:
+    """
+    Prompt tokens of the chat completions and the part of them that was served from the prompt cache of the provider.
+    Cached prompt tokens are cheaper and faster, the share shows whether the prompts keep a stable prefix.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self._lock = threading.Lock()
+
+    def record(self, usage):
+        """usage of a chat completion, the response object or the dictionary of a batch result."""
+        if usage is None:
+            return
+        prompt_tokens = _field(usage, "prompt_tokens") or 0
+        cached_tokens = _field(_field(usage, "prompt_tokens_details"), "cached_tokens") or 0
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += prompt_tokens
+            self.cached_tokens += cached_tokens
+        logging.debug(f"Chat completion used [{prompt_tokens}] prompt tokens, [{cached_tokens}] of them cached")
+
+    def log_statistics(self):
+        if self.requests == 0:
+            return
+        share = self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0
+        logging.info(f"Provider prompt cache: [{self.cached_tokens}] of [{self.prompt_tokens}] prompt tokens cached in [{self.requests}] requests, "
+                     f"cached share [{share:.0%}]")
+
+
+def _field(value, name: str):
+    # older SDK versions do not model prompt_tokens_details, it is kept as an extra field of the response
+    if value is None:
+        return None
+    if isinstance(value, dict):
+        return value.get(name)
+    return getattr(value, name, None)
+
+
+_prompt_cache_metrics = PromptCacheMetrics()
+
+
+def get_prompt_cache_metrics() -> PromptCacheMetrics:
+    return _prompt_cache_metrics
+
+
+def record_usage(usage):
+    _prompt_cache_metrics.record(usage)
@@ -0,0 +1,252 @@
+import asyncio
+import logging
+import re
+import threading
+import time
+from typing import Awaitable, Callable, TypeVar
+
+from ..config import Config
+from . import retries
+from .retries import error_status_and_headers
+
+T = TypeVar("T")
+
+MAX_RATE_LIMITED_RETRIES = 5
+# after a 429 the rate is reduced by this factor, every successful call restores a small part of it
+RATE_DECREASE_FACTOR = 0.5
+RATE_RECOVERY_FACTOR = 1.05
+DEFAULT_RETRY_AFTER_SECONDS = 10.0
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+class TokenBucket:
+    """
+    Refills continuously with rate_per_minute units. Reservations may take the bucket below zero,
+    the caller then waits until the debt is refilled. This keeps the order of callers and works for threads and coroutines.
+    """
+
+    def __init__(self, rate_per_minute: float):
+        self.rate_per_minute = rate_per_minute
+        self.capacity = rate_per_minute
+        self.available = rate_per_minute
+        self.updated_at = time.monotonic()
+
+    def refill(self, now: float):
+        elapsed = now - self.updated_at
+        self.available = min(self.capacity, self.available + elapsed * self.rate_per_minute / 60)
+        self.updated_at = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        self.refill(now)
+        self.available -= amount
+        if self.available >= 0:
+            return 0.0
+        return -self.available * 60 / self.rate_per_minute
+
+    def set_rate(self, rate_per_minute: float, now: float):
+        self.refill(now)
+        self.rate_per_minute = max(rate_per_minute, 1.0)
+        self.capacity = self.rate_per_minute
+        self.available = min(self.available, self.capacity)
+
+    def drain_to(self, remaining: float, now: float):
+        self.refill(now)
+        self.available = min(self.available, remaining)
+
+
+class EndpointLimiter:
+    """Requests-per-minute and tokens-per-minute budget of one provider endpoint."""
+
+    def __init__(self, endpoint: str, requests_per_minute: float, tokens_per_minute: float = None, max_requests_per_minute: float = None):
+        self.endpoint = endpoint
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        # upper bound for the rate, the provider limit from headers is used if it is lower or no bound is set
+        self.max_requests_per_minute = max_requests_per_minute
+        self.target_requests_per_minute = requests_per_minute
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def reserve(self, estimated_tokens: int = 0) -> float:
+        with self.lock:
+            now = time.monotonic()
+            wait = max(0.0, self.blocked_until - now)
+            wait = max(wait, self.requests.reserve(1, now))
+            if self.tokens is not None and estimated_tokens > 0:
+                wait = max(wait, self.tokens.reserve(estimated_tokens, now))
+            return wait
+
+    def acquire(self, estimated_tokens: int = 0):
+        wait = self.reserve(estimated_tokens)
+        if wait > 0:
+            logging.debug(f"Rate limiter [{self.endpoint}]: waiting [{wait:.2f}] seconds")
+            time.sleep(wait)
+
+    async def acquire_async(self, estimated_tokens: int = 0):
+        wait = self.reserve(estimated_tokens)
+        if wait > 0:
+            logging.debug(f"Rate limiter [{self.endpoint}]: waiting [{wait:.2f}] seconds")
+            await asyncio.sleep(wait)
+
+    def record_token_usage(self, estimated_tokens: int, actual_tokens: int):
+        if self.tokens is None or actual_tokens is None:
+            return
+        with self.lock:
+            # correct the estimate made before the call
+            self.tokens.available -= actual_tokens - estimated_tokens
+
+    def update_from_headers(self, headers):
+        limit_requests = _header_float(headers, "x-ratelimit-limit-requests")
+        remaining_requests = _header_float(headers, "x-ratelimit-remaining-requests")
+        reset_requests = parse_duration(headers.get("x-ratelimit-reset-requests"))
+        limit_tokens = _header_float(headers, "x-ratelimit-limit-tokens")
+        remaining_tokens = _header_float(headers, "x-ratelimit-remaining-tokens")
+        reset_tokens = parse_duration(headers.get("x-ratelimit-reset-tokens"))
+
+        with self.lock:
+            now = time.monotonic()
+            if limit_requests:
+                target = limit_requests if self.max_requests_per_minute is None else min(limit_requests, self.max_requests_per_minute)
+                if target != self.target_requests_per_minute:
+                    logging.info(f"Rate limiter [{self.endpoint}]: provider allows [{limit_requests:g}] requests, using [{target:g}] RPM")
+                    self.target_requests_per_minute = target
+                    self.requests.set_rate(target, now)
+            if remaining_requests is not None:
+                self.requests.drain_to(remaining_requests, now)
+                if remaining_requests == 0 and reset_requests:
+                    self.blocked_until = max(self.blocked_until, now + reset_requests)
+            if self.tokens is not None:
+                if limit_tokens and limit_tokens != self.tokens.rate_per_minute:
+                    self.tokens.set_rate(limit_tokens, now)
+                if remaining_tokens is not None:
+                    self.tokens.drain_to(remaining_tokens, now)
+                    if remaining_tokens == 0 and reset_tokens:
+                        self.blocked_until = max(self.blocked_until, now + reset_tokens)
+
+    def on_success(self):
+        with self.lock:
+            if self.requests.rate_per_minute < self.target_requests_per_minute:
+                restored = min(self.target_requests_per_minute, self.requests.rate_per_minute * RATE_RECOVERY_FACTOR)
+                self.requests.set_rate(restored, time.monotonic())
+
+    def on_rate_limited(self, retry_after_seconds: float):
+        with self.lock:
+            now = time.monotonic()
+            self.blocked_until = max(self.blocked_until, now + retry_after_seconds)
+            self.requests.set_rate(self.requests.rate_per_minute * RATE_DECREASE_FACTOR, now)
+            self.requests.drain_to(0, now)
+            logging.warning(f"Rate limiter [{self.endpoint}]: rate limited by provider, pausing [{retry_after_seconds:.1f}] seconds "
+                            f"and reducing rate to [{self.requests.rate_per_minute:.1f}] RPM")
+
+
+_limiters: dict[str, EndpointLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(endpoint: str) -> EndpointLimiter:
+    with _limiters_lock:
+        limiter = _limiters.get(endpoint)
+        if limiter is None:
+            requests_per_minute, tokens_per_minute = Config.RATE_LIMITS[endpoint]
+            explicit = endpoint in Config.CUSTOM_RATE_LIMITS
+            limiter = EndpointLimiter(endpoint, requests_per_minute, tokens_per_minute,
+                                      max_requests_per_minute=requests_per_minute if explicit else None)
+            _limiters[endpoint] = limiter
+        return limiter
+
+
+def call_with_rate_limit(endpoint: str, call: Callable[[], T], estimated_tokens: int = 0) -> T:
+    """
+    Wait for the endpoint budget, perform the call and adapt the budget to the rate limit headers of the response.
+    On HTTP 429 the endpoint is paused for the time requested by the provider and the call is repeated.
+    Network errors and server errors are retried with backoff, each endpoint has its own circuit breaker.
+    """
+    return retries.call_with_retries(endpoint, lambda: _call_within_budget(endpoint, call, estimated_tokens))
+
+
+async def call_with_rate_limit_async(endpoint: str, call: Callable[[], Awaitable[T]], estimated_tokens: int = 0) -> T:
+    """Same as call_with_rate_limit, but waits without blocking the event loop."""
+    return await retries.call_with_retries_async(endpoint, lambda: _call_within_budget_async(endpoint, call, estimated_tokens))
+
+
+def _call_within_budget(endpoint: str, call: Callable[[], T], estimated_tokens: int) -> T:
+    limiter = get_limiter(endpoint)
+    attempt = 0
+    while True:
+        limiter.acquire(estimated_tokens)
+        try:
+            response = call()
+        except Exception as e:
+            status_code, headers = error_status_and_headers(e)
+            if status_code != 429 or attempt >= MAX_RATE_LIMITED_RETRIES:
+                raise
+            attempt += 1
+            limiter.on_rate_limited(retry_after_seconds(headers))
+            continue
+        headers = getattr(response, "headers", None)
+        if headers is not None:
+            limiter.update_from_headers(headers)
+        limiter.on_success()
+        return response
+
+
+async def _call_within_budget_async(endpoint: str, call: Callable[[], Awaitable[T]], estimated_tokens: int) -> T:
+    limiter = get_limiter(endpoint)
+    attempt = 0
+    while True:
+        await limiter.acquire_async(estimated_tokens)
+        try:
+            response = await call()
+        except Exception as e:
+            status_code, headers = error_status_and_headers(e)
+            if status_code != 429 or attempt >= MAX_RATE_LIMITED_RETRIES:
+                raise
+            attempt += 1
+            limiter.on_rate_limited(retry_after_seconds(headers))
+            continue
+        headers = getattr(response, "headers", None)
+        if headers is not None:
+            limiter.update_from_headers(headers)
+        limiter.on_success()
+        return response
+
+
+def estimate_chat_tokens(messages: list[dict], max_tokens: int) -> int:
+    # roughly four characters per token, the completion budget is reserved completely
+    return sum(len(message["content"]) for message in messages) // 4 + max_tokens
+
+
+def retry_after_seconds(headers) -> float:
+    retry_after = retries.retry_after_header_seconds(headers)
+    if retry_after is not None:
+        return retry_after
+    resets = [parse_duration(headers.get(name)) for name in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens")]
+    resets = [reset for reset in resets if reset]
+    if resets:
+        return max(resets)
+    return DEFAULT_RETRY_AFTER_SECONDS
+
+
+def parse_duration(value: str) -> float | None:
+    """Parse durations like '1s', '6m0s' or '20ms' used by the OpenAI rate limit headers."""
+    if not value:
+        return None
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def _header_float(headers, name: str) -> float | None:
+    value = headers.get(name) if headers else None
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
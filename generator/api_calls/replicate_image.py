@@ -1,18 +1,14 @@
 import logging
 
-import replicate
-from openai import OpenAI
-
-from ..config import Config
+from ..config import Config, ENDPOINT_REPLICATE
 from ..entities import WordWithContext
-
-client = OpenAI()
+from . import clients, rate_limiter
 
 
 def replicate_generate_image(prompt: str) -> str:
     logging.debug(f"Replicate image generation prompt [{prompt}]")
 
-    replicate_client = replicate.Client(api_token=Config.REPLICATE_API_KEY)
+    replicate_client = clients.get_replicate_client()
 
     input = {
         "prompt": prompt
@@ -20,10 +16,10 @@ def replicate_generate_image(prompt: str) -> str:
 
     logging.info("Using Replicate model for image generation: " + Config.REPLICATE_MODEL_URL)
 
-    output = replicate_client.run(
+    output = rate_limiter.call_with_rate_limit(ENDPOINT_REPLICATE, lambda: replicate_client.run(
         Config.REPLICATE_MODEL_URL,
         input=input
-    )
+    ))
 
     print(output)
 
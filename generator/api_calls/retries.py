@@ -0,0 +1,297 @@
+import asyncio
+import email.utils
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from typing import Awaitable, Callable, TypeVar
+from urllib.parse import urlparse
+
+from ..config import Config, ENDPOINT_OPENAI_IMAGE, ENDPOINT_REPLICATE
+
+T = TypeVar("T")
+
+# 429 is not listed, rate limits are handled by the rate limiter
+RETRYABLE_STATUS_CODES = {408, 409, 500, 502, 503, 504}
+# network errors of the OpenAI SDK, httpx and requests, matched by name so that the libraries are not imported for it
+RETRYABLE_ERROR_NAMES = {"APIConnectionError", "APITimeoutError", "TransportError", "TimeoutException", "ConnectionError", "Timeout",
+                         "ChunkedEncodingError", "RemoteDisconnected", "TimeoutError", "ConnectionResetError"}
+# a timed out image generation may have run and been billed, these providers are only retried if the request did not reach them
+# or they answered with a server error
+SINGLE_CHARGE_PROVIDERS = {ENDPOINT_OPENAI_IMAGE, ENDPOINT_REPLICATE}
+SERVER_ERROR_STATUS_CODES = {500, 502, 503, 504}
+# the connection failed before the request was sent, also as cause of the connection errors of the OpenAI SDK and requests
+CONNECT_ERROR_NAMES = {"ConnectError", "ConnectTimeout", "NewConnectionError", "ConnectionRefusedError", "NameResolutionError", "gaierror"}
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+RETRY_AFTER_MAX_SECONDS = 300.0
+# consecutive failures of a provider that open its circuit, the pause doubles every time the trial call fails
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_OPEN_SECONDS = 30.0
+CIRCUIT_MAX_OPEN_SECONDS = 300.0
+# how often callers check whether the trial call of a half open circuit is done
+CIRCUIT_TRIAL_POLL_SECONDS = 1.0
+# optional calls (dictionary checks) do not wait for paused providers and retry only briefly, the card is created without them
+OPTIONAL_CALL_MAX_RETRY_SECONDS = 15.0
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """The calls to the provider are paused and the caller can not wait until the pause is over."""
+
+
+class CircuitBreaker:
+    """
+    Pauses the calls to one provider after repeated transient failures, so a provider outage does not burn the retries
+    of every word. Only the callers of this provider wait, the stages that use other providers keep going.
+    After the pause one trial call is let through, it closes the circuit on success and opens it again on failure.
+    """
+
+    def __init__(self, provider: str):
+        self.provider = provider
+        self.state = CIRCUIT_CLOSED
+        self.consecutive_failures = 0
+        self.open_seconds = CIRCUIT_OPEN_SECONDS
+        self.open_until = 0.0
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Seconds to wait before the next attempt, 0 if the call may be made now."""
+        with self.lock:
+            if self.state == CIRCUIT_CLOSED:
+                return 0.0
+            now = time.monotonic()
+            if self.state == CIRCUIT_OPEN:
+                if now < self.open_until:
+                    return self.open_until - now
+                self.state = CIRCUIT_HALF_OPEN
+                self.trial_in_flight = False
+            if self.trial_in_flight:
+                return CIRCUIT_TRIAL_POLL_SECONDS
+            self.trial_in_flight = True
+            logging.info(f"Circuit [{self.provider}]: trial call after the pause")
+            return 0.0
+
+    def wait(self, deadline: float):
+        """Wait until the call may be made, CircuitOpenError if the pause lasts beyond the deadline (time.monotonic)."""
+        while (wait := self.reserve()) > 0:
+            self._check_deadline(wait, deadline)
+            time.sleep(wait)
+
+    async def wait_async(self, deadline: float):
+        while (wait := self.reserve()) > 0:
+            self._check_deadline(wait, deadline)
+            await asyncio.sleep(wait)
+
+    def _check_deadline(self, wait: float, deadline: float):
+        if time.monotonic() + wait > deadline:
+            raise CircuitOpenError(f"Calls to [{self.provider}] are paused for [{wait:.0f}] more seconds")
+
+    def record_success(self):
+        """The provider answered, also if the answer is an error that is not retried."""
+        with self.lock:
+            if self.state != CIRCUIT_CLOSED:
+                logging.info(f"Circuit [{self.provider}]: provider answers again, circuit closed")
+            self.state = CIRCUIT_CLOSED
+            self.consecutive_failures = 0
+            self.open_seconds = CIRCUIT_OPEN_SECONDS
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.consecutive_failures += 1
+            if self.state == CIRCUIT_OPEN:
+                return
+            if self.state == CIRCUIT_HALF_OPEN or self.consecutive_failures >= CIRCUIT_FAILURE_THRESHOLD:
+                if self.state == CIRCUIT_HALF_OPEN:
+                    self.open_seconds = min(self.open_seconds * 2, CIRCUIT_MAX_OPEN_SECONDS)
+                self.state = CIRCUIT_OPEN
+                self.open_until = time.monotonic() + self.open_seconds
+                self.trial_in_flight = False
+                retry_statistics.record_circuit_opened(self.provider)
+                logging.warning(f"Circuit [{self.provider}]: [{self.consecutive_failures}] consecutive failures, "
+                                f"calls to this provider are paused for [{self.open_seconds:.0f}] seconds")
+
+
+class RetryStatistics:
+
+    def __init__(self):
+        self.retries: Counter = Counter()
+        self.circuits_opened: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def record_retry(self, provider: str):
+        with self._lock:
+            self.retries[provider] += 1
+
+    def record_circuit_opened(self, provider: str):
+        with self._lock:
+            self.circuits_opened[provider] += 1
+
+    def log_statistics(self):
+        if not self.retries and not self.circuits_opened:
+            return
+        logging.info(f"Retries: {dict(self.retries)} retried calls, {dict(self.circuits_opened)} paused providers")
+
+
+retry_statistics = RetryStatistics()
+_circuit_breakers: dict[str, CircuitBreaker] = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(provider: str) -> CircuitBreaker:
+    with _circuit_breakers_lock:
+        breaker = _circuit_breakers.get(provider)
+        if breaker is None:
+            breaker = CircuitBreaker(provider)
+            _circuit_breakers[provider] = breaker
+        return breaker
+
+
+def provider_of_url(url: str) -> str:
+    """Dictionaries and image hosts have one circuit per host."""
+    return urlparse(url).hostname or url
+
+
+def call_with_retries(provider: str, call: Callable[[], T], optional: bool = False) -> T:
+    """
+    Perform the call, repeat it with jittered exponential backoff on retryable errors (network errors, timeouts,
+    server errors) at most Config.MAX_RETRIES times and within Config.MAX_RETRY_SECONDS. Other errors are raised at once.
+    An optional call raises CircuitOpenError at once if the provider is paused.
+    """
+    breaker = get_circuit_breaker(provider)
+    started_at = time.monotonic()
+    deadline = started_at + max_retry_seconds(optional)
+    attempt = 0
+    while True:
+        breaker.wait(started_at if optional else deadline)
+        try:
+            result = call()
+        except Exception as e:
+            if not is_retryable(e, provider):
+                breaker.record_success()
+                raise
+            breaker.record_failure()
+            delay = backoff_seconds(attempt + 1, e)
+            if attempt >= Config.MAX_RETRIES or time.monotonic() + delay > deadline:
+                raise
+            attempt += 1
+            retry_statistics.record_retry(provider)
+            logging.warning(f"Call to [{provider}] failed due to [{e}], retry [{attempt}/{Config.MAX_RETRIES}] in [{delay:.1f}] seconds")
+            time.sleep(delay)
+            continue
+        breaker.record_success()
+        return result
+
+
+async def call_with_retries_async(provider: str, call: Callable[[], Awaitable[T]], optional: bool = False) -> T:
+    """Same as call_with_retries, but waits without blocking the event loop."""
+    breaker = get_circuit_breaker(provider)
+    started_at = time.monotonic()
+    deadline = started_at + max_retry_seconds(optional)
+    attempt = 0
+    while True:
+        await breaker.wait_async(started_at if optional else deadline)
+        try:
+            result = await call()
+        except Exception as e:
+            if not is_retryable(e, provider):
+                breaker.record_success()
+                raise
+            breaker.record_failure()
+            delay = backoff_seconds(attempt + 1, e)
+            if attempt >= Config.MAX_RETRIES or time.monotonic() + delay > deadline:
+                raise
+            attempt += 1
+            retry_statistics.record_retry(provider)
+            logging.warning(f"Call to [{provider}] failed due to [{e}], retry [{attempt}/{Config.MAX_RETRIES}] in [{delay:.1f}] seconds")
+            await asyncio.sleep(delay)
+            continue
+        breaker.record_success()
+        return result
+
+
+def max_retry_seconds(optional: bool) -> float:
+    if optional:
+        return min(Config.MAX_RETRY_SECONDS, OPTIONAL_CALL_MAX_RETRY_SECONDS)
+    return Config.MAX_RETRY_SECONDS
+
+
+def is_retryable(error: Exception, provider: str = None) -> bool:
+    if provider in SINGLE_CHARGE_PROVIDERS:
+        return was_not_processed(error)
+    if getattr(error, "retryable", False):
+        return True
+    status_code, _ = error_status_and_headers(error)
+    if isinstance(status_code, int):
+        return status_code in RETRYABLE_STATUS_CODES
+    return any(cls.__name__ in RETRYABLE_ERROR_NAMES for cls in type(error).__mro__)
+
+
+def was_not_processed(error: Exception) -> bool:
+    """
+    The provider answered with a server error or the connection failed before the request was sent.
+    Read timeouts and dropped connections are not included, the provider may have processed the request.
+    """
+    status_code, _ = error_status_and_headers(error)
+    if isinstance(status_code, int):
+        return status_code in SERVER_ERROR_STATUS_CODES
+    return any(cls.__name__ in CONNECT_ERROR_NAMES for cause in error_causes(error) for cls in type(cause).__mro__)
+
+
+def error_causes(error: Exception) -> list[BaseException]:
+    """The error and the errors it wraps, e.g. the httpx.ConnectTimeout of an APITimeoutError or the reason of a urllib3 MaxRetryError."""
+    causes: list[BaseException] = []
+    while error is not None and error not in causes and len(causes) < 10:
+        causes.append(error)
+        reason = getattr(error, "reason", None)
+        if isinstance(reason, BaseException):
+            causes.append(reason)
+        error = error.__cause__ or error.__context__
+    return causes
+
+
+def backoff_seconds(attempt: int, error: Exception) -> float:
+    """Full jitter, so that the workers of a stage do not retry at the same moment. Retry-After of the provider wins."""
+    _, headers = error_status_and_headers(error)
+    retry_after = retry_after_header_seconds(headers)
+    if retry_after is not None:
+        return min(retry_after, RETRY_AFTER_MAX_SECONDS)
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+def error_status_and_headers(error: Exception) -> tuple[int, dict]:
+    response = getattr(error, "response", None)
+    status_code = getattr(error, "status_code", None) or getattr(error, "status", None)
+    if status_code is None and response is not None:
+        status_code = getattr(response, "status_code", None)
+    headers = getattr(response, "headers", None) or {}
+    return status_code, headers
+
+
+def retry_after_header_seconds(headers) -> float | None:
+    """Retry-After in seconds or as HTTP date, and the retry-after-ms header of OpenAI. None if the provider sent none."""
+    if not headers:
+        return None
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms is not None:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if retry_after is None:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
@@ -1,5 +1,3 @@
-from generator.config import Config
-
 anki_prompt_preamble = """You are an English vocabulary teacher creating flashcards for Russian-speaking learners.
 
 IMPORTANT: Output ONLY valid JSON. No markdown, no explanations, just JSON.
@@ -154,8 +152,6 @@ Output:
   "notes": "Phrasal verb. Informal/neutral. Collocations: jot down + notes/ideas/numbers/reminders/thoughts. Similar to 'write down' but emphasizes speed and brevity.",
   "russian_speaker_tips": null
 }
-
-Now process the input and return ONLY the JSON response.
 """
     return examples_preamble
 
@@ -220,27 +216,34 @@ Output:
     {"sentence": "The {{c1::accurate}} translation preserved the original meaning.", "hint": "точный"}
   ]
 }
-
-Now process the input and return ONLY the JSON response.
 """
     return examples_preamble
 
 
-def rule_language_level() -> str:
+def rule_language_level(level: str) -> str:
     return f"""
     Language Level:
-    - A person with the language level [{Config.LEVEL}] should understand the card.
+    - A person with the language level [{level}] should understand the card.
     - Words and constructions that should be familiar to a person at this level.
     - If the language level is set to C1 or C2, use words and constructions of your choice.
     """
 
 
-def get_prompt() -> str:
-    """Get the prompt for card generation without cloze sentences."""
-    return anki_prompt_preamble + rule_language_level() + examples()
+closing_instruction = """
+Now process the input and return ONLY the JSON response.
+"""
+
+
+def get_prompt(level: str) -> str:
+    """
+    Get the prompt for card generation without cloze sentences.
+    The level rule is the only part that depends on the settings, it follows the preamble and examples,
+    so they are a common prefix of all levels for the prompt caching of the provider.
+    """
+    return anki_prompt_preamble + examples() + rule_language_level(level) + closing_instruction
 
 
-def get_prompt_with_cloze() -> str:
+def get_prompt_with_cloze(level: str) -> str:
     """Get the prompt for card generation WITH cloze sentences."""
     base_prompt = """You are an English vocabulary teacher creating flashcards for Russian-speaking learners.
 
@@ -281,4 +284,4 @@ RUSSIAN_SPEAKER_TIPS (include when relevant, otherwise null):
 
 """ + cloze_guidelines
 
-    return base_prompt + rule_language_level() + examples_with_cloze()
+    return base_prompt + examples_with_cloze() + rule_language_level(level) + closing_instruction
@@ -1,5 +1,3 @@
-from generator.config import Config
-
 anki_prompt_preamble = """Ich möchte, dass Sie sich wie ein professioneller Anki-Kartenhersteller verhalten, der in der Lage ist, Anki-Karten aus dem Text zu erstellen, den ich bereitstelle.
 
 Während der Formulierung von Karteninhalten sollten Sie zwei Prinzipien folgen.
@@ -75,14 +73,15 @@ def examples() -> str:
     return examples_preamble + ''.join(anki_examples_strings)
 
 
-def rule_language_level() -> str:
+def rule_language_level(level: str) -> str:
     return f"""
     Sprachniveau:
-    - Eine Person mit Sprachniveau [{Config.LEVEL}] sollte die Karte verstehen. 
+    - Eine Person mit Sprachniveau [{level}] sollte die Karte verstehen. 
     - Wörter und Konstruktionen, die einer Person mit diesem Niveau vertraut sein sollten.
     - Falls die Sprachniveau C1 oder C2 gesetzt wird, verwende Wörter und Konstruktionen deiner Wahl.
     """
 
 
-def get_prompt() -> str:
-    return anki_prompt_preamble + rule_language_level() + examples()
+def get_prompt(level: str) -> str:
+    # the level rule is last, so the static part is a common prefix for the prompt caching of the provider
+    return anki_prompt_preamble + examples() + rule_language_level(level)
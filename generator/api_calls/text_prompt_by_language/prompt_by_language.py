@@ -1,3 +1,4 @@
+import functools
 import logging
 
 from generator.api_calls.text_prompt_by_language import english_prompt_text, german_prompt_text
@@ -5,12 +6,18 @@ from generator.config import Config, ENGLISH, GERMAN
 
 
 def get_system_prompt_by_language():
-    if Config.LANGUAGE == ENGLISH:
-        if Config.INCLUDE_CLOZE:
-            return english_prompt_text.get_prompt_with_cloze()
-        return english_prompt_text.get_prompt()
-    elif Config.LANGUAGE == GERMAN:
-        return german_prompt_text.get_prompt()
+    return build_system_prompt(Config.LANGUAGE, Config.LEVEL, Config.INCLUDE_CLOZE)
+
+
+@functools.lru_cache(maxsize=None)
+def build_system_prompt(language: str, level: str, include_cloze: bool) -> str | None:
+    """The prompt is built once per combination of settings, every request of a run sends the identical string."""
+    if language == ENGLISH:
+        if include_cloze:
+            return english_prompt_text.get_prompt_with_cloze(level)
+        return english_prompt_text.get_prompt(level)
+    elif language == GERMAN:
+        return german_prompt_text.get_prompt(level)
     else:
-        logging.error(f"No text prompt for language [{Config.LANGUAGE}]")
+        logging.error(f"No text prompt for language [{language}]")
         return None
@@ -0,0 +1,77 @@
+import logging
+import os
+import subprocess
+import threading
+import time
+
+from generator.config import Config, AUDIO_FORMAT_MP3, AUDIO_FORMAT_OPUS
+from generator.input.file_operations import atomic_write
+
+FILE_EXTENSIONS = {AUDIO_FORMAT_MP3: ".mp3", AUDIO_FORMAT_OPUS: ".ogg"}
+FFMPEG_CODECS = {AUDIO_FORMAT_MP3: ["-codec:a", "libmp3lame", "-f", "mp3"], AUDIO_FORMAT_OPUS: ["-codec:a", "libopus", "-f", "ogg"]}
+# removes the pauses of the ". word. " speech input at the start, the reversed audio is trimmed for the end
+SILENCE_REMOVAL = "silenceremove=start_periods=1:start_threshold=-50dB:start_silence=0.05"
+# EBU R128 loudness, all pronunciations play at the same volume
+LOUDNESS_NORMALIZATION = "loudnorm=I=-16:TP=-1.5:LRA=11"
+# sample rate of the OpenAI speech, also supported by Opus
+SAMPLE_RATE = 24000
+FFMPEG_TIMEOUT_SECONDS = 30
+
+
+class AudioProcessingStatistics:
+    """Size of the audio files before and after processing and the time spent in ffmpeg."""
+
+    def __init__(self):
+        self.files = 0
+        self.source_bytes = 0
+        self.target_bytes = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, source_bytes: int, target_bytes: int, seconds: float):
+        with self._lock:
+            self.files += 1
+            self.source_bytes += source_bytes
+            self.target_bytes += target_bytes
+            self.seconds += seconds
+
+    def log_statistics(self):
+        if self.files == 0:
+            return
+        logging.info(f"Audio processing: [{self.files}] files, [{self.source_bytes / 1024:.0f}] KB to [{self.target_bytes / 1024:.0f}] KB, "
+                     f"[{self.seconds / self.files:.2f}] seconds per file")
+
+
+audio_processing_statistics = AudioProcessingStatistics()
+
+
+def audio_processing_enabled() -> bool:
+    return Config.PROCESS_AUDIO
+
+
+def process_for_anki(audio_path: str) -> str:
+    """Trim the silence, normalize the loudness and re-encode the speech. Returns the path of the processed audio."""
+    target_path = os.path.splitext(audio_path)[0] + FILE_EXTENSIONS[Config.AUDIO_FORMAT]
+    source_bytes = os.path.getsize(audio_path)
+    started_at = time.perf_counter()
+    with atomic_write(target_path) as file:
+        # ffmpeg writes to stdout, so the processed file replaces the original only when it is complete
+        result = subprocess.run(ffmpeg_command(audio_path), stdout=file, stderr=subprocess.PIPE, timeout=FFMPEG_TIMEOUT_SECONDS)
+        if result.returncode != 0:
+            raise Exception(f"ffmpeg failed to process audio [{audio_path}]: [{result.stderr.decode('utf-8', errors='replace').strip()}]")
+    seconds = time.perf_counter() - started_at
+    target_bytes = os.path.getsize(target_path)
+    audio_processing_statistics.record(source_bytes, target_bytes, seconds)
+    # the original is kept in the audio cache, the processing directory only keeps the audio of the card
+    if target_path != audio_path:
+        os.remove(audio_path)
+    logging.info(f"Audio [{audio_path}] processed to [{target_path}], [{source_bytes / 1024:.0f}] KB to [{target_bytes / 1024:.0f}] KB "
+                 f"in [{seconds:.2f}] seconds")
+    return target_path
+
+
+def ffmpeg_command(audio_path: str) -> list[str]:
+    trim = f"{SILENCE_REMOVAL},areverse,{SILENCE_REMOVAL},areverse"
+    return ["ffmpeg", "-hide_banner", "-loglevel", "error", "-nostdin", "-i", audio_path,
+            "-af", f"{trim},{LOUDNESS_NORMALIZATION}", "-ac", "1", "-ar", str(SAMPLE_RATE),
+            "-b:a", f"{Config.AUDIO_BITRATE_KBPS}k", *FFMPEG_CODECS[Config.AUDIO_FORMAT], "pipe:1"]
@@ -0,0 +1,71 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+import unicodedata
+
+from ..config import Config
+from .blob_store import BlobStore, link_or_copy
+
+KIND_SPEECH = "speech"
+
+
+class AudioCache(BlobStore):
+    """Synthesized pronunciations, they only depend on the word and the speech settings, not on context or deck."""
+
+    def __init__(self, cache_directory: str, max_bytes: int):
+        super().__init__(os.path.join(cache_directory, "audio_cache.sqlite3"), os.path.join(cache_directory, "audio"),
+                         max_bytes, name="Audio cache")
+
+    @staticmethod
+    def speech_key(word: str, model: str, voice: str, audio_format: str) -> str:
+        parts = [KIND_SPEECH, normalize_word(word), model, voice, audio_format]
+        return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def normalize_word(word: str) -> str:
+    # case is kept, it can change the pronunciation (e.g. "Polish" and "polish")
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", word)).strip()
+
+
+_audio_cache: AudioCache = None
+_audio_cache_lock = threading.Lock()
+
+
+def get_audio_cache() -> AudioCache | None:
+    """Process wide audio cache, None if caching is disabled."""
+    global _audio_cache
+    if not Config.USE_CACHE:
+        return None
+    with _audio_cache_lock:
+        if _audio_cache is None:
+            if Config.CACHE_DIRECTORY is None:
+                Config.setup_default_cache_directory()
+            _audio_cache = AudioCache(Config.CACHE_DIRECTORY, max_bytes=Config.AUDIO_CACHE_MAX_MEGABYTES * 1024 * 1024)
+        return _audio_cache
+
+
+def copy_cached_audio(word: str, model: str, voice: str, audio_format: str, target_file_path: str) -> bool:
+    """Link or copy the cached audio of the word to target_file_path. Returns False if the word is not cached."""
+    cache = get_audio_cache()
+    if cache is None:
+        return False
+    path = cache.find([AudioCache.speech_key(word, model, voice, audio_format)])
+    if path is None:
+        return False
+    link_or_copy(path, target_file_path)
+    logging.info(f"Reusing cached audio for word [{word}]")
+    return True
+
+
+def add_audio(file_path: str, word: str, model: str, voice: str, audio_format: str):
+    cache = get_audio_cache()
+    if cache is None:
+        return
+    try:
+        cache.add_file(file_path, {AudioCache.speech_key(word, model, voice, audio_format): KIND_SPEECH},
+                       label=word, details=f"{model}:{voice}:{audio_format}")
+    except OSError as e:
+        # the card is complete without the cache
+        logging.warning(f"Audio [{file_path}] is not added to the audio cache due to [{e}]")
@@ -0,0 +1,163 @@
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from .sqlite_store import SqliteStore
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    extension TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    label TEXT,
+    details TEXT,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS blobs_accessed_at ON blobs (accessed_at);
+CREATE TABLE IF NOT EXISTS blob_keys (
+    key TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    hash TEXT NOT NULL REFERENCES blobs (hash)
+);
+CREATE INDEX IF NOT EXISTS blob_keys_hash ON blob_keys (hash);
+"""
+
+_HASH_CHUNK_BYTES = 1024 * 1024
+
+
+class BlobStore(SqliteStore):
+    """
+    Content addressed file store. Files are saved once under their sha256 in blob_directory,
+    any number of lookup keys point to the same file. The least recently used files are evicted above max_bytes.
+    """
+
+    def __init__(self, database_path: str, blob_directory: str, max_bytes: int, name: str):
+        super().__init__(database_path, SCHEMA)
+        self.blob_directory = blob_directory
+        self.max_bytes = max_bytes
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+        os.makedirs(blob_directory, exist_ok=True)
+
+    def blob_path(self, content_hash: str, extension: str) -> str:
+        return os.path.join(self.blob_directory, content_hash[:2], content_hash + extension)
+
+    def find(self, keys: list[str]) -> str | None:
+        """Path of the file stored under the first known key, None if no key is known."""
+        for key in keys:
+            rows = self.execute("SELECT blobs.hash, blobs.extension FROM blob_keys JOIN blobs ON blobs.hash = blob_keys.hash WHERE blob_keys.key = ?", (key,))
+            if not rows:
+                continue
+            content_hash, extension = rows[0]
+            path = self.blob_path(content_hash, extension)
+            if not os.path.exists(path):
+                # removed by hand or by another process
+                self.remove(content_hash)
+                continue
+            self.execute("UPDATE blobs SET accessed_at = ? WHERE hash = ?", (time.time(), content_hash))
+            self._count(hit=True)
+            return path
+        self._count(hit=False)
+        return None
+
+    def add_file(self, file_path: str, keys: dict[str, str], label: str = None, details: str = None) -> str:
+        """Store a copy of the file under all keys (key -> kind) and return the path of the stored file."""
+        content_hash = file_sha256(file_path)
+        extension = os.path.splitext(file_path)[1]
+        path = self.blob_path(content_hash, extension)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temporary_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            shutil.copyfile(file_path, temporary_path)
+            os.replace(temporary_path, path)
+
+        now = time.time()
+        self.execute("INSERT OR IGNORE INTO blobs (hash, extension, size, label, details, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                     (content_hash, extension, os.path.getsize(path), label, details, now, now))
+        self.execute_many("INSERT OR REPLACE INTO blob_keys (key, kind, hash) VALUES (?, ?, ?)",
+                          [(key, kind, content_hash) for key, kind in keys.items()])
+        logging.debug(f"{self.name}: stored [{file_path}] as [{path}]")
+        self.evict(self.max_bytes)
+        return path
+
+    def remove(self, content_hash: str):
+        rows = self.execute("SELECT extension FROM blobs WHERE hash = ?", (content_hash,))
+        self.execute("DELETE FROM blob_keys WHERE hash = ?", (content_hash,))
+        self.execute("DELETE FROM blobs WHERE hash = ?", (content_hash,))
+        if rows:
+            try:
+                os.remove(self.blob_path(content_hash, rows[0][0]))
+            except FileNotFoundError:
+                pass
+
+    def evict(self, max_bytes: int, older_than_seconds: float = None) -> int:
+        """Remove files not used for older_than_seconds, then the least recently used ones until the store fits in max_bytes."""
+        removed = 0
+        if older_than_seconds is not None:
+            threshold = time.time() - older_than_seconds
+            for (content_hash,) in self.execute("SELECT hash FROM blobs WHERE accessed_at < ?", (threshold,)):
+                self.remove(content_hash)
+                removed += 1
+        total_size = self.total_size()
+        if total_size > max_bytes:
+            for content_hash, size in self.execute("SELECT hash, size FROM blobs ORDER BY accessed_at"):
+                if total_size <= max_bytes:
+                    break
+                self.remove(content_hash)
+                total_size -= size
+                removed += 1
+        if removed:
+            logging.info(f"{self.name}: evicted [{removed}] files")
+        return removed
+
+    def total_size(self) -> int:
+        return self.execute("SELECT COALESCE(SUM(size), 0) FROM blobs")[0][0]
+
+    def list_blobs(self) -> list[tuple]:
+        """(hash, size, label, details, created_at, accessed_at) of all files, most recently used first."""
+        return self.execute("SELECT hash, size, label, details, created_at, accessed_at FROM blobs ORDER BY accessed_at DESC")
+
+    def _count(self, hit: bool):
+        with self._stats_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def log_statistics(self):
+        requests = self.hits + self.misses
+        if requests == 0:
+            return
+        logging.info(f"{self.name}: [{self.hits}] hits, [{self.misses}] misses, hit rate [{self.hits / requests:.0%}]")
+
+
+def file_sha256(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(_HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def link_or_copy(source_path: str, target_path: str):
+    """Hard link the file if source and target are on the same file system, copy it otherwise."""
+    detach_file(target_path)
+    try:
+        os.link(source_path, target_path)
+    except OSError:
+        shutil.copyfile(source_path, target_path)
+
+
+def detach_file(file_path: str):
+    """Remove the file before it is written again, so a hard linked stored file is not overwritten in place."""
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
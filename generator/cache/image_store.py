@@ -0,0 +1,127 @@
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+
+from ..config import Config, OPENAI, REPLICATE
+from ..entities import WordWithContext
+from .blob_store import BlobStore, link_or_copy
+
+KIND_PROMPT = "prompt"
+KIND_CONCEPT = "concept"
+
+
+class ImageStore(BlobStore):
+    """Generated images of all runs and decks, found by normalized image prompt or by word and definition."""
+
+    def __init__(self, cache_directory: str, max_bytes: int):
+        super().__init__(os.path.join(cache_directory, "image_store.sqlite3"), os.path.join(cache_directory, "images"),
+                         max_bytes, name="Image store")
+
+    @staticmethod
+    def prompt_key(generator: str, image_prompt: str) -> str:
+        return _hash(KIND_PROMPT, generator, normalize_text(image_prompt))
+
+    @staticmethod
+    def concept_key(generator: str, language: str, word: str, definition: str) -> str:
+        return _hash(KIND_CONCEPT, generator, language, normalize_text(word), normalize_text(definition))
+
+    def lookup_keys(self, image_prompt: str, word_with_context: WordWithContext = None, definition: str = None) -> dict[str, str]:
+        generator = image_generator()
+        keys = {self.prompt_key(generator, image_prompt): KIND_PROMPT}
+        if word_with_context is not None and definition:
+            keys[self.concept_key(generator, Config.LANGUAGE, word_with_context.word, definition)] = KIND_CONCEPT
+        return keys
+
+    def stored_prompt(self, path: str) -> str | None:
+        """Image prompt the stored image was generated with."""
+        content_hash = os.path.splitext(os.path.basename(path))[0]
+        rows = self.execute("SELECT details FROM blobs WHERE hash = ?", (content_hash,))
+        return rows[0][0] if rows else None
+
+
+def normalize_text(text: str) -> str:
+    text = re.sub(r"\s+", " ", text.lower()).strip()
+    return text.strip(" .,;:!?\"'")
+
+
+def image_generator() -> str:
+    """Identifies the model that creates the images, images of different models are not mixed."""
+    if Config.IMAGE_GENERATION_MODE == OPENAI:
+        from ..api_calls.openai_image import IMAGE_PARAMETERS
+        return f"{OPENAI}:{IMAGE_PARAMETERS['model']}:{IMAGE_PARAMETERS['size']}:{IMAGE_PARAMETERS['quality']}"
+    elif Config.IMAGE_GENERATION_MODE == REPLICATE:
+        return f"{REPLICATE}:{Config.REPLICATE_MODEL_URL}"
+    else:
+        raise Exception(f"Unsupported image generation mode: [{Config.IMAGE_GENERATION_MODE}]")
+
+
+def _hash(*parts: str) -> str:
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+_image_store: ImageStore = None
+_image_store_lock = threading.Lock()
+
+
+def get_image_store() -> ImageStore | None:
+    """Process wide image store, None if caching is disabled."""
+    global _image_store
+    if not Config.USE_CACHE:
+        return None
+    with _image_store_lock:
+        if _image_store is None:
+            if Config.CACHE_DIRECTORY is None:
+                Config.setup_default_cache_directory()
+            _image_store = ImageStore(Config.CACHE_DIRECTORY, max_bytes=Config.IMAGE_STORE_MAX_MEGABYTES * 1024 * 1024)
+        return _image_store
+
+
+def find_image(image_prompt: str) -> str | None:
+    """Path of the stored image for this prompt, None if there is no such image."""
+    store = get_image_store()
+    if store is None:
+        return None
+    path = store.find([store.prompt_key(image_generator(), image_prompt)])
+    if path is not None:
+        logging.info(f"Reusing stored image [{path}] for prompt [{image_prompt}]")
+    return path
+
+
+def find_concept_image(word_with_context: WordWithContext, definition: str) -> tuple[str, str | None] | None:
+    """
+    Path and image prompt of the stored image for the word with this definition, None if there is no such image.
+    It only needs the card text, so it is checked before the image prompt is generated.
+    """
+    store = get_image_store()
+    if store is None or not definition:
+        return None
+    path = store.find([store.concept_key(image_generator(), Config.LANGUAGE, word_with_context.word, definition)])
+    if path is None:
+        return None
+    logging.info(f"Reusing stored image [{path}] for word [{word_with_context.word}] with the same definition")
+    return path, store.stored_prompt(path)
+
+
+def is_stored_image_url(image_url: str) -> bool:
+    """Earlier versions recorded stored images as file:// urls in the generation journal."""
+    return image_url is not None and image_url.startswith("file:")
+
+
+def copy_stored_image(stored_image_path: str, image_path: str):
+    link_or_copy(stored_image_path, image_path)
+    logging.info(f"Stored image copied as {image_path}")
+
+
+def add_image(image_path: str, image_prompt: str, word_with_context: WordWithContext = None, definition: str = None):
+    store = get_image_store()
+    if store is None:
+        return
+    try:
+        store.add_file(image_path, store.lookup_keys(image_prompt, word_with_context, definition),
+                       label=word_with_context.word if word_with_context else None, details=image_prompt)
+    except (OSError, sqlite3.Error) as e:
+        # the card is complete without the store
+        logging.warning(f"Image [{image_path}] is not added to the image store due to [{e}]")
@@ -0,0 +1,202 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Awaitable, Callable
+
+from ..config import Config
+from .sqlite_store import SqliteStore
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_responses (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    response TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS llm_responses_accessed_at ON llm_responses (accessed_at);
+"""
+
+# eviction runs on startup and after this number of new entries
+EVICTION_INTERVAL = 100
+
+
+class LlmCache(SqliteStore):
+    """
+    Persistent cache of chat completions, keyed by a hash of model parameters and messages.
+    Concurrent identical requests are coalesced, only the first one is sent to the API.
+    """
+
+    def __init__(self, database_path: str, max_bytes: int, max_age_days: float):
+        super().__init__(database_path, SCHEMA)
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_days * 24 * 3600
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._stats_lock = threading.Lock()
+        self._in_flight: dict[str, Future] = {}
+        self._in_flight_async: dict[str, asyncio.Future] = {}
+        self._puts_since_eviction = 0
+        self.evict()
+
+    @staticmethod
+    def make_key(parameters: dict, messages: list[dict]) -> str:
+        payload = json.dumps({"parameters": parameters, "messages": messages}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        rows = self.execute("SELECT response, created_at FROM llm_responses WHERE key = ?", (key,))
+        if not rows or now - rows[0][1] > self.max_age_seconds:
+            return None
+        self.execute("UPDATE llm_responses SET accessed_at = ? WHERE key = ?", (now, key))
+        return rows[0][0]
+
+    def put(self, key: str, model: str, response: str):
+        now = time.time()
+        self.execute("INSERT OR REPLACE INTO llm_responses (key, model, response, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                     (key, model, response, len(response.encode("utf-8")), now, now))
+        with self._stats_lock:
+            self._puts_since_eviction += 1
+            evict = self._puts_since_eviction >= EVICTION_INTERVAL
+            if evict:
+                self._puts_since_eviction = 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        expiry_threshold = time.time() - self.max_age_seconds
+        expired = self.execute("SELECT COUNT(*) FROM llm_responses WHERE created_at < ?", (expiry_threshold,))[0][0]
+        self.execute("DELETE FROM llm_responses WHERE created_at < ?", (expiry_threshold,))
+        total_size = self.execute("SELECT COALESCE(SUM(size), 0) FROM llm_responses")[0][0]
+        removed_for_size = 0
+        if total_size > self.max_bytes:
+            # remove least recently used entries until the cache fits
+            for key, size in self.execute("SELECT key, size FROM llm_responses ORDER BY accessed_at"):
+                if total_size <= self.max_bytes:
+                    break
+                self.execute("DELETE FROM llm_responses WHERE key = ?", (key,))
+                total_size -= size
+                removed_for_size += 1
+        if expired or removed_for_size:
+            logging.info(f"LLM cache: evicted [{expired}] expired and [{removed_for_size}] least recently used responses")
+
+    def get_or_compute(self, key: str, model: str, compute: Callable[[], str]) -> str:
+        cached = self.get(key)
+        if cached is not None:
+            self._count(hit=True)
+            return cached
+
+        with self._stats_lock:
+            in_flight = self._in_flight.get(key)
+            owner = in_flight is None
+            if owner:
+                in_flight = Future()
+                self._in_flight[key] = in_flight
+        if not owner:
+            self._count(coalesced=True)
+            return in_flight.result()
+
+        self._count(hit=False)
+        try:
+            response = compute()
+            self.put(key, model, response)
+            in_flight.set_result(response)
+            return response
+        except Exception as e:
+            in_flight.set_exception(e)
+            raise
+        finally:
+            with self._stats_lock:
+                del self._in_flight[key]
+
+    async def get_or_compute_async(self, key: str, model: str, compute: Callable[[], Awaitable[str]]) -> str:
+        cached = self.get(key)
+        if cached is not None:
+            self._count(hit=True)
+            return cached
+
+        in_flight = self._in_flight_async.get(key)
+        if in_flight is not None:
+            self._count(coalesced=True)
+            return await asyncio.shield(in_flight)
+        in_flight = asyncio.get_running_loop().create_future()
+        self._in_flight_async[key] = in_flight
+
+        self._count(hit=False)
+        try:
+            response = await compute()
+            self.put(key, model, response)
+            in_flight.set_result(response)
+            return response
+        except asyncio.CancelledError:
+            in_flight.cancel()
+            raise
+        except Exception as e:
+            in_flight.set_exception(e)
+            # the exception is raised to the caller, waiters retrieve it from the future
+            in_flight.exception()
+            raise
+        finally:
+            del self._in_flight_async[key]
+
+    def _count(self, hit: bool = False, coalesced: bool = False):
+        with self._stats_lock:
+            if coalesced:
+                self.coalesced += 1
+            elif hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def log_statistics(self):
+        requests = self.hits + self.misses + self.coalesced
+        if requests == 0:
+            return
+        logging.info(f"LLM cache: [{self.hits}] hits, [{self.misses}] misses, [{self.coalesced}] coalesced requests, "
+                     f"hit rate [{(self.hits + self.coalesced) / requests:.0%}]")
+
+
+_llm_cache: LlmCache = None
+_llm_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> LlmCache | None:
+    """Process wide LLM cache, None if caching is disabled."""
+    global _llm_cache
+    if not Config.USE_CACHE:
+        return None
+    with _llm_cache_lock:
+        if _llm_cache is None:
+            if Config.CACHE_DIRECTORY is None:
+                Config.setup_default_cache_directory()
+            os.makedirs(Config.CACHE_DIRECTORY, exist_ok=True)
+            _llm_cache = LlmCache(os.path.join(Config.CACHE_DIRECTORY, "llm_cache.sqlite3"),
+                                  max_bytes=Config.LLM_CACHE_MAX_MEGABYTES * 1024 * 1024,
+                                  max_age_days=Config.LLM_CACHE_MAX_AGE_DAYS)
+        return _llm_cache
+
+
+def cached_completion(parameters: dict, messages: list[dict], compute: Callable[[], str]) -> str:
+    """
+    Return the cached response for these parameters and messages or compute it.
+    compute should raise for invalid responses, so they are not cached.
+    """
+    cache = get_llm_cache()
+    if cache is None:
+        return compute()
+    return cache.get_or_compute(LlmCache.make_key(parameters, messages), parameters["model"], compute)
+
+
+async def cached_completion_async(parameters: dict, messages: list[dict], compute: Callable[[], Awaitable[str]]) -> str:
+    cache = get_llm_cache()
+    if cache is None:
+        return await compute()
+    return await cache.get_or_compute_async(LlmCache.make_key(parameters, messages), parameters["model"], compute)
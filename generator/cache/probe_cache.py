@@ -0,0 +1,135 @@
+import logging
+import os
+import threading
+import time
+from typing import Awaitable, Callable
+
+from ..api_calls import retries
+from ..config import Config
+from .sqlite_store import SqliteStore
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dictionary_probes (
+    url TEXT PRIMARY KEY,
+    entry_exists INTEGER NOT NULL,
+    checked_at REAL NOT NULL
+);
+"""
+
+
+class TransientProbeError(Exception):
+    """The dictionary could not be checked right now (network error, timeout, rate limit, server error)."""
+    retryable = True
+
+
+class ProbeCache(SqliteStore):
+    """
+    Results of dictionary page checks of all dictionaries. Existing and missing entries have separate TTLs,
+    missing entries are checked again sooner because dictionaries add new words.
+    """
+
+    def __init__(self, database_path: str, positive_ttl_days: float, negative_ttl_days: float):
+        super().__init__(database_path, SCHEMA)
+        self.positive_ttl_seconds = positive_ttl_days * 24 * 3600
+        self.negative_ttl_seconds = negative_ttl_days * 24 * 3600
+        self.hits = 0
+        self.misses = 0
+        self.transient_errors = 0
+        self._stats_lock = threading.Lock()
+
+    def get(self, url: str) -> bool | None:
+        rows = self.execute("SELECT entry_exists, checked_at FROM dictionary_probes WHERE url = ?", (url,))
+        if rows:
+            entry_exists, checked_at = bool(rows[0][0]), rows[0][1]
+            ttl = self.positive_ttl_seconds if entry_exists else self.negative_ttl_seconds
+            if time.time() - checked_at <= ttl:
+                self._count("hits")
+                return entry_exists
+        self._count("misses")
+        return None
+
+    def put(self, url: str, entry_exists: bool):
+        self.execute("INSERT OR REPLACE INTO dictionary_probes (url, entry_exists, checked_at) VALUES (?, ?, ?)",
+                     (url, int(entry_exists), time.time()))
+
+    def record_transient_error(self):
+        self._count("transient_errors")
+
+    def _count(self, counter: str):
+        with self._stats_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def log_statistics(self):
+        requests = self.hits + self.misses
+        if requests == 0:
+            return
+        logging.info(f"Dictionary probe cache: [{self.hits}] hits, [{self.misses}] misses, "
+                     f"[{self.transient_errors}] transient errors, hit rate [{self.hits / requests:.0%}]")
+
+
+_probe_cache: ProbeCache = None
+_probe_cache_lock = threading.Lock()
+
+
+def get_probe_cache() -> ProbeCache | None:
+    """Process wide dictionary probe cache, None if caching is disabled."""
+    global _probe_cache
+    if not Config.USE_CACHE:
+        return None
+    with _probe_cache_lock:
+        if _probe_cache is None:
+            if Config.CACHE_DIRECTORY is None:
+                Config.setup_default_cache_directory()
+            _probe_cache = ProbeCache(os.path.join(Config.CACHE_DIRECTORY, "dictionary_probes.sqlite3"),
+                                      positive_ttl_days=Config.DICTIONARY_POSITIVE_TTL_DAYS,
+                                      negative_ttl_days=Config.DICTIONARY_NEGATIVE_TTL_DAYS)
+        return _probe_cache
+
+
+def cached_probe(url: str, probe: Callable[[], bool]) -> bool | None:
+    """
+    Whether the dictionary has an entry at url, checked with probe if the result is not cached.
+    probe raises TransientProbeError if the page could not be checked, None is returned and nothing is cached.
+    The card does not wait for a dictionary that is paused after repeated failures, None is returned at once.
+    """
+    cache = get_probe_cache()
+    if cache is not None:
+        entry_exists = cache.get(url)
+        if entry_exists is not None:
+            return entry_exists
+    try:
+        entry_exists = retries.call_with_retries(retries.provider_of_url(url), probe, optional=True)
+    except (TransientProbeError, retries.CircuitOpenError) as e:
+        _transient_error(cache, url, e)
+        return None
+    if cache is not None:
+        cache.put(url, entry_exists)
+    return entry_exists
+
+
+async def cached_probe_async(url: str, probe: Callable[[], Awaitable[bool]]) -> bool | None:
+    cache = get_probe_cache()
+    if cache is not None:
+        entry_exists = cache.get(url)
+        if entry_exists is not None:
+            return entry_exists
+    try:
+        entry_exists = await retries.call_with_retries_async(retries.provider_of_url(url), probe, optional=True)
+    except (TransientProbeError, retries.CircuitOpenError) as e:
+        _transient_error(cache, url, e)
+        return None
+    if cache is not None:
+        cache.put(url, entry_exists)
+    return entry_exists
+
+
+def raise_for_transient_status(status_code: int, url: str):
+    # 404 and redirects are answers of the dictionary, rate limits and server errors are not
+    if status_code == 429 or status_code >= 500:
+        raise TransientProbeError(f"Dictionary page [{url}] returned status [{status_code}]")
+
+
+def _transient_error(cache: ProbeCache | None, url: str, error: Exception):
+    if cache is not None:
+        cache.record_transient_error()
+    logging.warning(f"Dictionary page [{url}] could not be checked, the card is created without dictionary link: [{error}]")
@@ -0,0 +1,41 @@
+import logging
+import os
+import sqlite3
+import threading
+
+
+class SqliteStore:
+    """
+    Thread safe wrapper around one SQLite database file. Several processes can use the same file,
+    WAL mode lets readers work while another process writes.
+    """
+
+    def __init__(self, database_path: str, schema: str):
+        directory = os.path.dirname(database_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.database_path = database_path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(database_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(schema)
+        logging.debug(f"SQLite store opened at [{database_path}]")
+
+    def execute(self, sql: str, parameters=()) -> list[tuple]:
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    def execute_many(self, sql: str, rows: list[tuple]):
+        with self._lock:
+            self._connection.execute("BEGIN")
+            try:
+                self._connection.executemany(sql, rows)
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -1,6 +1,8 @@
 import datetime
+import importlib.util
 import logging
 import os
+import shutil
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -26,11 +28,52 @@ BOTH = "both"                # Generate both card types
 # Cloze card option
 INCLUDE_CLOZE = False        # Generate cloze deletion cards
 
+# Generation pipeline stages
+STAGE_TEXT = "text"
+STAGE_IMAGE_PROMPT = "image_prompt"
+STAGE_IMAGE = "image"
+STAGE_DOWNLOAD = "download"
+STAGE_TRANSCODE = "transcode"
+STAGE_AUDIO = "audio"
+STAGE_AUDIO_PROCESSING = "audio_processing"
+STAGE_DICTIONARY = "dictionary"
+STAGE_CARD = "card"
+
+# Format of the card images, png keeps the downloaded image
+IMAGE_FORMAT_PNG = "png"
+IMAGE_FORMAT_WEBP = "webp"
+IMAGE_FORMAT_JPEG = "jpeg"
+
+# Format of the processed card audio
+AUDIO_FORMAT_MP3 = "mp3"
+AUDIO_FORMAT_OPUS = "opus"
+
+# Policies of the decisions that are asked interactively by default
+POLICY_ASK = "ask"
+POLICY_SKIP = "skip"
+POLICY_REPLACE = "replace"     # delete the existing notes and import the new card
+POLICY_UPDATE = "update"       # update the fields of the existing notes, the review history is kept
+POLICY_ABORT = "abort"
+POLICY_RETRY = "retry"         # generate the failed words again, completed stages are taken from the journal
+POLICY_DELETE = "delete"       # delete the invalid card file and skip the word
+POLICY_REGENERATE = "regenerate"  # delete the invalid card file and generate the card again
+
+# Transfer of media files to Anki
+MEDIA_TRANSFER_LOCAL = "local"                # media directory on this machine
+MEDIA_TRANSFER_ANKI_CONNECT = "anki_connect"  # storeMediaFile, e.g. if Anki runs on another machine
+
+# Rate limited provider endpoints
+ENDPOINT_OPENAI_CHAT = "openai_chat"
+ENDPOINT_OPENAI_IMAGE = "openai_image"
+ENDPOINT_OPENAI_AUDIO = "openai_audio"
+ENDPOINT_REPLICATE = "replicate"
+
 
 class Config:
     OPENAI_API_KEY: str = None
+    # None uses the OpenAI API, another URL e.g. a proxy or a local stand-in server
+    OPENAI_BASE_URL: str = None
 
-    SECONDS_WAIT_BETWEEN_DALLE_CALLS: int = 20
     DECK_NAME: str = None
     ANKI_MEDIA_DIRECTORY: str = None
     PROCESSING_DIRECTORY_PATH: str = None
@@ -62,6 +105,99 @@ class Config:
     INCLUDE_CLOZE: bool = False
     CLOZE_MODEL: str = "Cloze"
 
+    # Number of parallel workers for each generation stage
+    DEFAULT_STAGE_WORKERS: dict[str, int] = {
+        STAGE_TEXT: 4,
+        STAGE_IMAGE_PROMPT: 4,
+        STAGE_IMAGE: 1,
+        STAGE_DOWNLOAD: 4,
+        STAGE_TRANSCODE: 2,
+        STAGE_AUDIO: 4,
+        STAGE_AUDIO_PROCESSING: 2,
+        STAGE_DICTIONARY: 4,
+    }
+    STAGE_WORKERS: dict[str, int] = dict(DEFAULT_STAGE_WORKERS)
+
+    PREWARM_CONNECTIONS: bool = True
+
+    # Images are shown with max-height 300px, 600px are sharp on high density displays
+    SUPPORTED_IMAGE_FORMATS = [IMAGE_FORMAT_PNG, IMAGE_FORMAT_WEBP, IMAGE_FORMAT_JPEG]
+    IMAGE_FORMAT: str = IMAGE_FORMAT_PNG
+    DEFAULT_IMAGE_QUALITY: int = 80
+    IMAGE_QUALITY: int = DEFAULT_IMAGE_QUALITY
+    DEFAULT_IMAGE_MAX_SIZE: int = 600
+    IMAGE_MAX_SIZE: int = DEFAULT_IMAGE_MAX_SIZE
+
+    # Speech is trimmed, normalized and re-encoded with ffmpeg, mono speech needs no high bitrate
+    PROCESS_AUDIO: bool = False
+    SUPPORTED_AUDIO_FORMATS = [AUDIO_FORMAT_MP3, AUDIO_FORMAT_OPUS]
+    AUDIO_FORMAT: str = AUDIO_FORMAT_MP3
+    DEFAULT_AUDIO_BITRATE_KBPS: int = 48
+    AUDIO_BITRATE_KBPS: int = DEFAULT_AUDIO_BITRATE_KBPS
+
+    MEDIA_TRANSFER: str = MEDIA_TRANSFER_LOCAL
+    SUPPORTED_MEDIA_TRANSFERS = [MEDIA_TRANSFER_LOCAL, MEDIA_TRANSFER_ANKI_CONNECT]
+    MEDIA_TRANSFER_WORKERS: int = 8
+
+    # Notes per addNotes request to AnkiConnect
+    DEFAULT_IMPORT_CHUNK_SIZE: int = 100
+    IMPORT_CHUNK_SIZE: int = DEFAULT_IMPORT_CHUNK_SIZE
+
+    # Persistent caches shared by all runs and decks
+    USE_CACHE: bool = True
+    CACHE_DIRECTORY: str = None
+    LLM_CACHE_MAX_MEGABYTES: int = 200
+    LLM_CACHE_MAX_AGE_DAYS: float = 180
+    IMAGE_STORE_MAX_MEGABYTES: int = 2048
+    AUDIO_CACHE_MAX_MEGABYTES: int = 500
+    DICTIONARY_POSITIVE_TTL_DAYS: float = 90
+    DICTIONARY_NEGATIVE_TTL_DAYS: float = 7
+
+    # Requests per minute and tokens per minute (None if not limited) of each endpoint.
+    # The budgets are adjusted to the rate limit headers returned by the provider.
+    DEFAULT_RATE_LIMITS: dict[str, tuple[float, float]] = {
+        ENDPOINT_OPENAI_CHAT: (500, 30000),
+        ENDPOINT_OPENAI_IMAGE: (5, None),
+        ENDPOINT_OPENAI_AUDIO: (50, None),
+        ENDPOINT_REPLICATE: (600, None),
+    }
+    RATE_LIMITS: dict[str, tuple[float, float]] = dict(DEFAULT_RATE_LIMITS)
+    CUSTOM_RATE_LIMITS: dict[str, tuple[float, float]] = {}
+
+    # What happens if a card exists in the deck, generation or import fail or a card file is invalid.
+    # Non-interactive runs never ask, the policies that are not set use the defaults below.
+    SUPPORTED_ON_EXISTING_POLICIES = [POLICY_ASK, POLICY_SKIP, POLICY_REPLACE, POLICY_UPDATE]
+    SUPPORTED_ON_ERROR_POLICIES = [POLICY_ASK, POLICY_SKIP, POLICY_ABORT, POLICY_RETRY]
+    SUPPORTED_ON_INVALID_POLICIES = [POLICY_ASK, POLICY_DELETE, POLICY_REGENERATE]
+    NON_INTERACTIVE_DEFAULT_POLICIES = {"on_existing": POLICY_SKIP, "on_error": POLICY_SKIP, "on_invalid": POLICY_REGENERATE}
+    NON_INTERACTIVE: bool = False
+    ON_EXISTING: str = POLICY_ASK
+    ON_ERROR: str = POLICY_ASK
+    ON_INVALID: str = POLICY_ASK
+    CREATE_DECK: bool = False
+    # rounds in which words that failed are generated again with the retry policy
+    ERROR_RETRY_ROUNDS: int = 2
+    REPORT_FILE: str = None
+
+    # Retries of a call after network errors, timeouts and server errors, with exponential backoff
+    DEFAULT_MAX_RETRIES: int = 4
+    MAX_RETRIES: int = DEFAULT_MAX_RETRIES
+    # time a call may spend in backoff and in paused circuits, a stage of a word does not wait longer for a provider
+    DEFAULT_MAX_RETRY_SECONDS: float = 300.0
+    MAX_RETRY_SECONDS: float = DEFAULT_MAX_RETRY_SECONDS
+
+    # Words per structured text request, 1 sends every word on its own.
+    # The output of gpt-4o is limited to 4096 tokens, 512 tokens per card.
+    DEFAULT_PACK_SIZE: int = 1
+    MAX_PACK_SIZE: int = 8
+    PACK_SIZE: int = DEFAULT_PACK_SIZE
+
+    # Structured texts and image prompts are requested with the OpenAI Batch API
+    BATCH_MODE: bool = False
+    # continue interrupted words from the generation journal of the processing directory
+    RESUME: bool = False
+    DEFAULT_BATCH_POLL_SECONDS: float = 60
+    BATCH_POLL_SECONDS: float = DEFAULT_BATCH_POLL_SECONDS
 
     @classmethod
     def set_processing_directory_path(cls, path: str):
@@ -104,6 +240,26 @@ class Config:
         else:
             cls.OPENAI_API_KEY = api_key
 
+    @classmethod
+    def set_openai_base_url_or_use_default(cls, base_url: str):
+        if base_url is None:
+            base_url = os.environ.get("OPENAI_BASE_URL")
+        cls.OPENAI_BASE_URL = base_url
+        if cls.OPENAI_BASE_URL is not None:
+            logging.info(f"Using OpenAI base URL [{cls.OPENAI_BASE_URL}]")
+
+    @classmethod
+    def set_batch_mode(cls, batch_mode: bool, poll_seconds: float = None):
+        cls.BATCH_MODE = batch_mode
+        if poll_seconds is None:
+            cls.BATCH_POLL_SECONDS = cls.DEFAULT_BATCH_POLL_SECONDS
+        elif poll_seconds <= 0:
+            raise ValueError(f"Batch poll interval must be positive, got [{poll_seconds}]")
+        else:
+            cls.BATCH_POLL_SECONDS = poll_seconds
+        if cls.BATCH_MODE:
+            logging.info(f"Batch mode enabled, batches are polled every [{cls.BATCH_POLL_SECONDS}] seconds")
+
     @classmethod
     def set_language_or_use_default(cls, language: str):
         if language is None:
@@ -145,12 +301,177 @@ class Config:
             raise Exception(f"Card direction [{card_direction}] not supported. Supported directions: {cls.SUPPORTED_CARD_DIRECTIONS}")
         logging.info(f"Card direction set to [{cls.CARD_DIRECTION}]")
 
+    @classmethod
+    def set_resume(cls, resume: bool):
+        cls.RESUME = resume
+        if cls.RESUME:
+            logging.info("Interrupted words are resumed from the generation journal")
+
     @classmethod
     def set_include_cloze(cls, include_cloze: bool):
         cls.INCLUDE_CLOZE = include_cloze
         if cls.INCLUDE_CLOZE:
             logging.info("Cloze card generation enabled")
 
+    @classmethod
+    def set_image_transcoding_or_use_default(cls, image_format: str, quality: int = None, max_size: int = None):
+        cls.IMAGE_FORMAT = image_format.lower() if image_format is not None else IMAGE_FORMAT_PNG
+        if cls.IMAGE_FORMAT not in cls.SUPPORTED_IMAGE_FORMATS:
+            raise Exception(f"Image format [{image_format}] not supported. Supported formats: {cls.SUPPORTED_IMAGE_FORMATS}")
+        cls.IMAGE_QUALITY = quality if quality is not None else cls.DEFAULT_IMAGE_QUALITY
+        if not 1 <= cls.IMAGE_QUALITY <= 100:
+            raise ValueError(f"Image quality must be between 1 and 100, got [{cls.IMAGE_QUALITY}]")
+        cls.IMAGE_MAX_SIZE = max_size if max_size is not None else cls.DEFAULT_IMAGE_MAX_SIZE
+        if cls.IMAGE_MAX_SIZE < 1:
+            raise ValueError(f"Image size must be positive, got [{cls.IMAGE_MAX_SIZE}]")
+        if cls.IMAGE_FORMAT == IMAGE_FORMAT_PNG:
+            return
+        if importlib.util.find_spec("PIL") is None:
+            raise EnvironmentError(f"Image format [{cls.IMAGE_FORMAT}] requires Pillow, install it with: pip install Pillow")
+        logging.info(f"Images are converted to [{cls.IMAGE_FORMAT}] with quality [{cls.IMAGE_QUALITY}] and at most [{cls.IMAGE_MAX_SIZE}] pixels")
+
+    @classmethod
+    def set_audio_processing_or_use_default(cls, process_audio: bool, audio_format: str = None, bitrate_kbps: int = None):
+        cls.PROCESS_AUDIO = process_audio
+        cls.AUDIO_FORMAT = audio_format.lower() if audio_format is not None else AUDIO_FORMAT_MP3
+        if cls.AUDIO_FORMAT not in cls.SUPPORTED_AUDIO_FORMATS:
+            raise Exception(f"Audio format [{audio_format}] not supported. Supported formats: {cls.SUPPORTED_AUDIO_FORMATS}")
+        cls.AUDIO_BITRATE_KBPS = bitrate_kbps if bitrate_kbps is not None else cls.DEFAULT_AUDIO_BITRATE_KBPS
+        if not 8 <= cls.AUDIO_BITRATE_KBPS <= 320:
+            raise ValueError(f"Audio bitrate must be between 8 and 320 kbit/s, got [{cls.AUDIO_BITRATE_KBPS}]")
+        if not cls.PROCESS_AUDIO:
+            return
+        if shutil.which("ffmpeg") is None:
+            raise EnvironmentError("Audio processing requires ffmpeg, install it and make sure it is on the PATH")
+        logging.info(f"Audio is trimmed, normalized and encoded as [{cls.AUDIO_FORMAT}] with [{cls.AUDIO_BITRATE_KBPS}] kbit/s")
+
+    @classmethod
+    def set_media_transfer_or_use_default(cls, media_transfer: str):
+        if media_transfer is not None:
+            cls.MEDIA_TRANSFER = media_transfer
+        logging.info(f"Media files are transferred to Anki with [{cls.MEDIA_TRANSFER}]")
+
+    @classmethod
+    def set_import_chunk_size_or_use_default(cls, import_chunk_size: int):
+        if import_chunk_size is None:
+            cls.IMPORT_CHUNK_SIZE = cls.DEFAULT_IMPORT_CHUNK_SIZE
+        elif import_chunk_size < 1:
+            raise ValueError(f"Import chunk size must be at least 1, got [{import_chunk_size}]")
+        else:
+            cls.IMPORT_CHUNK_SIZE = import_chunk_size
+        logging.info(f"Import chunk size: {cls.IMPORT_CHUNK_SIZE} notes")
+
+    @classmethod
+    def set_pack_size_or_use_default(cls, pack_size: int):
+        if pack_size is None:
+            cls.PACK_SIZE = cls.DEFAULT_PACK_SIZE
+        elif pack_size < 1 or pack_size > cls.MAX_PACK_SIZE:
+            raise ValueError(f"Pack size must be between 1 and {cls.MAX_PACK_SIZE}, got [{pack_size}]")
+        else:
+            cls.PACK_SIZE = pack_size
+        if cls.PACK_SIZE > 1:
+            logging.info(f"Structured texts are generated for [{cls.PACK_SIZE}] words per request")
+
+    @classmethod
+    def set_stage_workers_or_use_default(cls, stage_workers: dict[str, int]):
+        workers = dict(cls.DEFAULT_STAGE_WORKERS)
+        for stage, count in stage_workers.items():
+            if stage not in workers:
+                raise Exception(f"Unknown generation stage [{stage}]. Supported stages: {list(workers.keys())}")
+            if count is None:
+                continue
+            if count < 1:
+                raise Exception(f"Stage [{stage}] needs at least one worker, got [{count}]")
+            workers[stage] = count
+        cls.STAGE_WORKERS = workers
+        logging.info(f"Generation stage workers: {cls.STAGE_WORKERS}")
+
+    @classmethod
+    def set_rate_limits_or_use_default(cls, rate_limits: list[str]):
+        """Parse rate limits in format ENDPOINT=RPM or ENDPOINT=RPM/TPM"""
+        custom_rate_limits = {}
+        for rate_limit in rate_limits or []:
+            try:
+                endpoint, budget = rate_limit.split("=", 1)
+                endpoint = endpoint.strip().lower()
+                requests_per_minute, _, tokens_per_minute = budget.partition("/")
+                parsed = (float(requests_per_minute), float(tokens_per_minute) if tokens_per_minute else cls.DEFAULT_RATE_LIMITS.get(endpoint, (None, None))[1])
+            except ValueError:
+                raise Exception(f"Rate limit [{rate_limit}] has invalid format. Expected ENDPOINT=RPM or ENDPOINT=RPM/TPM")
+            if endpoint not in cls.DEFAULT_RATE_LIMITS:
+                raise Exception(f"Unknown rate limited endpoint [{endpoint}]. Supported endpoints: {list(cls.DEFAULT_RATE_LIMITS.keys())}")
+            if parsed[0] <= 0:
+                raise Exception(f"Rate limit for endpoint [{endpoint}] must be positive")
+            custom_rate_limits[endpoint] = parsed
+        cls.CUSTOM_RATE_LIMITS = custom_rate_limits
+        cls.RATE_LIMITS = {**cls.DEFAULT_RATE_LIMITS, **custom_rate_limits}
+        logging.info(f"Rate limits (RPM, TPM): {cls.RATE_LIMITS}")
+
+    @classmethod
+    def set_policies_or_use_default(cls, on_existing: str, on_error: str, on_invalid: str, create_deck: bool, non_interactive: bool):
+        cls.NON_INTERACTIVE = non_interactive
+        defaults = cls.NON_INTERACTIVE_DEFAULT_POLICIES if non_interactive else {}
+        cls.ON_EXISTING = on_existing or defaults.get("on_existing", POLICY_ASK)
+        cls.ON_ERROR = on_error or defaults.get("on_error", POLICY_ASK)
+        cls.ON_INVALID = on_invalid or defaults.get("on_invalid", POLICY_ASK)
+        cls.CREATE_DECK = create_deck
+        for name, policy, supported in [("on_existing", cls.ON_EXISTING, cls.SUPPORTED_ON_EXISTING_POLICIES),
+                                        ("on_error", cls.ON_ERROR, cls.SUPPORTED_ON_ERROR_POLICIES),
+                                        ("on_invalid", cls.ON_INVALID, cls.SUPPORTED_ON_INVALID_POLICIES)]:
+            if policy not in supported:
+                raise Exception(f"Policy [{policy}] not supported for [{name}]. Supported policies: {supported}")
+            if non_interactive and policy == POLICY_ASK:
+                raise Exception(f"Policy [{POLICY_ASK}] for [{name}] can not be used in a non-interactive run")
+        logging.info(f"Policies: existing cards [{cls.ON_EXISTING}], errors [{cls.ON_ERROR}], invalid cards [{cls.ON_INVALID}], "
+                     f"create deck [{cls.CREATE_DECK}], non-interactive [{cls.NON_INTERACTIVE}]")
+
+    @classmethod
+    def set_report_file_or_use_default(cls, report_file: str):
+        if report_file is None:
+            # a subdirectory, the JSON files of the processing directory are read as cards
+            report_file = os.path.join(cls.PROCESSING_DIRECTORY_PATH, "reports", f"run_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+        cls.REPORT_FILE = report_file
+        logging.info(f"Run report will be saved as [{cls.REPORT_FILE}]")
+
+    @classmethod
+    def policies(cls) -> dict:
+        return {"on_existing": cls.ON_EXISTING, "on_error": cls.ON_ERROR, "on_invalid": cls.ON_INVALID,
+                "create_deck": cls.CREATE_DECK, "non_interactive": cls.NON_INTERACTIVE}
+
+    @classmethod
+    def set_max_retries_or_use_default(cls, max_retries: int, max_retry_seconds: float = None):
+        cls.MAX_RETRIES = max_retries if max_retries is not None else cls.DEFAULT_MAX_RETRIES
+        if cls.MAX_RETRIES < 0:
+            raise ValueError(f"Number of retries must not be negative, got [{cls.MAX_RETRIES}]")
+        cls.MAX_RETRY_SECONDS = max_retry_seconds if max_retry_seconds is not None else cls.DEFAULT_MAX_RETRY_SECONDS
+        if cls.MAX_RETRY_SECONDS < 0:
+            raise ValueError(f"Retry time must not be negative, got [{cls.MAX_RETRY_SECONDS}]")
+        logging.info(f"Failed calls are retried up to [{cls.MAX_RETRIES}] times within [{cls.MAX_RETRY_SECONDS:.0f}] seconds")
+
+    @classmethod
+    def set_cache_directory_or_use_default(cls, cache_directory: str, use_cache: bool = True):
+        cls.USE_CACHE = use_cache
+        if not use_cache:
+            logging.info("Persistent caches are disabled")
+            return
+        if cache_directory is None:
+            cls.setup_default_cache_directory()
+        else:
+            cls.CACHE_DIRECTORY = cache_directory
+        os.makedirs(cls.CACHE_DIRECTORY, exist_ok=True)
+        logging.info(f"Using cache directory: {cls.CACHE_DIRECTORY}")
+
+    @classmethod
+    def setup_default_cache_directory(cls):
+        if os.name == "nt":
+            local_app_data = os.getenv('LOCALAPPDATA', os.path.join(os.path.expanduser('~'), 'AppData', 'Local'))
+            cls.CACHE_DIRECTORY = os.path.join(local_app_data, 'anki-cards-ai-generator', 'cache')
+        elif os.name == 'posix':
+            cache_home = os.getenv('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+            cls.CACHE_DIRECTORY = os.path.join(cache_home, 'anki-cards-ai-generator')
+        else:
+            raise EnvironmentError(f"Unknown OS [{os.name}]")
+
     @classmethod
     def setup_openai_api_key_from_environment(cls):
         openai_api_key = os.environ.get("OPENAI_API_KEY")
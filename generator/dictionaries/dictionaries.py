@@ -1,7 +1,12 @@
+from generator.cache import probe_cache
 from generator.config import Config, ENGLISH, GERMAN
 from generator.dictionaries import dictionary_english, dictionary_german
 
 import logging
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import httpx
 
 
 def create_dictionary_url_if_website_exists(word: str) -> str | None:
@@ -12,3 +17,28 @@ def create_dictionary_url_if_website_exists(word: str) -> str | None:
     else:
         logging.error(f"No dictionary for language [{Config.LANGUAGE}]")
         return None
+
+
+async def create_dictionary_url_if_website_exists_async(word: str, http_client: 'httpx.AsyncClient') -> str | None:
+    if Config.LANGUAGE == ENGLISH:
+        url = dictionary_english.build_cambridge_url(word)
+        headers = dictionary_english.HEADERS
+    elif Config.LANGUAGE == GERMAN:
+        url = dictionary_german.build_dwds_url(word)
+        headers = dictionary_german.HEADERS
+    else:
+        logging.error(f"No dictionary for language [{Config.LANGUAGE}]")
+        return None
+
+    async def probe() -> bool:
+        import httpx
+        try:
+            response = await http_client.get(url, headers=headers, follow_redirects=True)
+        except httpx.HTTPError as e:
+            raise probe_cache.TransientProbeError(f"An error occurred while checking the dictionary page: {e}") from e
+        probe_cache.raise_for_transient_status(response.status_code, url)
+        if Config.LANGUAGE == ENGLISH:
+            return dictionary_english.cambridge_entry_exists(word, url, response.status_code, str(response.url))
+        return dictionary_german.dwds_entry_exists(word, url, response.status_code, response.text)
+
+    return url if await probe_cache.cached_probe_async(url, probe) else None
@@ -2,28 +2,39 @@ import logging
 
 import requests
 
+from generator.cache import probe_cache
+
+CAMBRIDGE_BASE_URL: str = "https://dictionary.cambridge.org/dictionary/english/"
+PROBE_TIMEOUT_SECONDS = 15
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
+}
+
 
 def create_cambridge_url_if_website_exists(word_or_phrase: str) -> str | None:
-    # Convert spaces to hyphens and lowercase the word for the URL
-    formatted_word = '-'.join(word_or_phrase.lower().split())
+    url = build_cambridge_url(word_or_phrase)
+    return url if probe_cache.cached_probe(url, lambda: probe_cambridge(word_or_phrase, url)) else None
+
 
-    # Create the URL
-    base_url: str = "https://dictionary.cambridge.org/dictionary/english/"
-    url = f"{base_url}{formatted_word}"
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
-    }
+def probe_cambridge(word_or_phrase: str, url: str) -> bool:
     try:
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            if response.url == base_url:
-                print(f"No Cambridge Dictionary entry found for '{word_or_phrase}'.")
-                return None
-            print(f"Cambridge Dictionary page exists for '{word_or_phrase}': {url}")
-            return url
-        else:
-            print(f"No Cambridge Dictionary entry found for '{word_or_phrase}'.")
-            return None
+        response = requests.get(url, headers=HEADERS, timeout=PROBE_TIMEOUT_SECONDS)
     except requests.RequestException as e:
-        print(f"An error occurred while checking the dictionary page: {e}")
-        return None
+        raise probe_cache.TransientProbeError(f"An error occurred while checking the dictionary page: {e}") from e
+    probe_cache.raise_for_transient_status(response.status_code, url)
+    return cambridge_entry_exists(word_or_phrase, url, response.status_code, response.url)
+
+
+def build_cambridge_url(word_or_phrase: str) -> str:
+    # Convert spaces to hyphens and lowercase the word for the URL
+    formatted_word = '-'.join(word_or_phrase.lower().split())
+    return f"{CAMBRIDGE_BASE_URL}{formatted_word}"
+
+
+def cambridge_entry_exists(word_or_phrase: str, url: str, status_code: int, final_url: str) -> bool:
+    # Cambridge redirects to the base url if there is no entry
+    if status_code == 200 and final_url != CAMBRIDGE_BASE_URL:
+        print(f"Cambridge Dictionary page exists for '{word_or_phrase}': {url}")
+        return True
+    print(f"No Cambridge Dictionary entry found for '{word_or_phrase}'.")
+    return False
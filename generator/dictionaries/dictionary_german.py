@@ -3,6 +3,14 @@ import re
 
 import requests
 
+from generator.cache import probe_cache
+
+DWDS_BASE_URL = "https://www.dwds.de/wb/"
+PROBE_TIMEOUT_SECONDS = 15
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
+}
+
 
 def remove_german_articles(text):
     # Define a regular expression pattern for German articles
@@ -17,30 +25,38 @@ def remove_german_articles(text):
 
 
 def create_dwds_url_if_website_exists(word: str) -> str | None:
-    word = remove_german_articles(word)
-    formatted_word = '-'.join(word.lower().split())
+    url = build_dwds_url(word)
+    return url if probe_cache.cached_probe(url, lambda: probe_dwds(word, url)) else None
 
-    # Create the URL for DWDS
-    base_url = "https://www.dwds.de/wb/"
-    url = f"{base_url}{formatted_word}"
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
-    }
 
+def probe_dwds(word: str, url: str) -> bool:
     try:
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            # Check if the specific error message is in the response text
-            error_message = f"Es tut uns leid, Ihre Anfrage <strong>{formatted_word}</strong> ist nicht in unseren gegenwartssprachlichen lexikalischen Quellen vorhanden."
-            if error_message in response.text:
-                logging.warning(f"No DWDS dictionary entry found for '{word}'.")
-                return None
-            else:
-                logging.info(f"DWDS dictionary page exists for '{word}': {url}")
-                return url
-        else:
-            logging.warning(f"No DWDS dictionary entry found for '{word}'.")
-            return None
+        response = requests.get(url, headers=HEADERS, timeout=PROBE_TIMEOUT_SECONDS)
     except requests.RequestException as e:
-        logging.error(f"An error occurred while checking the dictionary page: {e}")
-        return None
+        raise probe_cache.TransientProbeError(f"An error occurred while checking the dictionary page: {e}") from e
+    probe_cache.raise_for_transient_status(response.status_code, url)
+    return dwds_entry_exists(word, url, response.status_code, response.text)
+
+
+def format_dwds_word(word: str) -> str:
+    return '-'.join(remove_german_articles(word).lower().split())
+
+
+def build_dwds_url(word: str) -> str:
+    return f"{DWDS_BASE_URL}{format_dwds_word(word)}"
+
+
+def dwds_entry_exists(word: str, url: str, status_code: int, text: str) -> bool:
+    word = remove_german_articles(word)
+    if status_code == 200:
+        # Check if the specific error message is in the response text
+        error_message = f"Es tut uns leid, Ihre Anfrage <strong>{format_dwds_word(word)}</strong> ist nicht in unseren gegenwartssprachlichen lexikalischen Quellen vorhanden."
+        if error_message in text:
+            logging.warning(f"No DWDS dictionary entry found for '{word}'.")
+            return False
+        else:
+            logging.info(f"DWDS dictionary page exists for '{word}': {url}")
+            return True
+    else:
+        logging.warning(f"No DWDS dictionary entry found for '{word}'.")
+        return False
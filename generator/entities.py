@@ -60,7 +60,8 @@ class CardRawDataV2:
     context_sentences: list[str]
     notes: str
     image_prompt: str
-    image_url: str
+    # url of the generated image, None if the image is reused from the image store
+    image_url: str | None
     image_path: str
     audio_path: str
     russian_speaker_tips: str = None
@@ -78,7 +79,7 @@ class CardRawDataV2:
             raise ValueError("At least 2 context sentences required")
         if not self.image_path or not self.audio_path:
             raise ValueError("Image and audio paths are required")
-        if not self.image_url:
+        if self.image_url == "":
             raise ValueError("Image URL cannot be empty")
 
 
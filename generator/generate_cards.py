@@ -1,106 +1,256 @@
 import logging
-import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import closing
+from typing import Iterable, Iterator
+from dataclasses import dataclass, field
 
-from generator.api_calls import openai_image, openai_text, openai_audio, openai_image_prompt, replicate_image
+from generator.api_calls import openai_batch, openai_image, openai_text, openai_audio, openai_image_prompt, replicate_image
+from generator import audio_processing, generation_journal, image_transcoding
+from generator.cache import image_store
 from generator.dictionaries import dictionaries
-from generator.config import Config, OPENAI, REPLICATE
+from generator.config import Config, OPENAI, REPLICATE, STAGE_TEXT, STAGE_IMAGE_PROMPT, STAGE_IMAGE, STAGE_DOWNLOAD, STAGE_TRANSCODE, STAGE_AUDIO, STAGE_AUDIO_PROCESSING, STAGE_DICTIONARY, \
+    STAGE_CARD, POLICY_ABORT, POLICY_RETRY, POLICY_SKIP
 from generator.entities import WordWithContext, CardRawDataV1, CardRawDataV2, ClozeSentence, serialize_to_json
 from generator.input.file_operations import save_text, generate_image_path, generate_card_data_path, download_and_save_image, generate_audio_path
 from generator.input.confirm import confirm_action
+from generator.pipeline import PipelineResult, Stage, StagedPipeline, critical_path_seconds
+from generator.run_report import run_report, PHASE_GENERATION
+
 
 def generate_text_and_image(input_words: list[WordWithContext]) -> dict[WordWithContext, CardRawDataV2]:
     words_total = len(input_words)
-    words_remaining = words_total
 
     logging.info(f"Starting generation of text and images for {words_total} words {list(map(lambda entry: entry.word, input_words))}")
     words_cards: dict[WordWithContext, CardRawDataV2] = {}
 
-    for word_with_context in input_words:
-        try:
-            card_raw = create_card_for_word_v2(word_with_context)
-            words_cards[word_with_context] = card_raw
-            logging.info(f"Word [{word_with_context.word}] processed")
-        except Exception as e:
-            logging.error(f"Failed to process word [{word_with_context.word}] due to [{e}]")
-            abort = confirm_action("Do you want to abort processing? If no, the processing will be resumed and this card will be skipped")
+    works = [CardWork(word_with_context) for word_with_context in input_words]
+    journal = generation_journal.GenerationJournal(Config.PROCESSING_DIRECTORY_PATH)
+    stages = card_generation_stages(Config.STAGE_WORKERS, journal)
+    if Config.RESUME:
+        journal.restore(works, stages)
+    elif journaled_words := len(journal.entries_for_words(input_words)):
+        logging.info(f"[{journaled_words}] words have completed stages of an interrupted run, use --resume to continue them")
+
+    batch_state = None
+    if Config.BATCH_MODE and works:
+        batch_state = openai_batch.BatchState(Config.PROCESSING_DIRECTORY_PATH)
+        run_batch_text_stages(works, batch_state)
+
+    failed_results = run_generation_round(stages, run_packed_text_stage(works) if Config.PACK_SIZE > 1 else works, words_cards, words_total)
+    retry_round = 0
+    while failed_results and Config.ON_ERROR == POLICY_RETRY and retry_round < Config.ERROR_RETRY_ROUNDS:
+        retry_round += 1
+        retry_works = [CardWork(result.item.word_with_context) for result in failed_results]
+        logging.info(f"Retry round [{retry_round}/{Config.ERROR_RETRY_ROUNDS}] for words {[work.word_with_context.word for work in retry_works]}")
+        # the stages completed before the failure are not repeated
+        journal.restore(retry_works, stages, retry_round=True)
+        failed_results = run_generation_round(stages, retry_works, words_cards, words_total)
+    for result in failed_results:
+        logging.warning(f"Word [{result.item.word_with_context.word}] is skipped after [{retry_round}] retry rounds")
+        run_report.add_failure(result.item.word_with_context.word, PHASE_GENERATION, result.error, "skipped", result.failed_stage)
+    if batch_state is not None:
+        # all batch results are used, the next run starts new batches
+        batch_state.clear()
+    journal.log_resume_statistics()
+    journal.close()
+    return words_cards
+
+
+def run_generation_round(stages: list[Stage], works: Iterable['CardWork'], words_cards: dict[WordWithContext, CardRawDataV2],
+                         words_total: int) -> list[PipelineResult]:
+    """
+    Run the works through the pipeline and add their cards to words_cards. A failed word is handled with Config.ON_ERROR,
+    the failures that are retried later are returned.
+    """
+    retried: list[PipelineResult] = []
+    with closing(StagedPipeline(stages).run(works)) as results:
+        for result in results:
+            word_with_context = result.item.word_with_context
+            if result.error is None:
+                words_cards[word_with_context] = result.item.card
+                sequential = sum(result.stage_seconds.values())
+                critical_path = critical_path_seconds(stages, result.stage_seconds)
+                logging.info(f"Word [{word_with_context.word}] processed ({len(words_cards)}/{words_total}) in [{result.elapsed_seconds:.1f}] seconds, "
+                             f"[{sequential - critical_path:.1f}] seconds saved by parallel stages compared to sequential execution [{sequential:.1f}]")
+                continue
+            logging.error(f"Failed to process word [{word_with_context.word}] at stage [{result.failed_stage}] due to [{result.error}]")
+            if Config.ON_ERROR == POLICY_RETRY:
+                retried.append(result)
+                continue
+            if Config.ON_ERROR == POLICY_ABORT:
+                abort = True
+            elif Config.ON_ERROR == POLICY_SKIP:
+                abort = False
+            else:
+                abort = confirm_action("Do you want to abort processing? If no, the processing will be resumed and this card will be skipped")
+            run_report.add_failure(word_with_context.word, PHASE_GENERATION, result.error, "aborted" if abort else "skipped", result.failed_stage)
             if abort:
-                raise Exception(f"Aborting processing after error: [{e}]")
+                raise Exception(f"Aborting processing after error: [{result.error}]")
             else:
                 logging.warning(f"Word [{word_with_context.word}] will be skipped")
-        words_remaining -= 1
-        if words_remaining > 0:
-            wait_after_word_processing()
-    return words_cards
+    return retried
 
 
-def create_card_for_word(word_with_context) -> CardRawDataV1:
-    card_text = openai_text.chat_generate_text(word_with_context)
-    logging.info("Card text is created")
+def run_batch_text_stages(works: list['CardWork'], batch_state: openai_batch.BatchState):
+    """
+    Request the structured texts and then the image prompts of all words with the Batch API.
+    The pipeline skips the text and image prompt stages of the words with results, the other words are requested as usual.
+    Results restored from the journal are not requested again.
+    """
+    works_without_text = [work for work in works if work.structured_content is None]
+    structured_texts = openai_batch.batch_structured_texts([work.word_with_context for work in works_without_text], batch_state)
+    for work in works_without_text:
+        work.structured_content = structured_texts.get(work.word_with_context)
+    works_with_text = [work for work in works if work.structured_content is not None and work.image_prompt is None and work.stored_image_path is None]
+    # words with a stored image for the same definition need no image prompt
+    works_with_text = [work for work in works_with_text if not reuse_stored_concept_image(work)]
+    image_prompts = openai_batch.batch_dalle_prompts([(work.word_with_context, work.structured_content["definition"]) for work in works_with_text], batch_state)
+    for work in works_with_text:
+        work.image_prompt = image_prompts.get(work.word_with_context)
 
-    image_prompt = openai_image_prompt.chat_generate_dalle_prompt(word_with_context, card_text)
-    image_url = get_image_url_depending_on_image_generation_mode(image_prompt)
 
-    logging.info("Card Image is created")
-    logging.info(f"Image url: {image_url}")
+@dataclass
+class CardWork:
+    """Intermediate results of one word while it moves through the generation stages."""
+    word_with_context: WordWithContext
+    structured_content: dict = None
+    image_prompt: str = None
+    image_url: str = None
+    # image of the image store that is copied instead of generating one
+    stored_image_path: str = None
+    image_path: str = None
+    audio_path: str = None
+    dictionary_url: str = None
+    card: CardRawDataV2 = None
+    # stages restored from the generation journal, they are not run again
+    completed_stages: set[str] = field(default_factory=set)
 
-    image_path = generate_image_path(Config.PROCESSING_DIRECTORY_PATH, word_with_context)
-    download_and_save_image(image_url, image_path)
-    logging.info(f"Card image is saved as [{image_path}]")
 
-    audio_path = generate_audio_path(Config.PROCESSING_DIRECTORY_PATH, word_with_context)
-    openai_audio.chat_generate_and_save_audio(word_with_context.word, audio_path)
-    logging.info(f"Card audio is saved as [{audio_path}]")
+def run_packed_text_stage(works: list[CardWork]) -> Iterator[CardWork]:
+    """
+    Generate the structured texts in packs of Config.PACK_SIZE words and pass each pack to the pipeline as soon as it is done.
+    Words without valid card in the packed response are generated one by one in the text stage.
+    """
+    works_without_text = [work for work in works if work.structured_content is None]
+    packs = [works_without_text[start:start + Config.PACK_SIZE] for start in range(0, len(works_without_text), Config.PACK_SIZE)]
+    # words generated in batch mode do not wait for the packs
+    yield from (work for work in works if work.structured_content is not None)
+    executor = ThreadPoolExecutor(max_workers=Config.STAGE_WORKERS[STAGE_TEXT], thread_name_prefix="packed-text")
+    try:
+        for future in as_completed([executor.submit(generate_pack, pack) for pack in packs]):
+            yield from future.result()
+    finally:
+        # closed by the pipeline after an early stop, the packs that were not sent yet are cancelled
+        executor.shutdown(cancel_futures=True)
 
-    dictionary_url = dictionaries.create_dictionary_url_if_website_exists(word_with_context.word)
-    if dictionary_url:
-        logging.info(f"Dictionary url is created")
-    else:
-        logging.warning(f"Dictionary url is not created")
 
-    card_raw: CardRawDataV1 = CardRawDataV1(word=word_with_context.word, card_text=card_text,
-                                            image_prompt=image_prompt, image_url=image_url, image_path=image_path,
-                                            audio_path=audio_path,
-                                            dictionary_url=dictionary_url)
-    card_data_path = generate_card_data_path(Config.PROCESSING_DIRECTORY_PATH, word_with_context)
-    save_text(serialize_to_json(card_raw), card_data_path)
-    logging.info(f"Card data is saved as [{card_data_path}]")
-    return card_raw
+def generate_pack(pack: list[CardWork]) -> list[CardWork]:
+    try:
+        structured_texts = openai_text.chat_generate_structured_texts_packed([work.word_with_context for work in pack])
+    except Exception as e:
+        logging.warning(f"Packed request for words {[work.word_with_context.word for work in pack]} failed, they are generated one by one: [{e}]")
+        return pack
+    for work in pack:
+        work.structured_content = structured_texts.get(work.word_with_context)
+    return pack
 
 
-def create_card_for_word_v2(word_with_context: WordWithContext) -> CardRawDataV2:
+def card_generation_stages(workers: dict[str, int], journal: generation_journal.GenerationJournal = None) -> list[Stage]:
     """
-    Create a vocabulary card using structured JSON output (v2 format).
-    Returns CardRawDataV2 with definition, context_sentences, and notes.
+    Dependency graph of the card generation. Audio and dictionary lookup only need the word,
+    so they run next to the text -> image prompt -> image -> download chain.
+    With a journal, the output of every stage is recorded and stages restored from the journal are skipped.
     """
-    # Generate structured card content (definition, context_sentences, notes)
-    structured_content = openai_text.chat_generate_structured_text(word_with_context)
-    logging.info("Structured card content created")
-
-    # Generate image prompt based on definition and context
-    image_prompt = openai_image_prompt.chat_generate_dalle_prompt(
-        word_with_context,
-        structured_content["definition"]
-    )
-    image_url = get_image_url_depending_on_image_generation_mode(image_prompt)
-    logging.info("Card Image is created")
-    logging.info(f"Image url: {image_url}")
+    stages = [
+        Stage(STAGE_TEXT, run_text_stage, workers[STAGE_TEXT]),
+        Stage(STAGE_IMAGE_PROMPT, run_image_prompt_stage, workers[STAGE_IMAGE_PROMPT], depends_on=[STAGE_TEXT]),
+        Stage(STAGE_IMAGE, run_image_stage, workers[STAGE_IMAGE], depends_on=[STAGE_IMAGE_PROMPT]),
+        Stage(STAGE_DOWNLOAD, run_download_stage, workers[STAGE_DOWNLOAD], depends_on=[STAGE_IMAGE]),
+        Stage(STAGE_TRANSCODE, run_transcode_stage, workers[STAGE_TRANSCODE], depends_on=[STAGE_DOWNLOAD]),
+        Stage(STAGE_AUDIO, run_audio_stage, workers[STAGE_AUDIO]),
+        Stage(STAGE_AUDIO_PROCESSING, run_audio_processing_stage, workers[STAGE_AUDIO_PROCESSING], depends_on=[STAGE_AUDIO]),
+        Stage(STAGE_DICTIONARY, run_dictionary_stage, workers[STAGE_DICTIONARY]),
+        Stage(STAGE_CARD, run_card_stage, 1, depends_on=[STAGE_TRANSCODE, STAGE_AUDIO_PROCESSING, STAGE_DICTIONARY]),
+    ]
+    if journal is None:
+        return stages
+    return [journal.journaled(stage) for stage in stages]
 
-    # Download and save image
-    image_path = generate_image_path(Config.PROCESSING_DIRECTORY_PATH, word_with_context)
-    download_and_save_image(image_url, image_path)
+
+def run_text_stage(work: CardWork):
+    if work.structured_content is not None:
+        # generated in batch mode
+        return
+    work.structured_content = openai_text.chat_generate_structured_text(work.word_with_context)
+    logging.info(f"Structured card content for word [{work.word_with_context.word}] created")
+
+
+def run_image_prompt_stage(work: CardWork):
+    if work.image_prompt is not None or work.stored_image_path is not None or reuse_stored_concept_image(work):
+        return
+    work.image_prompt = openai_image_prompt.chat_generate_dalle_prompt(work.word_with_context, work.structured_content["definition"])
+
+
+def reuse_stored_concept_image(work: CardWork) -> bool:
+    """Take the stored image of the same word and definition, the image prompt and the image are not generated then."""
+    stored_image = image_store.find_concept_image(work.word_with_context, work.structured_content["definition"])
+    if stored_image is None:
+        return False
+    work.stored_image_path, work.image_prompt = stored_image
+    return True
+
+
+def run_image_stage(work: CardWork):
+    if work.stored_image_path is None:
+        work.stored_image_path = image_store.find_image(work.image_prompt)
+    if work.stored_image_path is not None:
+        return
+    work.image_url = get_image_url_depending_on_image_generation_mode(work.image_prompt)
+    logging.info(f"Card image for word [{work.word_with_context.word}] is created")
+    logging.info(f"Image url: {work.image_url}")
+
+
+def run_download_stage(work: CardWork):
+    image_path = generate_image_path(Config.PROCESSING_DIRECTORY_PATH, work.word_with_context)
+    if work.stored_image_path is not None:
+        image_store.copy_stored_image(work.stored_image_path, image_path)
+    else:
+        save_image(work.image_url, image_path, work.image_prompt, work.word_with_context, work.structured_content["definition"])
+    work.image_path = image_path
     logging.info(f"Card image is saved as [{image_path}]")
 
-    # Generate and save audio
-    audio_path = generate_audio_path(Config.PROCESSING_DIRECTORY_PATH, word_with_context)
-    openai_audio.chat_generate_and_save_audio(word_with_context.word, audio_path)
+
+def run_transcode_stage(work: CardWork):
+    if image_transcoding.transcoding_enabled():
+        work.image_path = image_transcoding.transcode_for_anki(work.image_path)
+
+
+def run_audio_stage(work: CardWork):
+    audio_path = generate_audio_path(Config.PROCESSING_DIRECTORY_PATH, work.word_with_context)
+    openai_audio.chat_generate_and_save_audio(work.word_with_context.word, audio_path)
+    work.audio_path = audio_path
     logging.info(f"Card audio is saved as [{audio_path}]")
 
-    # Get dictionary URL
-    dictionary_url = dictionaries.create_dictionary_url_if_website_exists(word_with_context.word)
-    if dictionary_url:
-        logging.info(f"Dictionary url is created")
+
+def run_audio_processing_stage(work: CardWork):
+    if audio_processing.audio_processing_enabled():
+        work.audio_path = audio_processing.process_for_anki(work.audio_path)
+
+
+def run_dictionary_stage(work: CardWork):
+    work.dictionary_url = dictionaries.create_dictionary_url_if_website_exists(work.word_with_context.word)
+    if work.dictionary_url:
+        logging.info(f"Dictionary url for word [{work.word_with_context.word}] is created")
     else:
-        logging.warning(f"Dictionary url is not created")
+        logging.warning(f"Dictionary url for word [{work.word_with_context.word}] is not created")
+
+
+def run_card_stage(work: CardWork):
+    work.card = build_and_save_card(work)
+
+
+def build_and_save_card(work: CardWork) -> CardRawDataV2:
+    structured_content = work.structured_content
 
     # Parse cloze sentences if present
     cloze_sentences = None
@@ -110,27 +260,58 @@ def create_card_for_word_v2(word_with_context: WordWithContext) -> CardRawDataV2
             for c in structured_content["cloze_sentences"]
         ]
 
-    # Create CardRawDataV2 object
     card_raw: CardRawDataV2 = CardRawDataV2(
-        word=word_with_context.word,
+        word=work.word_with_context.word,
         definition=structured_content["definition"],
         russian_translation=structured_content["russian_translation"],
         context_sentences=structured_content["context_sentences"],
         notes=structured_content["notes"],
-        image_prompt=image_prompt,
-        image_url=image_url,
-        image_path=image_path,
-        audio_path=audio_path,
+        image_prompt=work.image_prompt,
+        image_url=work.image_url,
+        image_path=work.image_path,
+        audio_path=work.audio_path,
         russian_speaker_tips=structured_content.get("russian_speaker_tips"),
         cloze_sentences=cloze_sentences,
-        dictionary_url=dictionary_url
+        dictionary_url=work.dictionary_url
     )
 
-    # Save card data
-    card_data_path = generate_card_data_path(Config.PROCESSING_DIRECTORY_PATH, word_with_context)
+    card_data_path = generate_card_data_path(Config.PROCESSING_DIRECTORY_PATH, work.word_with_context)
     save_text(serialize_to_json(card_raw), card_data_path)
     logging.info(f"Card data is saved as [{card_data_path}]")
+    return card_raw
 
+
+def create_card_for_word(word_with_context) -> CardRawDataV1:
+    card_text = openai_text.chat_generate_text(word_with_context)
+    logging.info("Card text is created")
+
+    image_prompt = openai_image_prompt.chat_generate_dalle_prompt(word_with_context, card_text)
+    image_url = get_image_url_depending_on_image_generation_mode(image_prompt)
+
+    logging.info("Card Image is created")
+    logging.info(f"Image url: {image_url}")
+
+    image_path = generate_image_path(Config.PROCESSING_DIRECTORY_PATH, word_with_context)
+    save_image(image_url, image_path, image_prompt, word_with_context)
+    logging.info(f"Card image is saved as [{image_path}]")
+
+    audio_path = generate_audio_path(Config.PROCESSING_DIRECTORY_PATH, word_with_context)
+    openai_audio.chat_generate_and_save_audio(word_with_context.word, audio_path)
+    logging.info(f"Card audio is saved as [{audio_path}]")
+
+    dictionary_url = dictionaries.create_dictionary_url_if_website_exists(word_with_context.word)
+    if dictionary_url:
+        logging.info(f"Dictionary url is created")
+    else:
+        logging.warning(f"Dictionary url is not created")
+
+    card_raw: CardRawDataV1 = CardRawDataV1(word=word_with_context.word, card_text=card_text,
+                                            image_prompt=image_prompt, image_url=image_url, image_path=image_path,
+                                            audio_path=audio_path,
+                                            dictionary_url=dictionary_url)
+    card_data_path = generate_card_data_path(Config.PROCESSING_DIRECTORY_PATH, word_with_context)
+    save_text(serialize_to_json(card_raw), card_data_path)
+    logging.info(f"Card data is saved as [{card_data_path}]")
     return card_raw
 
 
@@ -143,7 +324,7 @@ def get_image_url_depending_on_image_generation_mode(image_prompt):
         raise Exception(f"Unsupported image generation mode: [{Config.IMAGE_GENERATION_MODE}]")
 
 
-def wait_after_word_processing():
-    sleep_seconds = Config.SECONDS_WAIT_BETWEEN_DALLE_CALLS
-    logging.info(f"Waiting [{sleep_seconds}] seconds after word processing (API RPM)")
-    time.sleep(sleep_seconds)
+def save_image(image_url, image_path, image_prompt, word_with_context: WordWithContext = None, definition: str = None):
+    """Download the image and add it to the image store for other runs and decks."""
+    download_and_save_image(image_url, image_path)
+    image_store.add_image(image_path, image_prompt, word_with_context, definition)
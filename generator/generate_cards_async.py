@@ -0,0 +1,195 @@
+import asyncio
+import logging
+from typing import TYPE_CHECKING, AsyncIterator, Iterable
+
+import httpx
+from openai import AsyncOpenAI
+
+from generator.api_calls import clients, openai_audio, openai_image, openai_image_prompt, openai_text, prompt_cache_metrics, rate_limiter
+from generator import audio_processing, image_transcoding
+from generator.cache import audio_cache, image_store, llm_cache
+from generator.cache.blob_store import detach_file
+from generator.config import Config, OPENAI, REPLICATE, STAGE_TEXT, STAGE_IMAGE_PROMPT, STAGE_IMAGE, STAGE_DOWNLOAD, STAGE_TRANSCODE, STAGE_AUDIO, STAGE_AUDIO_PROCESSING, STAGE_DICTIONARY, \
+    ENDPOINT_OPENAI_CHAT, ENDPOINT_OPENAI_IMAGE, ENDPOINT_OPENAI_AUDIO, ENDPOINT_REPLICATE
+from generator.dictionaries import dictionaries
+from generator.entities import WordWithContext, CardRawDataV2
+from generator.generate_cards import CardWork, build_and_save_card
+from generator.input.file_operations import generate_image_path, generate_audio_path, download_and_save_image_async
+
+if TYPE_CHECKING:
+    import replicate
+
+
+def create_stage_semaphores(stage_workers: dict[str, int] = None) -> dict[str, asyncio.Semaphore]:
+    """One semaphore per generation stage. A host application can create them once and share them between calls."""
+    if stage_workers is None:
+        stage_workers = Config.STAGE_WORKERS
+    return {stage: asyncio.Semaphore(workers) for stage, workers in stage_workers.items()}
+
+
+class AsyncCardGenerator:
+    """
+    Generates cards on the running event loop. Clients and semaphores can be passed by the host application,
+    so the generator shares connection pools and concurrency limits with the rest of the service.
+    """
+
+    def __init__(self, semaphores: dict[str, asyncio.Semaphore] = None, openai_client: AsyncOpenAI = None, http_client: httpx.AsyncClient = None):
+        self.semaphores = semaphores or create_stage_semaphores()
+        self.openai_client = openai_client or clients.get_async_openai_client()
+        self.replicate_client: 'replicate.Client' = None
+        self.http_client = http_client or httpx.AsyncClient(timeout=httpx.Timeout(60.0))
+        self._owns_http_client = http_client is None
+
+    async def aclose(self):
+        if self._owns_http_client:
+            await self.http_client.aclose()
+
+    async def create_card(self, word_with_context: WordWithContext) -> CardRawDataV2:
+        work = CardWork(word_with_context)
+        # audio and dictionary lookup only depend on the word and run next to the text and image chain
+        await asyncio.gather(
+            self._text_and_image(work),
+            self._audio(work),
+            self._dictionary(work),
+        )
+        return await asyncio.to_thread(build_and_save_card, work)
+
+    async def _text_and_image(self, work: CardWork):
+        async with self.semaphores[STAGE_TEXT]:
+            work.structured_content = await self._structured_text(work.word_with_context)
+        definition = work.structured_content["definition"]
+        stored_image = await asyncio.to_thread(image_store.find_concept_image, work.word_with_context, definition)
+        if stored_image is not None:
+            work.stored_image_path, work.image_prompt = stored_image
+        else:
+            async with self.semaphores[STAGE_IMAGE_PROMPT]:
+                work.image_prompt = await self._image_prompt(work.word_with_context, definition)
+            work.stored_image_path = await asyncio.to_thread(image_store.find_image, work.image_prompt)
+        if work.stored_image_path is None:
+            async with self.semaphores[STAGE_IMAGE]:
+                work.image_url = await self._image_url(work.image_prompt)
+            logging.info(f"Card image for word [{work.word_with_context.word}] is created")
+        async with self.semaphores[STAGE_DOWNLOAD]:
+            image_path = generate_image_path(Config.PROCESSING_DIRECTORY_PATH, work.word_with_context)
+            if work.stored_image_path is not None:
+                await asyncio.to_thread(image_store.copy_stored_image, work.stored_image_path, image_path)
+            else:
+                await download_and_save_image_async(work.image_url, image_path, self.http_client)
+                await asyncio.to_thread(image_store.add_image, image_path, work.image_prompt, work.word_with_context, definition)
+            work.image_path = image_path
+        if image_transcoding.transcoding_enabled():
+            async with self.semaphores[STAGE_TRANSCODE]:
+                target_path, future = image_transcoding.submit_transcoding(work.image_path)
+                work.image_path = image_transcoding.finish_transcoding(work.image_path, target_path, await asyncio.wrap_future(future))
+
+    async def _audio(self, work: CardWork):
+        await self._speech(work)
+        if audio_processing.audio_processing_enabled():
+            async with self.semaphores[STAGE_AUDIO_PROCESSING]:
+                work.audio_path = await asyncio.to_thread(audio_processing.process_for_anki, work.audio_path)
+
+    async def _speech(self, work: CardWork):
+        word = work.word_with_context.word
+        audio_path = generate_audio_path(Config.PROCESSING_DIRECTORY_PATH, work.word_with_context)
+        speech_settings = (openai_audio.TTS_MODEL, openai_audio.TTS_VOICE, openai_audio.TTS_FORMAT)
+        if await asyncio.to_thread(audio_cache.copy_cached_audio, word, *speech_settings, audio_path):
+            work.audio_path = audio_path
+            return
+        async with self.semaphores[STAGE_AUDIO]:
+            raw_response = await rate_limiter.call_with_rate_limit_async(ENDPOINT_OPENAI_AUDIO, lambda: self.openai_client.audio.speech.with_raw_response.create(
+                model=openai_audio.TTS_MODEL,
+                voice=openai_audio.TTS_VOICE,
+                input=openai_audio.speech_input(word),
+                response_format=openai_audio.TTS_FORMAT,
+            ))
+            detach_file(audio_path)
+            await asyncio.to_thread(raw_response.parse().write_to_file, audio_path)
+            await asyncio.to_thread(audio_cache.add_audio, audio_path, word, *speech_settings)
+            work.audio_path = audio_path
+            logging.info(f"Card audio is saved as [{audio_path}]")
+
+    async def _dictionary(self, work: CardWork):
+        async with self.semaphores[STAGE_DICTIONARY]:
+            work.dictionary_url = await dictionaries.create_dictionary_url_if_website_exists_async(work.word_with_context.word, self.http_client)
+
+    async def _structured_text(self, word_with_context: WordWithContext) -> dict:
+        messages = openai_text.build_structured_text_messages(word_with_context)
+
+        async def request() -> str:
+            response = await self._chat_completion(messages, openai_text.STRUCTURED_TEXT_PARAMETERS)
+            generated_text = response.choices[0].message.content
+            # invalid responses must not be cached
+            openai_text.parse_structured_text(word_with_context, generated_text)
+            return generated_text
+
+        generated_text = await llm_cache.cached_completion_async(openai_text.STRUCTURED_TEXT_PARAMETERS, messages, request)
+        return openai_text.parse_structured_text(word_with_context, generated_text)
+
+    async def _image_prompt(self, word_with_context: WordWithContext, card_text: str) -> str:
+        messages = openai_image_prompt.build_dalle_prompt_messages(word_with_context, card_text)
+
+        async def request() -> str:
+            response = await self._chat_completion(messages, openai_image_prompt.DALLE_PROMPT_PARAMETERS)
+            return response.choices[0].message.content
+
+        return await llm_cache.cached_completion_async(openai_image_prompt.DALLE_PROMPT_PARAMETERS, messages, request)
+
+    async def _chat_completion(self, messages: list[dict], parameters: dict):
+        estimated_tokens = rate_limiter.estimate_chat_tokens(messages, parameters["max_tokens"])
+        raw_response = await rate_limiter.call_with_rate_limit_async(ENDPOINT_OPENAI_CHAT, lambda: self.openai_client.chat.completions.with_raw_response.create(
+            messages=messages,
+            **parameters
+        ), estimated_tokens)
+        response = raw_response.parse()
+        rate_limiter.get_limiter(ENDPOINT_OPENAI_CHAT).record_token_usage(estimated_tokens, response.usage.total_tokens if response.usage else None)
+        prompt_cache_metrics.record_usage(response.usage)
+        return response
+
+    async def _image_url(self, image_prompt: str) -> str:
+        if Config.IMAGE_GENERATION_MODE == OPENAI:
+            raw_response = await rate_limiter.call_with_rate_limit_async(ENDPOINT_OPENAI_IMAGE, lambda: self.openai_client.images.with_raw_response.generate(
+                prompt=image_prompt,
+                **openai_image.IMAGE_PARAMETERS
+            ))
+            return raw_response.parse().data[0].url
+        elif Config.IMAGE_GENERATION_MODE == REPLICATE:
+            if self.replicate_client is None:
+                import replicate
+                # the async connections of the client belong to this event loop
+                self.replicate_client = replicate.Client(api_token=Config.REPLICATE_API_KEY)
+            output = await rate_limiter.call_with_rate_limit_async(ENDPOINT_REPLICATE, lambda: self.replicate_client.async_run(
+                Config.REPLICATE_MODEL_URL,
+                input={"prompt": image_prompt}
+            ))
+            return output[0]
+        else:
+            raise Exception(f"Unsupported image generation mode: [{Config.IMAGE_GENERATION_MODE}]")
+
+
+async def generate_cards_async(words: Iterable[WordWithContext], semaphores: dict[str, asyncio.Semaphore] = None,
+                               openai_client: AsyncOpenAI = None, http_client: httpx.AsyncClient = None) -> AsyncIterator[CardRawDataV2]:
+    """
+    Generate cards for all words concurrently and yield them as they are completed.
+    Words that fail are logged and skipped.
+    """
+    generator = AsyncCardGenerator(semaphores, openai_client, http_client)
+    tasks: dict[asyncio.Task, WordWithContext] = {
+        asyncio.create_task(generator.create_card(word_with_context)): word_with_context for word_with_context in words
+    }
+    logging.info(f"Starting async generation for {len(tasks)} words")
+    try:
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                word_with_context = tasks[task]
+                if task.exception() is not None:
+                    logging.error(f"Failed to process word [{word_with_context.word}] due to [{task.exception()}]")
+                    continue
+                logging.info(f"Word [{word_with_context.word}] processed")
+                yield task.result()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await generator.aclose()
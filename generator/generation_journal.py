@@ -0,0 +1,161 @@
+import json
+import logging
+import os
+import time
+from collections import Counter
+from typing import TYPE_CHECKING
+
+from generator.cache import image_store
+from generator.cache.sqlite_store import SqliteStore
+from generator.config import STAGE_TEXT, STAGE_IMAGE_PROMPT, STAGE_IMAGE, STAGE_DOWNLOAD, STAGE_TRANSCODE, STAGE_AUDIO, STAGE_AUDIO_PROCESSING, \
+    STAGE_DICTIONARY, STAGE_CARD
+from generator.entities import WordWithContext
+from generator.input.file_operations import file_exists_and_has_bytes
+from generator.pipeline import Stage
+
+if TYPE_CHECKING:
+    from generator.generate_cards import CardWork
+
+JOURNAL_FILE_NAME = ".generation_journal.sqlite3"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stages (
+    word_key TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    output TEXT NOT NULL,
+    recorded_at REAL NOT NULL,
+    PRIMARY KEY (word_key, stage)
+);
+"""
+
+# field of CardWork that holds the output of the stage, later stages overwrite the path of earlier ones
+STAGE_OUTPUT_FIELDS = {
+    STAGE_TEXT: "structured_content",
+    STAGE_IMAGE_PROMPT: "image_prompt",
+    STAGE_IMAGE: "image_url",
+    STAGE_DOWNLOAD: "image_path",
+    STAGE_TRANSCODE: "image_path",
+    STAGE_AUDIO: "audio_path",
+    STAGE_AUDIO_PROCESSING: "audio_path",
+    STAGE_DICTIONARY: "dictionary_url",
+}
+FILE_OUTPUT_FIELDS = {"image_path", "audio_path"}
+# OpenAI and Replicate delete generated images after an hour, older urls are generated again unless they point to the image store
+IMAGE_URL_LIFETIME_SECONDS = 55 * 60
+# stages that call a paid API, shown in the resume summary
+API_CALL_STAGES = [STAGE_TEXT, STAGE_IMAGE_PROMPT, STAGE_IMAGE, STAGE_AUDIO]
+
+# SQLite limits the number of parameters of one statement
+_WORDS_PER_QUERY = 500
+
+
+class GenerationJournal(SqliteStore):
+    """
+    Write-ahead journal of the card generation in a processing directory. The output of every stage is recorded
+    as soon as the stage is completed, the card file replaces the entries of the word at the end.
+    A resumed run continues each word after its last completed stage instead of paying for the earlier stages again.
+    """
+
+    def __init__(self, processing_directory: str):
+        super().__init__(os.path.join(processing_directory, JOURNAL_FILE_NAME), SCHEMA)
+        self.resumed_words = 0
+        self.resumed_stages: Counter = Counter()
+        # words of the retry rounds of this run, counted apart from the words of an interrupted run
+        self.retried_words = 0
+        self.retried_stages: Counter = Counter()
+
+    def journaled(self, stage: Stage) -> Stage:
+        """The stage with a handler that skips restored stages and records the output of the others."""
+
+        def handler(work: 'CardWork'):
+            if stage.name in work.completed_stages:
+                return
+            stage.handler(work)
+            if stage.name == STAGE_CARD:
+                self.forget(work.word_with_context)
+            else:
+                self.record(work, stage.name)
+
+        return Stage(stage.name, handler, stage.workers, stage.depends_on)
+
+    def record(self, work: 'CardWork', stage: str):
+        output = json.dumps(getattr(work, STAGE_OUTPUT_FIELDS[stage]), ensure_ascii=False)
+        self.execute("INSERT OR REPLACE INTO stages VALUES (?, ?, ?, ?)", (word_key(work.word_with_context), stage, output, time.time()))
+
+    def forget(self, word_with_context: WordWithContext):
+        self.execute("DELETE FROM stages WHERE word_key = ?", (word_key(word_with_context),))
+
+    def entries_for_words(self, words: list[WordWithContext]) -> dict[str, dict[str, tuple[object, float]]]:
+        """Recorded stage outputs and their time by word key."""
+        keys = list(dict.fromkeys(word_key(word_with_context) for word_with_context in words))
+        entries: dict[str, dict[str, tuple[object, float]]] = {}
+        for start in range(0, len(keys), _WORDS_PER_QUERY):
+            chunk = keys[start:start + _WORDS_PER_QUERY]
+            placeholders = ", ".join("?" for _ in chunk)
+            rows = self.execute(f"SELECT word_key, stage, output, recorded_at FROM stages WHERE word_key IN ({placeholders})", chunk)
+            for key, stage, output, recorded_at in rows:
+                entries.setdefault(key, {})[stage] = (json.loads(output), recorded_at)
+        return entries
+
+    def restore(self, works: list['CardWork'], stages: list[Stage], retry_round: bool = False):
+        """
+        Set the recorded outputs on the work items and mark their stages as completed. Stages whose file is missing
+        are run again, unless a later stage that depends on them is completed (e.g. the PNG is removed after transcoding).
+        retry_round restores the words that failed earlier in this run, they are not counted as resumed.
+        """
+        entries = self.entries_for_words([work.word_with_context for work in works])
+        for work in works:
+            outputs = entries.get(word_key(work.word_with_context))
+            if not outputs:
+                continue
+            completed = {stage for stage, (output, recorded_at) in outputs.items()
+                         if stage in STAGE_OUTPUT_FIELDS and is_valid_output(stage, output, recorded_at)}
+            # stages are listed after their dependencies
+            for stage in reversed(stages):
+                if stage.name in completed:
+                    completed.update(stage.depends_on)
+            for stage in stages:
+                if stage.name in completed and stage.name in outputs:
+                    setattr(work, STAGE_OUTPUT_FIELDS[stage.name], outputs[stage.name][0])
+            work.completed_stages = completed
+            if not completed:
+                continue
+            if retry_round:
+                self.retried_words += 1
+                self.retried_stages.update(completed)
+                logging.info(f"Word [{work.word_with_context.word}] retried, completed stages {sorted(completed)}")
+            else:
+                self.resumed_words += 1
+                self.resumed_stages.update(completed)
+                logging.info(f"Word [{work.word_with_context.word}] resumed, completed stages {sorted(completed)}")
+
+    def log_resume_statistics(self):
+        if self.resumed_words:
+            avoided = avoided_api_calls(self.resumed_stages)
+            logging.info(f"Resume: [{self.resumed_words}] words continued from the journal, [{sum(avoided.values())}] API calls avoided {avoided}")
+        if self.retried_words:
+            avoided = avoided_api_calls(self.retried_stages)
+            logging.info(f"Retry rounds: [{self.retried_words}] retried words continued after their completed stages, "
+                         f"[{sum(avoided.values())}] API calls avoided {avoided}")
+
+
+def avoided_api_calls(completed_stages: Counter) -> dict[str, int]:
+    return {stage: completed_stages[stage] for stage in API_CALL_STAGES if completed_stages[stage]}
+
+
+def is_valid_output(stage: str, output, recorded_at: float) -> bool:
+    if STAGE_OUTPUT_FIELDS[stage] in FILE_OUTPUT_FIELDS:
+        return isinstance(output, str) and file_exists_and_has_bytes(output)
+    if stage == STAGE_TEXT:
+        return isinstance(output, dict)
+    if stage == STAGE_IMAGE:
+        # images of the image store are looked up again
+        return bool(output) and not image_store.is_stored_image_url(output) and time.time() - recorded_at < IMAGE_URL_LIFETIME_SECONDS
+    if stage == STAGE_DICTIONARY:
+        # no dictionary url is a valid result
+        return True
+    return bool(output)
+
+
+def word_key(word_with_context: WordWithContext) -> str:
+    return f"{word_with_context.word}\x1f{word_with_context.context}"
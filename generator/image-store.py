@@ -0,0 +1,49 @@
+import argparse
+import datetime
+
+from generator.cache import image_store
+from generator.config import Config
+
+
+def list_images(limit: int):
+    store = image_store.get_image_store()
+    images = store.list_blobs()
+    for content_hash, size, word, image_prompt, created_at, accessed_at in images[:limit]:
+        last_used = datetime.datetime.fromtimestamp(accessed_at).strftime("%Y-%m-%d %H:%M")
+        print(f"{content_hash[:12]}  {size / 1024:8.0f} KB  {last_used}  {word or '-':<24}  {(image_prompt or '')[:80]}")
+    print(f"{len(images)} images, {store.total_size() / 1024 / 1024:.1f} MB in [{store.blob_directory}]")
+
+
+def prune_images(max_megabytes: float, older_than_days: float):
+    store = image_store.get_image_store()
+    size_before = store.total_size()
+    older_than_seconds = older_than_days * 24 * 3600 if older_than_days is not None else None
+    removed = store.evict(int(max_megabytes * 1024 * 1024), older_than_seconds)
+    print(f"{removed} images removed, {(size_before - store.total_size()) / 1024 / 1024:.1f} MB freed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List and prune the image store, that keeps generated images for reuse across runs and decks.")
+    parser.add_argument('--cache_directory', type=str, help="Directory of the caches. If not set, the standard cache directory for each OS is used", default=None)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    list_parser = commands.add_parser('list', help="List stored images, most recently used first")
+    list_parser.add_argument('--limit', type=int, help="Maximum number of listed images", default=50)
+
+    prune_parser = commands.add_parser('prune', help="Remove least recently used images")
+    prune_parser.add_argument('--max_megabytes', type=float, help="Remove least recently used images until the store fits in this size", default=Config.IMAGE_STORE_MAX_MEGABYTES)
+    prune_parser.add_argument('--older_than_days', type=float, help="Remove images not used for this number of days", default=None)
+
+    args = parser.parse_args()
+
+    Config.setup_logging()
+    Config.set_cache_directory_or_use_default(args.cache_directory)
+
+    if args.command == 'list':
+        list_images(args.limit)
+    elif args.command == 'prune':
+        prune_images(args.max_megabytes, args.older_than_days)
+
+
+if __name__ == '__main__':
+    main()
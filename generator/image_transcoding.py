@@ -0,0 +1,101 @@
+import logging
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from generator.config import Config, IMAGE_FORMAT_JPEG, IMAGE_FORMAT_PNG, IMAGE_FORMAT_WEBP, STAGE_TRANSCODE
+from generator.input.file_operations import atomic_write
+
+FILE_EXTENSIONS = {IMAGE_FORMAT_WEBP: ".webp", IMAGE_FORMAT_JPEG: ".jpg"}
+PILLOW_FORMATS = {IMAGE_FORMAT_WEBP: "WEBP", IMAGE_FORMAT_JPEG: "JPEG"}
+
+
+class TranscodingStatistics:
+    """Size of the images before and after transcoding, the difference is not synced to AnkiWeb."""
+
+    def __init__(self):
+        self.images = 0
+        self.source_bytes = 0
+        self.target_bytes = 0
+        self._lock = threading.Lock()
+
+    def record(self, source_bytes: int, target_bytes: int):
+        with self._lock:
+            self.images += 1
+            self.source_bytes += source_bytes
+            self.target_bytes += target_bytes
+
+    def log_statistics(self):
+        if self.images == 0:
+            return
+        megabytes = 1024 * 1024
+        logging.info(f"Image transcoding: [{self.images}] images, [{self.source_bytes / megabytes:.1f}] MB to [{self.target_bytes / megabytes:.1f}] MB, "
+                     f"[{(self.source_bytes - self.target_bytes) / megabytes:.1f}] MB saved")
+
+
+transcoding_statistics = TranscodingStatistics()
+_process_pool: ProcessPoolExecutor = None
+_process_pool_lock = threading.Lock()
+
+
+def transcoding_enabled() -> bool:
+    return Config.IMAGE_FORMAT != IMAGE_FORMAT_PNG
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """
+    Process wide pool, created on first use. Decoding and encoding images is CPU bound,
+    the processes use several cores unlike the threads of the pipeline.
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(max_workers=Config.STAGE_WORKERS[STAGE_TRANSCODE])
+        return _process_pool
+
+
+def shutdown_process_pool():
+    """Stop the worker processes at the end of the run, a later transcoding creates a new pool."""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown()
+            _process_pool = None
+
+
+def submit_transcoding(image_path: str) -> tuple[str, Future]:
+    """Path of the transcoded image and the future of the transcoding in the process pool."""
+    target_path = os.path.splitext(image_path)[0] + FILE_EXTENSIONS[Config.IMAGE_FORMAT]
+    future = get_process_pool().submit(transcode_image, image_path, target_path, PILLOW_FORMATS[Config.IMAGE_FORMAT],
+                                       Config.IMAGE_QUALITY, Config.IMAGE_MAX_SIZE)
+    return target_path, future
+
+
+def finish_transcoding(image_path: str, target_path: str, sizes: tuple[int, int]) -> str:
+    source_bytes, target_bytes = sizes
+    transcoding_statistics.record(source_bytes, target_bytes)
+    # the original is kept in the image store, the processing directory only keeps the image of the card
+    if target_path != image_path:
+        os.remove(image_path)
+    logging.info(f"Image [{image_path}] transcoded to [{target_path}], [{source_bytes / 1024:.0f}] KB to [{target_bytes / 1024:.0f}] KB")
+    return target_path
+
+
+def transcode_for_anki(image_path: str) -> str:
+    """Downscale and convert the image to the configured format. Returns the path of the converted image."""
+    target_path, future = submit_transcoding(image_path)
+    return finish_transcoding(image_path, target_path, future.result())
+
+
+def transcode_image(source_path: str, target_path: str, pillow_format: str, quality: int, max_size: int) -> tuple[int, int]:
+    """Runs in a worker process. Returns the size of the source and the target file."""
+    from PIL import Image
+
+    with Image.open(source_path) as image:
+        image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+        if pillow_format == "JPEG" and image.mode != "RGB":
+            # JPEG has no alpha channel
+            image = image.convert("RGB")
+        with atomic_write(target_path) as file:
+            image.save(file, format=pillow_format, quality=quality)
+    return os.path.getsize(source_path), os.path.getsize(target_path)
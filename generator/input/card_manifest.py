@@ -0,0 +1,107 @@
+import json
+import logging
+import os
+import time
+
+from generator.cache.sqlite_store import SqliteStore
+from generator.entities import CardRawDataV2
+from generator.input.file_operations import read_card_file
+
+MANIFEST_FILE_NAME = ".cards_manifest.sqlite3"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cards (
+    json_path TEXT PRIMARY KEY,
+    json_mtime_ns INTEGER NOT NULL,
+    json_size INTEGER NOT NULL,
+    word TEXT,
+    version INTEGER,
+    image_path TEXT,
+    image_size INTEGER,
+    image_mtime_ns INTEGER,
+    audio_path TEXT,
+    audio_size INTEGER,
+    audio_mtime_ns INTEGER
+);
+CREATE INDEX IF NOT EXISTS cards_word ON cards (word);
+"""
+
+# manifests of earlier versions have more columns, the rows are written with this column list
+COLUMNS = "json_path, json_mtime_ns, json_size, word, version, image_path, image_size, image_mtime_ns, audio_path, audio_size, audio_mtime_ns"
+
+# SQLite limits the number of parameters of one statement
+_WORDS_PER_QUERY = 500
+
+
+class CardManifest(SqliteStore):
+    """
+    Index of the card files of a processing directory: word, version, media paths, sizes and mtimes.
+    A refresh only stats the files and parses the cards that changed since the last run,
+    afterwards only the cards of the requested words are loaded.
+    """
+
+    def __init__(self, processing_directory: str):
+        super().__init__(os.path.join(processing_directory, MANIFEST_FILE_NAME), SCHEMA)
+        self.processing_directory = processing_directory
+
+    def refresh(self):
+        started_at = time.monotonic()
+        files: dict[str, tuple[int, int]] = {}
+        with os.scandir(self.processing_directory) as entries:
+            for entry in entries:
+                # dot-files like the batch state (.openai_batches.json) are not cards
+                if entry.name.endswith('.json') and not entry.name.startswith('.') and entry.is_file():
+                    stat = entry.stat()
+                    files[entry.path] = (stat.st_mtime_ns, stat.st_size)
+        indexed = {path: (mtime_ns, size) for path, mtime_ns, size in self.execute("SELECT json_path, json_mtime_ns, json_size FROM cards")}
+
+        removed = [(path,) for path in indexed if path not in files]
+        changed = [path for path, signature in files.items() if indexed.get(path) != signature]
+        rows = [self._index_row(path, *files[path]) for path in changed]
+        if removed:
+            self.execute_many("DELETE FROM cards WHERE json_path = ?", removed)
+        if rows:
+            self.execute_many(f"INSERT OR REPLACE INTO cards ({COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        logging.info(f"Card manifest refreshed in [{time.monotonic() - started_at:.2f}] seconds: [{len(files)}] cards, "
+                     f"[{len(changed)}] indexed, [{len(removed)}] removed")
+
+    def card_paths_for_words(self, words: list[str]) -> list[str]:
+        unique_words = list(dict.fromkeys(words))
+        paths = []
+        for start in range(0, len(unique_words), _WORDS_PER_QUERY):
+            chunk = unique_words[start:start + _WORDS_PER_QUERY]
+            placeholders = ", ".join("?" for _ in chunk)
+            paths += [path for (path,) in self.execute(f"SELECT json_path FROM cards WHERE version = 2 AND word IN ({placeholders})", chunk)]
+        return paths
+
+    def _index_row(self, json_path: str, json_mtime_ns: int, json_size: int) -> tuple:
+        try:
+            with open(json_path, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+        except (OSError, ValueError) as e:
+            # e.g. a file that was cut off by a crash, it is indexed again when it changes
+            logging.warning(f"Card file [{json_path}] can not be read: [{e}]")
+            return (json_path, json_mtime_ns, json_size) + (None,) * 8
+        image_path = data.get('image_path')
+        audio_path = data.get('audio_path')
+        return (json_path, json_mtime_ns, json_size, data.get('word'), data.get('version', 1),
+                image_path, *media_signature(image_path),
+                audio_path, *media_signature(audio_path))
+
+
+def media_signature(media_path: str | None) -> tuple:
+    """Size and mtime of a media file, the file is not read."""
+    if not media_path or not os.path.isfile(media_path):
+        return None, None
+    stat = os.stat(media_path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def cards_for_words(processing_directory: str, words: list[str]) -> list[CardRawDataV2]:
+    """Cards of the processing directory for the given words, only their files are read."""
+    manifest = CardManifest(processing_directory)
+    try:
+        manifest.refresh()
+        return [card for card in map(read_card_file, manifest.card_paths_for_words(words)) if card is not None]
+    finally:
+        manifest.close()
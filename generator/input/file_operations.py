@@ -1,45 +1,101 @@
 import json
 import logging
 import os
-import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, BinaryIO, Iterator
 
 import requests
+from requests.adapters import HTTPAdapter
 
-from generator.config import Config
+from generator.api_calls import retries
+from generator.config import Config, STAGE_DOWNLOAD
 
 from generator.entities import CardRawDataV1, CardRawDataV2, WordWithContext, word_to_filename
 
+if TYPE_CHECKING:
+    import httpx
 
-def cards_in_directory(processing_directory: str) -> list[CardRawDataV2]:
-    return read_json_files_as_objects(processing_directory)
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+# connect and read timeout, the read timeout applies between two chunks and not to the whole download
+DOWNLOAD_TIMEOUT_SECONDS = (10, 60)
+# keep-alive connections of the download session, enough for all download workers
+DOWNLOAD_POOL_SIZE = 16
 
 
-def list_json_files(directory):
-    return [os.path.join(directory, f) for f in os.listdir(directory) if f.endswith('.json')]
+class DownloadError(IOError):
+    """Image download failed with an HTTP status, server errors are retried."""
 
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.status_code = status_code
 
-def read_json_files_as_objects(directory):
-    """
-    Read JSON files and deserialize to CardRawDataV2 objects.
-    Automatically detects version field and uses appropriate dataclass.
-    """
-    files = list_json_files(directory)
-    objects = []
-    for file_path in files:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            data = json.load(file)
-            # Check version field to determine which dataclass to use
-            version = data.get('version', 1)
-            if version == 2:
-                obj = CardRawDataV2(**data)
-            else:
-                # For v1 or unversioned files, try to convert to v2 format
-                logging.warning(f"Found v1 card in {file_path}. Consider regenerating with v2 format.")
-                obj = CardRawDataV1(**data)
-                # Skip v1 cards for now (could add migration logic here)
-                continue
-            objects.append(obj)
-    return objects
+
+class IncompleteDownloadError(IOError):
+    """The connection was closed before the whole image was received."""
+    retryable = True
+
+
+class DownloadStatistics:
+    """Number, size and duration of the image downloads, to see whether downloads are limited by the network."""
+
+    def __init__(self):
+        self.downloads = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, url: str, size: int, seconds: float):
+        with self._lock:
+            self.downloads += 1
+            self.bytes += size
+            self.seconds += seconds
+        logging.debug(f"Downloaded [{size / 1024:.0f}] KB in [{seconds:.2f}] seconds, [{kilobytes_per_second(size, seconds):.0f}] KB/s from [{url}]")
+
+    def log_statistics(self):
+        if self.downloads == 0:
+            return
+        logging.info(f"Image downloads: [{self.downloads}] files, [{self.bytes / 1024 / 1024:.1f}] MB, "
+                     f"average throughput [{kilobytes_per_second(self.bytes, self.seconds):.0f}] KB/s per download")
+
+
+def kilobytes_per_second(size: int, seconds: float) -> float:
+    return size / 1024 / seconds if seconds > 0 else 0.0
+
+
+download_statistics = DownloadStatistics()
+_download_session: requests.Session = None
+_download_session_lock = threading.Lock()
+
+
+def get_download_session() -> requests.Session:
+    """Process wide session, downloads from the same host reuse the connection instead of a new TCP and TLS handshake."""
+    global _download_session
+    with _download_session_lock:
+        if _download_session is None:
+            _download_session = requests.Session()
+            pool_size = max(DOWNLOAD_POOL_SIZE, Config.STAGE_WORKERS[STAGE_DOWNLOAD])
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            _download_session.mount("https://", adapter)
+            _download_session.mount("http://", adapter)
+        return _download_session
+
+
+def read_card_file(file_path) -> CardRawDataV2 | None:
+    """Read one card file, v1 cards are skipped and None is returned."""
+    with open(file_path, 'r', encoding='utf-8') as file:
+        data = json.load(file)
+    # Check version field to determine which dataclass to use
+    version = data.get('version', 1)
+    if version == 2:
+        return CardRawDataV2(**data)
+    # For v1 or unversioned files, try to convert to v2 format
+    logging.warning(f"Found v1 card in {file_path}. Consider regenerating with v2 format.")
+    CardRawDataV1(**data)
+    # Skip v1 cards for now (could add migration logic here)
+    return None
 
 
 def save_text(content: str, path):
@@ -61,25 +117,67 @@ def generate_audio_path(processing_directory_path: str, word: WordWithContext) -
 
 
 def download_and_save_image(url, image_path):
-    response = requests.get(url)
-    if response.status_code == 200:
-        with open(image_path, 'wb') as f:
-            f.write(response.content)
-        logging.info(f"Image saved as {image_path}")
-    else:
-        raise IOError(f"Failed to retrieve image from URL: {url}. Status code: {response.status_code}")
-
-
-def copy_to_media_directory(file_path):
-    filename = os.path.basename(file_path)
-    target_file_path = os.path.join(Config.ANKI_MEDIA_DIRECTORY, filename)
-    shutil.copy(file_path, target_file_path)
-    if filename.endswith(".png"):
-        logging.info(f"Image [{filename}] copied to [{Config.ANKI_MEDIA_DIRECTORY}]")
-    elif filename.endswith(".mp3"):
-        logging.info(f"Audio file [{filename}] copied to [{Config.ANKI_MEDIA_DIRECTORY}]")
-    else:
-        logging.info(f"File [{filename}] copied to [{Config.ANKI_MEDIA_DIRECTORY}]")
+    """
+    Stream the image in chunks to a temporary file and rename it to image_path when it is complete.
+    A crash or a broken connection never leaves a truncated image behind, the download is retried then.
+    """
+    retries.call_with_retries(retries.provider_of_url(url), lambda: _download_and_save_image(url, image_path))
+
+
+async def download_and_save_image_async(url, image_path, http_client: 'httpx.AsyncClient'):
+    await retries.call_with_retries_async(retries.provider_of_url(url), lambda: _download_and_save_image_async(url, image_path, http_client))
+
+
+def _download_and_save_image(url, image_path):
+    started_at = time.monotonic()
+    with get_download_session().get(url, stream=True, timeout=DOWNLOAD_TIMEOUT_SECONDS) as response:
+        if response.status_code != 200:
+            raise DownloadError(f"Failed to retrieve image from URL: {url}. Status code: {response.status_code}", response.status_code)
+        with atomic_write(image_path) as file:
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_BYTES):
+                file.write(chunk)
+            check_complete(url, response.headers, file.tell())
+            size = file.tell()
+    download_statistics.record(url, size, time.monotonic() - started_at)
+    logging.info(f"Image saved as {image_path}")
+
+
+async def _download_and_save_image_async(url, image_path, http_client: 'httpx.AsyncClient'):
+    started_at = time.monotonic()
+    async with http_client.stream("GET", url) as response:
+        if response.status_code != 200:
+            raise DownloadError(f"Failed to retrieve image from URL: {url}. Status code: {response.status_code}", response.status_code)
+        with atomic_write(image_path) as file:
+            async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_BYTES):
+                file.write(chunk)
+            check_complete(url, response.headers, file.tell())
+            size = file.tell()
+    download_statistics.record(url, size, time.monotonic() - started_at)
+    logging.info(f"Image saved as {image_path}")
+
+
+def check_complete(url: str, headers, received_bytes: int):
+    expected_bytes = headers.get("Content-Length")
+    # compressed responses are decoded while streaming, their length is not comparable
+    if expected_bytes is not None and not headers.get("Content-Encoding") and int(expected_bytes) != received_bytes:
+        raise IncompleteDownloadError(f"Download of [{url}] is incomplete: [{received_bytes}] of [{expected_bytes}] bytes received")
+
+
+@contextmanager
+def atomic_write(path: str) -> Iterator[BinaryIO]:
+    """
+    Binary file that is written to a temporary file next to path and renamed to path when the block completes without error.
+    The rename also replaces a hard link to a stored file instead of writing into it.
+    """
+    directory, file_name = os.path.split(path)
+    temporary_path = os.path.join(directory, f".{file_name}.{uuid.uuid4().hex}.part")
+    try:
+        with open(temporary_path, 'wb') as file:
+            yield file
+        os.replace(temporary_path, path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
 
 
 def all_files_exist_and_are_not_empty(required_files: list[str]) -> bool:
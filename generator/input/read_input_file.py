@@ -1,49 +1,84 @@
+import csv
+import json
 import logging
 import os
-
-import pandas as pd
+from typing import Iterable, Iterator
 
 from generator.entities import WordWithContext
 
+REQUIRED_COLUMNS = {'word', 'context'}
+
 
-def normalize_columns(df):
+def normalize_columns(columns) -> list[str]:
     """Normalize all column names to lowercase."""
-    df.columns = [col.lower() for col in df.columns]
-    return df
+    return [str(column).strip().lower() if column is not None else "" for column in columns]
 
 
-def check_columns(df):
-    required_columns = {'word', 'context'}
-    if not required_columns.issubset(df.columns):
-        missing_cols = required_columns - set(df.columns)
-        raise ValueError(f"Missing required columns: {', '.join(missing_cols)}")
+def check_columns(columns: list[str]):
+    if not REQUIRED_COLUMNS.issubset(columns):
+        missing_cols = REQUIRED_COLUMNS - set(columns)
+        raise ValueError(f"Missing required columns: {', '.join(sorted(missing_cols))}")
     logging.info("All required columns are present")
 
 
-def read_from_dataframe(df) -> list[WordWithContext]:
-    words_with_context = []
-    df = normalize_columns(df)
-    check_columns(df)
-    for index, row in df.iterrows():
-        if not row['word'] or row['word'].strip() == "":
+def words_from_rows(rows: Iterable[dict]) -> Iterator[WordWithContext]:
+    """Rows without word are skipped, missing context becomes an empty string."""
+    for row in rows:
+        word = cell_to_text(row.get('word'))
+        if word == "":
             continue
-        word = row['word'].strip()
-        context = row['context'].strip() if 'context' in row and not pd.isna(row['context']) else ""
-        words_with_context.append(WordWithContext(word, context))
-    return words_with_context
-
-
-def read_csv_file(file_path: str) -> list[WordWithContext]:
-    df = pd.read_csv(file_path, delimiter=";")
-    return read_from_dataframe(df)
-
-
-def read_excel_file(file_path: str) -> list[WordWithContext]:
-    df = pd.read_excel(file_path, engine='openpyxl')
-    return read_from_dataframe(df)
-
-
-def read_file_based_on_extension(file_path: str) -> list[WordWithContext]:
+        yield WordWithContext(word, cell_to_text(row.get('context')))
+
+
+def cell_to_text(value) -> str:
+    if value is None:
+        return ""
+    return str(value).strip()
+
+
+def iter_csv_file(file_path: str) -> Iterator[WordWithContext]:
+    # utf-8-sig removes the byte order mark written by Excel
+    with open(file_path, 'r', encoding='utf-8-sig', newline='') as file:
+        reader = csv.reader(file, delimiter=';')
+        header = next(reader, None)
+        columns = normalize_columns(header or [])
+        check_columns(columns)
+        yield from words_from_rows(dict(zip(columns, row)) for row in reader)
+
+
+def iter_excel_file(file_path: str) -> Iterator[WordWithContext]:
+    # openpyxl is only imported for Excel input, it is slow to import
+    import openpyxl
+    # read-only mode streams the rows instead of building the whole sheet in memory
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        columns = normalize_columns(next(rows, None) or [])
+        check_columns(columns)
+        yield from words_from_rows(dict(zip(columns, row)) for row in rows)
+    finally:
+        workbook.close()
+
+
+def iter_jsonl_file(file_path: str) -> Iterator[WordWithContext]:
+    """One JSON object per line with the keys word and (optional) context."""
+    with open(file_path, 'r', encoding='utf-8-sig') as file:
+        for line_number, line in enumerate(file, start=1):
+            if line.strip() == "":
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"Invalid JSON in line {line_number}: {e}")
+            if not isinstance(entry, dict):
+                raise ValueError(f"Line {line_number} is not a JSON object")
+            entry = {key.lower(): value for key, value in entry.items()}
+            if 'word' not in entry:
+                raise ValueError(f"Missing required key word in line {line_number}")
+            yield from words_from_rows([entry])
+
+
+def iter_words_from_file(file_path: str) -> Iterator[WordWithContext]:
     # Check if file exists before proceeding
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"No file found at the specified path: {file_path}")
@@ -52,9 +87,24 @@ def read_file_based_on_extension(file_path: str) -> list[WordWithContext]:
 
     if file_extension.lower() in ['.csv']:
         logging.info("Reading CSV file")
-        return read_csv_file(file_path)
+        return iter_csv_file(file_path)
     elif file_extension.lower() in ['.xls', '.xlsx']:
         logging.info("Reading Excel file")
-        return read_excel_file(file_path)
+        return iter_excel_file(file_path)
+    elif file_extension.lower() in ['.jsonl']:
+        logging.info("Reading JSONL file")
+        return iter_jsonl_file(file_path)
     else:
         raise ValueError("Unsupported file format")
+
+
+def read_csv_file(file_path: str) -> list[WordWithContext]:
+    return list(iter_csv_file(file_path))
+
+
+def read_excel_file(file_path: str) -> list[WordWithContext]:
+    return list(iter_excel_file(file_path))
+
+
+def read_file_based_on_extension(file_path: str) -> list[WordWithContext]:
+    return list(iter_words_from_file(file_path))
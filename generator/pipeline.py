@@ -0,0 +1,205 @@
+import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, Iterator
+
+_QUEUE_POLL_SECONDS = 0.2
+_SHUTDOWN = object()
+
+
+@dataclass
+class Stage:
+    """
+    One step of the pipeline. The handler receives the work item and stores its output on it.
+    A stage starts for an item only after all stages from depends_on are completed for this item.
+    """
+    name: str
+    handler: Callable[[object], None]
+    workers: int = 1
+    depends_on: list[str] = field(default_factory=list)
+
+
+@dataclass
+class PipelineResult:
+    item: object
+    error: Exception = None
+    failed_stage: str = None
+    # duration of each executed stage
+    stage_seconds: dict[str, float] = field(default_factory=dict)
+    # from the start of the first stage to the end of the last stage of the item
+    elapsed_seconds: float = 0.0
+
+
+def critical_path_seconds(stages: list[Stage], stage_seconds: dict[str, float]) -> float:
+    """Longest chain of dependent stage durations, the time the item needs without waiting in queues."""
+    depends_on = {stage.name: stage.depends_on for stage in stages}
+    finished_at: dict[str, float] = {}
+
+    def finish(name: str) -> float:
+        if name not in finished_at:
+            finished_at[name] = max((finish(dependency) for dependency in depends_on[name]), default=0.0) + stage_seconds.get(name, 0.0)
+        return finished_at[name]
+
+    return max((finish(name) for name in depends_on), default=0.0)
+
+
+class _ItemState:
+    def __init__(self, item, stages: dict[str, Stage]):
+        self.item = item
+        self.waiting_for: dict[str, int] = {name: len(stage.depends_on) for name, stage in stages.items()}
+        self.pending: int = len(stages)
+        self.error: Exception = None
+        self.failed_stage: str = None
+        self.stage_seconds: dict[str, float] = {}
+        self.started_at: float = None
+
+
+class StagedPipeline:
+    """
+    Runs work items through a graph of stages. Every stage has its own bounded queue and its own pool of worker threads,
+    so many items are in flight at once and each stage can be sized for the provider behind it.
+    Results are yielded in completion order. If a stage fails for an item, the remaining stages are skipped for this item.
+    """
+
+    def __init__(self, stages: list[Stage], queue_size_per_worker: int = 2):
+        self._stages: dict[str, Stage] = {stage.name: stage for stage in stages}
+        self._downstream: dict[str, list[str]] = {name: [] for name in self._stages}
+        for stage in stages:
+            if stage.workers < 1:
+                raise ValueError(f"Stage [{stage.name}] needs at least one worker, got [{stage.workers}]")
+            for dependency in stage.depends_on:
+                if dependency not in self._stages:
+                    raise ValueError(f"Stage [{stage.name}] depends on unknown stage [{dependency}]")
+                self._downstream[dependency].append(stage.name)
+        self._roots: list[str] = [stage.name for stage in stages if not stage.depends_on]
+        self._check_acyclic()
+
+        self._queues: dict[str, queue.Queue] = {
+            stage.name: queue.Queue(maxsize=stage.workers * queue_size_per_worker) for stage in stages
+        }
+        self._results: queue.Queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads: list[threading.Thread] = []
+
+    def run(self, items: Iterable) -> Iterator[PipelineResult]:
+        self._start_workers()
+        feeder = threading.Thread(target=self._feed, args=(items,), name="pipeline-feeder", daemon=True)
+        feeder.start()
+        fed_total = None
+        emitted = 0
+        try:
+            while fed_total is None or emitted < fed_total:
+                result = self._results.get()
+                if isinstance(result, int):
+                    fed_total = result
+                    continue
+                emitted += 1
+                yield result
+        finally:
+            self.stop()
+
+    def stop(self):
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        for stage in self._stages.values():
+            for _ in range(stage.workers):
+                self._put(stage.name, _SHUTDOWN, force=True)
+
+    def _check_acyclic(self):
+        in_degree = {name: len(stage.depends_on) for name, stage in self._stages.items()}
+        ready = list(self._roots)
+        visited = 0
+        while ready:
+            name = ready.pop()
+            visited += 1
+            for child in self._downstream[name]:
+                in_degree[child] -= 1
+                if in_degree[child] == 0:
+                    ready.append(child)
+        if visited != len(self._stages):
+            raise ValueError("Pipeline stages contain a dependency cycle")
+
+    def _start_workers(self):
+        for stage in self._stages.values():
+            logging.debug(f"Pipeline stage [{stage.name}] uses [{stage.workers}] workers")
+            for index in range(stage.workers):
+                thread = threading.Thread(target=self._work, args=(stage,), name=f"pipeline-{stage.name}-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _feed(self, items: Iterable):
+        fed = 0
+        try:
+            for item in items:
+                if self._stop.is_set():
+                    break
+                state = _ItemState(item, self._stages)
+                fed += 1
+                for root in self._roots:
+                    self._put(root, state)
+        finally:
+            # a generator of items stops its pending work (e.g. packed requests) when the pipeline stops early
+            if hasattr(items, "close"):
+                items.close()
+        self._results.put(fed)
+
+    def _put(self, stage_name: str, entry, force: bool = False):
+        target = self._queues[stage_name]
+        while True:
+            try:
+                target.put(entry, timeout=_QUEUE_POLL_SECONDS)
+                return
+            except queue.Full:
+                if self._stop.is_set() and not force:
+                    return
+                if force:
+                    # drop queued work, workers only need the shutdown marker
+                    try:
+                        target.get_nowait()
+                    except queue.Empty:
+                        pass
+
+    def _work(self, stage: Stage):
+        source = self._queues[stage.name]
+        while True:
+            state = source.get()
+            if state is _SHUTDOWN:
+                return
+            if self._stop.is_set():
+                continue
+            if state.error is None:
+                started_at = time.monotonic()
+                with self._lock:
+                    if state.started_at is None:
+                        state.started_at = started_at
+                try:
+                    stage.handler(state.item)
+                except Exception as e:
+                    logging.debug(f"Pipeline stage [{stage.name}] failed", exc_info=True)
+                    with self._lock:
+                        if state.error is None:
+                            state.error = e
+                            state.failed_stage = stage.name
+                with self._lock:
+                    state.stage_seconds[stage.name] = time.monotonic() - started_at
+            self._complete(stage.name, state)
+
+    def _complete(self, stage_name: str, state: _ItemState):
+        ready: list[str] = []
+        with self._lock:
+            state.pending -= 1
+            finished = state.pending == 0
+            for child in self._downstream[stage_name]:
+                state.waiting_for[child] -= 1
+                if state.waiting_for[child] == 0:
+                    ready.append(child)
+        for child in ready:
+            self._put(child, state)
+        if finished:
+            elapsed_seconds = time.monotonic() - state.started_at if state.started_at is not None else 0.0
+            self._results.put(PipelineResult(item=state.item, error=state.error, failed_stage=state.failed_stage,
+                                             stage_seconds=state.stage_seconds, elapsed_seconds=elapsed_seconds))
@@ -1,33 +1,38 @@
 import argparse
+import json
 import logging
+import multiprocessing
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-import generator.input.file_operations
 from generator.entities import WordWithContext, CardRawDataV1, CardRawDataV2
-from generator.input import read_input_file
+from generator.input import card_manifest, file_operations, read_input_file
 from generator.anki import anki_importer, anki_operations
-from generator.config import Config
-from generator import generate_cards, entities
+from generator.api_calls import clients, prompt_cache_metrics, retries
+from generator.cache import audio_cache, image_store, llm_cache, probe_cache
+from generator.config import Config, MEDIA_TRANSFER_LOCAL, STAGE_TEXT, STAGE_IMAGE_PROMPT, STAGE_IMAGE, STAGE_DOWNLOAD, STAGE_TRANSCODE, STAGE_AUDIO, \
+    STAGE_AUDIO_PROCESSING, STAGE_DICTIONARY
+from generator import audio_processing, generate_cards, entities, image_transcoding
 from generator import validation
+from generator.run_report import run_report
 
 
-def process_existing_cards(input_words: list[WordWithContext]) -> list[str]:
-    filtered_words: list[WordWithContext] = validation.filter_words_are_present_in_deck(Config.DECK_NAME, input_words)
+def process_existing_cards(filtered_words: list[WordWithContext]) -> list[str]:
     input_words_without_context: list[str] = list(map(lambda word_with_context: word_with_context.word, filtered_words))
 
     logging.info("Processing existing cards")
-    cards_in_directory: list[CardRawDataV2] = generator.input.file_operations.cards_in_directory(Config.PROCESSING_DIRECTORY_PATH)
-    relevant_cards_in_directory: list[CardRawDataV2] = [card for card in cards_in_directory if card.word in input_words_without_context]
-    existing_cards_validated: list[CardRawDataV2] = validation.discard_invalid_cards(Config.PROCESSING_DIRECTORY_PATH, relevant_cards_in_directory)
+    relevant_cards_in_directory: list[CardRawDataV2] = card_manifest.cards_for_words(Config.PROCESSING_DIRECTORY_PATH, input_words_without_context)
+    existing_cards_validated, deleted_words = validation.discard_invalid_cards(Config.PROCESSING_DIRECTORY_PATH, relevant_cards_in_directory)
     existing_cards_data: dict[WordWithContext, CardRawDataV2] = entities.cards_to_dict_v2(existing_cards_validated)
     anki_importer.import_card_collection(existing_cards_data)
     logging.info("All existing cards processed")
 
-    imported_existing_words: list[str] = [item.word for item in existing_cards_data.keys()]
+    # words of deleted invalid cards are not generated again either
+    imported_existing_words: list[str] = [item.word for item in existing_cards_data.keys()] + deleted_words
     return imported_existing_words
 
 
-def process_new_cards(input_words: list[WordWithContext]):
-    filtered_words: list[WordWithContext] = validation.filter_words_are_present_in_deck(Config.DECK_NAME, input_words)
+def process_new_cards(filtered_words: list[WordWithContext]):
     generated_cards_data: dict[WordWithContext, CardRawDataV2] = generate_cards.generate_text_and_image(filtered_words)
     logging.info("Card generation completed")
     anki_importer.import_card_collection(generated_cards_data)
@@ -41,16 +46,32 @@ def exclude_imported_words(input_words, imported_existing_words) -> list[WordWit
     return input_words
 
 
+def run_preflight_checks(input_file: str) -> list[WordWithContext]:
+    """AnkiConnect and the deck are checked while the input file is read, they do not depend on each other."""
+    started_at = time.monotonic()
+    validation.check_language()
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix="preflight") as executor:
+        anki_prepared = executor.submit(validation.prepare_anki)
+        input_words = executor.submit(read_input_file.read_file_based_on_extension, input_file)
+        # a failed AnkiConnect check is reported before a failure of the input file
+        deck_note_ids = anki_prepared.result()
+        words = input_words.result()
+    validation.prepare_deck_lookup(deck_note_ids, len(words))
+    logging.info(f"Preflight checks completed in [{time.monotonic() - started_at:.2f}] seconds, [{len(words)}] words read")
+    return words
+
+
 def main():
     # Create the parser
     parser = argparse.ArgumentParser(description="This tool processes the list of words or phrases (with optional context) and creates an Anki card for each word. The cards are then imported via AnkiConnect.")
 
     # Required positional arguments
-    parser.add_argument('input_file', type=str, help="Path to the input file, CSV with semicolons or Excel. Header [word;context] is required")
+    parser.add_argument('input_file', type=str, help="Path to the input file, CSV with semicolons, Excel or JSONL. Header [word;context] is required for CSV and Excel")
     parser.add_argument('processing_directory', type=str, help="Path of the directory where the data should be processed. It could be an empty directory. If directory contains generated cards, tool will suggest to import them.")
 
     # Optional arguments
     parser.add_argument('--openai_api_key', type=str, help="API key for OpenAI. If not set, the value from environment variable OPENAI_API_KEY is used", default=None)
+    parser.add_argument('--openai_base_url', type=str, help="Base URL of the OpenAI API, e.g. a proxy or a local stand-in server. If not set, the value from environment variable OPENAI_BASE_URL or the OpenAI API is used", default=None)
     parser.add_argument('--deck_name', type=str, help="Name of the Anki deck. If not set, the default name is generated", default=None)
     parser.add_argument('--anki_media_directory_path', type=str, help="Path to the Anki media directory. If not set, the standard path for each OS is used", default=None)
     parser.add_argument('--language', type=str, help="Target card language. Not only the card translation, customized generation process for each language", default=Config.DEFAULT_LANGUAGE, choices=Config.SUPPORTED_LANGUAGES)
@@ -62,38 +83,172 @@ def main():
     parser.add_argument('--replicate_model_url', type=str, help="URL of Replicate model, which will be used to generate an image", default=None)
     parser.add_argument('--card_direction', type=str, help="Card type: 'recognition' (English→Russian), 'production' (Russian→English), or 'both'", default=Config.DEFAULT_CARD_DIRECTION, choices=Config.SUPPORTED_CARD_DIRECTIONS)
     parser.add_argument('--include_cloze', action='store_true', help="Generate cloze deletion cards for practicing collocations and prepositions")
+    parser.add_argument('--image_format', type=str, help="Convert and downscale the card images, e.g. webp is about 20 times smaller than the generated PNG. Requires Pillow (default: png, images are not converted)", default=None, choices=Config.SUPPORTED_IMAGE_FORMATS)
+    parser.add_argument('--image_quality', type=int, help=f"Quality of converted images from 1 to 100 (default: {Config.DEFAULT_IMAGE_QUALITY})", default=None)
+    parser.add_argument('--image_max_size', type=int, help=f"Maximal width and height of converted images in pixels (default: {Config.DEFAULT_IMAGE_MAX_SIZE})", default=None)
+    parser.add_argument('--process_audio', action='store_true', help="Trim the silence of the speech, normalize its loudness and re-encode it with a lower bitrate. Requires ffmpeg")
+    parser.add_argument('--audio_format', type=str, help="Format of the processed audio, opus is smaller but not played by every Anki client (default: mp3)", default=None, choices=Config.SUPPORTED_AUDIO_FORMATS)
+    parser.add_argument('--audio_bitrate', type=int, help=f"Bitrate of the processed audio in kbit/s (default: {Config.DEFAULT_AUDIO_BITRATE_KBPS})", default=None)
+    parser.add_argument('--media_transfer', type=str, help="How media files get to Anki: copied to the local media directory or sent via AnkiConnect storeMediaFile, e.g. if Anki runs on another machine", default=None, choices=Config.SUPPORTED_MEDIA_TRANSFERS)
+    parser.add_argument('--pack_size', type=int, help=f"Words per card text request, the long system prompt is sent once per pack (default: {Config.DEFAULT_PACK_SIZE}, max: {Config.MAX_PACK_SIZE})", default=None)
+    parser.add_argument('--import_chunk_size', type=int, help=f"Notes per addNotes request to AnkiConnect (default: {Config.DEFAULT_IMPORT_CHUNK_SIZE})", default=None)
+
+    # Concurrency of generation stages
+    parser.add_argument('--text_workers', type=int, help=f"Parallel structured text requests (default: {Config.DEFAULT_STAGE_WORKERS[STAGE_TEXT]})", default=None)
+    parser.add_argument('--image_prompt_workers', type=int, help=f"Parallel image prompt requests (default: {Config.DEFAULT_STAGE_WORKERS[STAGE_IMAGE_PROMPT]})", default=None)
+    parser.add_argument('--image_workers', type=int, help=f"Parallel image generation requests (default: {Config.DEFAULT_STAGE_WORKERS[STAGE_IMAGE]})", default=None)
+    parser.add_argument('--download_workers', type=int, help=f"Parallel image downloads (default: {Config.DEFAULT_STAGE_WORKERS[STAGE_DOWNLOAD]})", default=None)
+    parser.add_argument('--transcode_workers', type=int, help=f"Processes that convert images (default: {Config.DEFAULT_STAGE_WORKERS[STAGE_TRANSCODE]})", default=None)
+    parser.add_argument('--audio_workers', type=int, help=f"Parallel text-to-speech requests (default: {Config.DEFAULT_STAGE_WORKERS[STAGE_AUDIO]})", default=None)
+    parser.add_argument('--audio_processing_workers', type=int, help=f"Parallel ffmpeg processes for audio processing (default: {Config.DEFAULT_STAGE_WORKERS[STAGE_AUDIO_PROCESSING]})", default=None)
+    parser.add_argument('--dictionary_workers', type=int, help=f"Parallel dictionary lookups (default: {Config.DEFAULT_STAGE_WORKERS[STAGE_DICTIONARY]})", default=None)
+
+    # Batch API
+    parser.add_argument('--batch', action='store_true', help="Request card texts and image prompts with the OpenAI Batch API: half the price and separate rate limits, but results can take up to 24 hours. An interrupted run continues with the submitted batches")
+    parser.add_argument('--batch_poll_seconds', type=float, help=f"Interval of batch status checks (default: {Config.DEFAULT_BATCH_POLL_SECONDS})", default=None)
+
+    # Interrupted runs
+    parser.add_argument('--resume', action='store_true', help="Continue words of an interrupted run after their last completed stage, e.g. the paid text and image are not generated again")
+
+    # Unattended runs
+    parser.add_argument('--non_interactive', action='store_true', help="Never ask, decisions follow the policies. Policies that are not set: existing cards are skipped, failed words are skipped, invalid card files are generated again")
+    parser.add_argument('--on_existing', type=str, help="Card of the word exists in the deck: ask, skip the word, replace the notes or update their fields and keep the review history (default: ask)", default=None, choices=Config.SUPPORTED_ON_EXISTING_POLICIES)
+    parser.add_argument('--on_error', type=str, help=f"Generation or import of a word failed: ask, skip the word, abort the run or retry the generation up to {Config.ERROR_RETRY_ROUNDS} times (default: ask)", default=None, choices=Config.SUPPORTED_ON_ERROR_POLICIES)
+    parser.add_argument('--on_invalid', type=str, help="Card file with missing media: ask, delete it and skip the word or delete it and generate the card again (default: ask)", default=None, choices=Config.SUPPORTED_ON_INVALID_POLICIES)
+    parser.add_argument('--create_deck', action='store_true', help="Create the deck if it does not exist without asking")
+    parser.add_argument('--report_file', type=str, help="JSON report of the failures and decisions of the run. If not set, it is saved in the reports directory of the processing directory", default=None)
+    parser.add_argument('--config_file', type=str, help="JSON file with options, e.g. {\"on_existing\": \"skip\", \"max_retries\": 6}. Options on the command line override it", default=None)
+
+    # Provider connections and budgets
+    parser.add_argument('--no_prewarm', action='store_true', help="Do not open provider connections in the background during startup")
+    parser.add_argument('--max_retries', type=int, help=f"Retries of a call to OpenAI, Replicate, a dictionary or an image host after network errors, timeouts and server errors (default: {Config.DEFAULT_MAX_RETRIES})", default=None)
+    parser.add_argument('--max_retry_seconds', type=float, help=f"Time a call may wait for retries and paused providers before its word fails (default: {Config.DEFAULT_MAX_RETRY_SECONDS:.0f})", default=None)
+    parser.add_argument('--rate_limit', type=str, action='append', help=f"Budget of a provider endpoint as ENDPOINT=RPM or ENDPOINT=RPM/TPM, can be repeated. Endpoints: {list(Config.DEFAULT_RATE_LIMITS.keys())}", default=None)
+
+    # Persistent caches
+    parser.add_argument('--cache_directory', type=str, help="Directory of the caches shared by all runs and decks. If not set, the standard cache directory for each OS is used", default=None)
+    parser.add_argument('--no_cache', action='store_true', help="Do not read or write the persistent caches")
+    parser.add_argument('--image_store_max_megabytes', type=int, help="Size limit of the image store, least recently used images are removed first", default=Config.IMAGE_STORE_MAX_MEGABYTES)
+    parser.add_argument('--audio_cache_max_megabytes', type=int, help="Size limit of the pronunciation audio cache, least recently used files are removed first", default=Config.AUDIO_CACHE_MAX_MEGABYTES)
 
     # Parse arguments
-    args = parser.parse_args()
+    args, config_file_options = parse_arguments(parser)
 
     # Setup config
     Config.setup_logging()
+    if args.config_file is not None:
+        logging.info(f"Options from config file [{args.config_file}]: {config_file_options}")
     Config.set_openai_key_or_use_default(args.openai_api_key)
+    Config.set_openai_base_url_or_use_default(args.openai_base_url)
     Config.set_image_generation_mode_or_use_default(args.image_generation_mode)
     Config.set_replicate_token_and_url_if_replicate_mode_used(args.replicate_api_key, args.replicate_model_url)
     Config.set_anki_deck_name_or_use_default(args.deck_name)
-    Config.set_anki_media_directory_or_use_default(args.anki_media_directory_path)
+    Config.set_image_transcoding_or_use_default(args.image_format, args.image_quality, args.image_max_size)
+    Config.set_audio_processing_or_use_default(args.process_audio, args.audio_format, args.audio_bitrate)
+    Config.set_media_transfer_or_use_default(args.media_transfer)
+    if Config.MEDIA_TRANSFER == MEDIA_TRANSFER_LOCAL:
+        Config.set_anki_media_directory_or_use_default(args.anki_media_directory_path)
     Config.set_processing_directory_path(args.processing_directory)
+    Config.set_policies_or_use_default(args.on_existing, args.on_error, args.on_invalid, args.create_deck, args.non_interactive)
+    Config.set_report_file_or_use_default(args.report_file)
     Config.set_language_or_use_default(args.language)
     Config.set_level_or_use_default(args.level)
     Config.set_card_model_or_use_default(args.card_model)
     Config.set_card_direction_or_use_default(args.card_direction)
     Config.set_include_cloze(args.include_cloze)
-
-    # validate environment and read inputs
-    validation.check_anki_connect()
-    validation.check_whether_deck_exists()
-    validation.check_language()
-    input_words: list[WordWithContext] = read_input_file.read_file_based_on_extension(args.input_file)
-
-    # Processing
-    imported_existing_words: list[str] = process_existing_cards(input_words)
-    logging.info("Existing cards processed")
-    input_words_except_imported = exclude_imported_words(input_words, imported_existing_words)
-    process_new_cards(input_words_except_imported)
-    logging.info("New cards processed")
-    logging.info("Processing completed")
+    Config.set_resume(args.resume)
+    Config.set_import_chunk_size_or_use_default(args.import_chunk_size)
+    Config.set_pack_size_or_use_default(args.pack_size)
+    Config.set_stage_workers_or_use_default({
+        STAGE_TEXT: args.text_workers,
+        STAGE_IMAGE_PROMPT: args.image_prompt_workers,
+        STAGE_IMAGE: args.image_workers,
+        STAGE_DOWNLOAD: args.download_workers,
+        STAGE_TRANSCODE: args.transcode_workers,
+        STAGE_AUDIO: args.audio_workers,
+        STAGE_AUDIO_PROCESSING: args.audio_processing_workers,
+        STAGE_DICTIONARY: args.dictionary_workers,
+    })
+    Config.set_rate_limits_or_use_default(args.rate_limit)
+    Config.set_max_retries_or_use_default(args.max_retries, args.max_retry_seconds)
+    Config.set_batch_mode(args.batch, args.batch_poll_seconds)
+    Config.PREWARM_CONNECTIONS = not args.no_prewarm
+    Config.set_cache_directory_or_use_default(args.cache_directory, not args.no_cache)
+    Config.IMAGE_STORE_MAX_MEGABYTES = args.image_store_max_megabytes
+    Config.AUDIO_CACHE_MAX_MEGABYTES = args.audio_cache_max_megabytes
+
+    input_words: list[WordWithContext] | None = None
+    status = "aborted"
+    error = None
+    try:
+        # validate environment and read inputs
+        if Config.PREWARM_CONNECTIONS:
+            clients.prewarm_connections()
+        input_words = run_preflight_checks(args.input_file)
+
+        # Processing, the words in the deck are checked once, the policy decides once per word
+        filtered_words: list[WordWithContext] = validation.filter_words_are_present_in_deck(Config.DECK_NAME, input_words)
+        imported_existing_words: list[str] = process_existing_cards(filtered_words)
+        logging.info("Existing cards processed")
+        input_words_except_imported = exclude_imported_words(filtered_words, imported_existing_words)
+        process_new_cards(input_words_except_imported)
+        logging.info("New cards processed")
+        log_cache_statistics()
+        logging.info("Processing completed")
+        status = "completed"
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        image_transcoding.shutdown_process_pool()
+        run_report.write(Config.REPORT_FILE, status, Config.policies(), len(input_words) if input_words is not None else None, error)
+
+
+def parse_arguments(parser: argparse.ArgumentParser) -> tuple[argparse.Namespace, dict]:
+    """
+    Options of the config file are used as defaults, options on the command line override them.
+    Returns the arguments and the options of the config file, they are logged once logging is configured.
+    """
+    known_args, _ = parser.parse_known_args()
+    config_file_options = {}
+    if known_args.config_file is not None:
+        config_file_options = read_config_file(parser, known_args.config_file)
+        parser.set_defaults(**config_file_options)
+    return parser.parse_args(), config_file_options
+
+
+def read_config_file(parser: argparse.ArgumentParser, config_file: str) -> dict:
+    with open(config_file, 'r', encoding='utf-8') as file:
+        values = json.load(file)
+    if not isinstance(values, dict):
+        parser.error(f"Config file [{config_file}] must contain a JSON object")
+    options = {action.dest: action for action in parser._actions if action.option_strings and action.dest not in ("help", "config_file")}
+    defaults = {}
+    for key, value in values.items():
+        # keys can be written like the options, e.g. "--on_existing" or "on-existing"
+        dest = key.lstrip('-').replace('-', '_')
+        action = options.get(dest)
+        if action is None:
+            parser.error(f"Unknown option [{key}] in config file [{config_file}]")
+        if action.choices is not None and value not in action.choices:
+            parser.error(f"Invalid value [{value}] of option [{key}] in config file [{config_file}], choose from {list(action.choices)}")
+        defaults[dest] = value
+    return defaults
+
+
+def log_cache_statistics():
+    for cache in [llm_cache.get_llm_cache(), image_store.get_image_store(), audio_cache.get_audio_cache(),
+                  probe_cache.get_probe_cache()]:
+        if cache is not None:
+            cache.log_statistics()
+    prompt_cache_metrics.get_prompt_cache_metrics().log_statistics()
+    file_operations.download_statistics.log_statistics()
+    image_transcoding.transcoding_statistics.log_statistics()
+    retries.retry_statistics.log_statistics()
+    audio_processing.audio_processing_statistics.log_statistics()
 
 
 if __name__ == '__main__':
+    # the processes of the image transcoding start the frozen Windows executable again, they must not run the CLI
+    multiprocessing.freeze_support()
     main()
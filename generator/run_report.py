@@ -0,0 +1,59 @@
+import datetime
+import json
+import logging
+import os
+import threading
+
+# where a failure or decision happened
+PHASE_DECK = "deck"
+PHASE_EXISTING = "existing"
+PHASE_INVALID = "invalid"
+PHASE_GENERATION = "generation"
+PHASE_IMPORT = "import"
+
+
+class RunReport:
+    """
+    Failures and policy decisions of one run, written as JSON at the end, so unattended runs can be checked
+    and the failed words can be processed again by a script.
+    """
+
+    def __init__(self):
+        self.started_at = datetime.datetime.now().astimezone()
+        self.failures: list[dict] = []
+        self.decisions: list[dict] = []
+        self._lock = threading.Lock()
+
+    def add_failure(self, word: str | None, phase: str, error, action: str, step: str = None):
+        entry = {"word": word, "phase": phase, "error": str(error), "action": action}
+        if step is not None:
+            # generation stage or card type of the failed note
+            entry["step"] = step
+        with self._lock:
+            self.failures.append(entry)
+
+    def add_decision(self, word: str, phase: str, action: str):
+        with self._lock:
+            self.decisions.append({"word": word, "phase": phase, "action": action})
+
+    def write(self, path: str, status: str, policies: dict, input_words: int | None, error: Exception = None):
+        report = {
+            "status": status,
+            "error": str(error) if error is not None else None,
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "finished_at": datetime.datetime.now().astimezone().isoformat(timespec="seconds"),
+            "input_words": input_words,
+            "policies": policies,
+            "failed_words": sorted({entry["word"] for entry in self.failures if entry["word"] is not None}),
+            "failures": self.failures,
+            "decisions": self.decisions,
+        }
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        logging.info(f"Run report with [{len(self.failures)}] failures and [{len(self.decisions)}] decisions saved as [{path}]")
+
+
+run_report = RunReport()
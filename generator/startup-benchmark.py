@@ -0,0 +1,76 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Runs in a fresh interpreter, so the modules imported by earlier runs do not hide the import time
+CHILD_SCRIPT = """
+import importlib, json, time
+started_at = time.perf_counter()
+importlib.import_module('generator.read-generate-import')
+imported_at = time.perf_counter()
+from generator.api_calls import clients
+clients.get_openai_client().models.list()
+called_at = time.perf_counter()
+print(json.dumps({'import_ms': (imported_at - started_at) * 1000, 'first_call_ms': (called_at - imported_at) * 1000}))
+"""
+
+
+class StubApiHandler(BaseHTTPRequestHandler):
+    """Answers every request with an empty model list, the benchmark measures the client and not the network."""
+
+    def do_GET(self):
+        body = json.dumps({"object": "list", "data": []}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run_child(base_url: str) -> dict[str, float]:
+    environment = dict(os.environ, OPENAI_API_KEY=os.environ.get("OPENAI_API_KEY", "benchmark"), OPENAI_BASE_URL=base_url)
+    started_at = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", CHILD_SCRIPT], env=environment, capture_output=True, text=True, check=True).stdout
+    total_ms = (time.perf_counter() - started_at) * 1000
+    timings = json.loads(output.strip().splitlines()[-1])
+    timings["total_ms"] = total_ms
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures the startup of the tool: import time of the command line module and the time until the first API call is answered. "
+                                                 "The API is a local stub, so only the tool itself is measured.")
+    parser.add_argument('--runs', type=int, help="Number of fresh interpreters to start", default=5)
+    parser.add_argument('--max_import_ms', type=float, help="Exit with an error if the median import time is higher, e.g. in a build pipeline", default=None)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubApiHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    try:
+        runs = [run_child(base_url) for _ in range(args.runs)]
+    finally:
+        server.shutdown()
+
+    for metric, title in [("import_ms", "Import of read-generate-import"), ("first_call_ms", "First API call after import"),
+                          ("total_ms", "Interpreter start to first API call")]:
+        values = [run[metric] for run in runs]
+        print(f"{title}: median [{statistics.median(values):.0f}] ms, min [{min(values):.0f}] ms, max [{max(values):.0f}] ms")
+
+    median_import_ms = statistics.median(run["import_ms"] for run in runs)
+    if args.max_import_ms is not None and median_import_ms > args.max_import_ms:
+        print(f"Median import time [{median_import_ms:.0f}] ms is above the limit of [{args.max_import_ms:.0f}] ms")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,12 +3,13 @@ import os
 
 import requests
 
-from generator.anki import anki_operations
-from generator.config import Config
+from generator.anki import anki_operations, deck_index
+from generator.config import Config, POLICY_ASK, POLICY_SKIP, POLICY_REPLACE, POLICY_UPDATE, POLICY_DELETE
 from generator.entities import WordWithContext, CardRawDataV1
 from generator.input import file_operations
 from generator.input.confirm import confirm_action
 from generator.input.file_operations import generate_card_data_path
+from generator.run_report import run_report, PHASE_DECK, PHASE_EXISTING, PHASE_INVALID
 
 
 def check_anki_connect():
@@ -26,6 +27,13 @@ def check_whether_deck_exists():
     deck_name = Config.DECK_NAME
     deck_exists = anki_operations.check_deck_exists(deck_name)
     if not deck_exists:
+        if Config.CREATE_DECK:
+            anki_operations.create_deck(deck_name)
+            run_report.add_decision(None, PHASE_DECK, "created")
+            return
+        if Config.NON_INTERACTIVE:
+            run_report.add_failure(None, PHASE_DECK, f"Deck [{deck_name}] does not exist", "aborted")
+            raise Exception(f"Deck [{deck_name}] does not exist, use --create_deck to create it in a non-interactive run")
         confirmation = confirm_action(f"Deck {deck_name} does not exist. Should it be created? Otherwise the processing will be aborted.")
         if confirmation:
             anki_operations.create_deck(deck_name)
@@ -33,6 +41,21 @@ def check_whether_deck_exists():
             raise Exception("Can not create deck without the confirmation")
 
 
+def prepare_anki() -> list[int]:
+    """AnkiConnect and the deck are checked. Returns the notes of the deck, they decide how the input words are looked up."""
+    check_anki_connect()
+    check_whether_deck_exists()
+    return deck_index.find_deck_note_ids(Config.DECK_NAME)
+
+
+def prepare_deck_lookup(deck_note_ids: list[int], words: int):
+    """Loads the deck index if it takes fewer requests than the lookup of the words, otherwise the words are looked up in multi requests."""
+    if deck_index.index_is_cheaper(len(deck_note_ids), words):
+        deck_index.get_deck_index(Config.DECK_NAME, deck_note_ids)
+    else:
+        logging.info(f"Deck [{Config.DECK_NAME}] has [{len(deck_note_ids)}] notes, the [{words}] input words are looked up without loading the deck index")
+
+
 def check_language():
     if Config.LANGUAGE not in Config.SUPPORTED_LANGUAGES:
         raise Exception(f"Language {Config.LANGUAGE} is not supported")
@@ -45,9 +68,13 @@ def check_level():
 
 def filter_words_are_present_in_deck(deck_name, words: list[WordWithContext]) -> list[WordWithContext]:
     words_to_skip: list[WordWithContext] = []
+    notes_by_word: dict[str, list[int]] = anki_operations.find_notes_by_words(deck_name, [word.word for word in words])
     for word in words:
-        card_exists = anki_operations.check_card_exists(deck_name, word.word)
-        if card_exists:
+        card_exists = len(notes_by_word[word.word]) >= 1
+        if card_exists and Config.ON_EXISTING != POLICY_ASK:
+            if not apply_existing_card_policy(deck_name, word):
+                words_to_skip.append(word)
+        elif card_exists:
             deletion_confirmation = confirm_action(
                 f"Card for [{word.word}] already exists in the deck [{deck_name}]. Should it be deleted from the deck? Otherwise the word will be skipped.")
             if deletion_confirmation:
@@ -69,8 +96,32 @@ def filter_words_are_present_in_deck(deck_name, words: list[WordWithContext]) ->
     return words_to_process
 
 
-def discard_invalid_cards(processing_directory: str, existing_cards: list[CardRawDataV1]) -> list[CardRawDataV1]:
+def apply_existing_card_policy(deck_name: str, word: WordWithContext) -> bool:
+    """Whether the word is processed, its existing notes are replaced or updated, or it is skipped."""
+    if Config.ON_EXISTING == POLICY_SKIP:
+        logging.info(f"Card for [{word.word}] already exists in the deck [{deck_name}], the word is skipped")
+        run_report.add_decision(word.word, PHASE_EXISTING, "skipped")
+        return False
+    if Config.ON_EXISTING == POLICY_UPDATE:
+        logging.info(f"Card for [{word.word}] already exists in the deck [{deck_name}], its notes will be updated")
+        run_report.add_decision(word.word, PHASE_EXISTING, "updated")
+        return True
+    if Config.ON_EXISTING == POLICY_REPLACE:
+        if anki_operations.delete_card_from_deck(deck_name, word.word):
+            run_report.add_decision(word.word, PHASE_EXISTING, "replaced")
+            return True
+        run_report.add_failure(word.word, PHASE_EXISTING, "Existing notes could not be deleted", "skipped")
+        return False
+    raise Exception(f"Unsupported policy for existing cards: [{Config.ON_EXISTING}]")
+
+
+def discard_invalid_cards(processing_directory: str, existing_cards: list[CardRawDataV1]) -> tuple[list[CardRawDataV1], list[str]]:
+    """
+    Valid cards and the words that are not generated again: their invalid card file was deleted or could not be deleted.
+    A card is invalid if its image or audio file is missing.
+    """
     valid_cards: list[CardRawDataV1] = []
+    deleted_words: list[str] = []
     for card in existing_cards:
         required_files: list[str] = [card.audio_path, card.image_path]
         if file_operations.all_files_exist_and_are_not_empty(required_files):
@@ -78,8 +129,24 @@ def discard_invalid_cards(processing_directory: str, existing_cards: list[CardRa
             valid_cards.append(card)
         else:
             logging.info(f"Some files from [{required_files}] does not exist, card for word [{card.word}] is not valid")
+            if Config.ON_INVALID != POLICY_ASK:
+                try:
+                    os.remove(generate_card_data_path(processing_directory, WordWithContext(card.word, "")))
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    # the invalid card stays, the word is neither imported nor generated in this run
+                    logging.warning(f"Invalid card file for word [{card.word}] could not be deleted: [{e}]")
+                    deleted_words.append(card.word)
+                    run_report.add_failure(card.word, PHASE_INVALID, e, "skipped")
+                    continue
+                if Config.ON_INVALID == POLICY_DELETE:
+                    deleted_words.append(card.word)
+                run_report.add_failure(card.word, PHASE_INVALID, f"Missing media files {required_files}",
+                                       "deleted" if Config.ON_INVALID == POLICY_DELETE else "regenerated")
+                continue
             confirmation = confirm_action(f"Card for [{card.word}] is invalid. Should the card file be deleted? Otherwise the processing will be aborted.")
             if confirmation:
-                file_path = generate_card_data_path(processing_directory, card.word)
+                file_path = generate_card_data_path(processing_directory, WordWithContext(card.word, ""))
                 os.remove(file_path)
-    return valid_cards
+    return valid_cards, deleted_words
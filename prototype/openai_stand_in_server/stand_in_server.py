@@ -0,0 +1,181 @@
+"""
+Local stand-in for the parts of the OpenAI API used by the generator: files, batches, chat completions,
+image generation and speech. Responses are canned, so batch mode and the generation stages can be tried
+without an API key and without costs.
+
+    python prototype/openai_stand_in_server/stand_in_server.py --port 8089 --batch_seconds 5
+    python -m generator.read-generate-import words.csv ./processing --batch --batch_poll_seconds 2 \
+        --openai_base_url http://127.0.0.1:8089/v1 --openai_api_key stand-in
+"""
+import argparse
+import base64
+import json
+import re
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 1x1 transparent PNG
+PNG_IMAGE = base64.b64decode("iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg==")
+# one silent MPEG audio frame
+MP3_AUDIO = bytes.fromhex("fffb9064") + bytes(413)
+
+files: dict[str, dict] = {}
+batches: dict[str, dict] = {}
+lock = threading.RLock()
+settings = argparse.Namespace(batch_seconds=5.0, invalid_every=0, speech_file=None, error_every=0)
+completions_count = 0
+generation_requests_count = 0
+
+
+def structured_card(word: str) -> dict:
+    global completions_count
+    with lock:
+        completions_count += 1
+        if settings.invalid_every > 0 and completions_count % settings.invalid_every == 0:
+            return {"definition": f"Definition of {word}"}
+    return {
+        "definition": f"Definition of {word}",
+        "russian_translation": f"Перевод {word}",
+        "context_sentences": [f"First sentence with {word}.", f"Second sentence with {word}."],
+        "notes": f"Notes about {word}",
+        "russian_speaker_tips": None,
+    }
+
+
+def chat_completion(body: dict) -> dict:
+    user_message = body["messages"][-1]["content"]
+    words = re.findall(r"WORD: \[(.*?)\]", user_message) or ["word"]
+    if (body.get("response_format") or {}).get("type") != "json_object":
+        content = f"A detailed illustration of {words[0]} without any text"
+    elif '"cards"' in user_message:
+        # packed request with several words
+        content = json.dumps({"cards": [{"word": word, **structured_card(word)} for word in words]}, ensure_ascii=False)
+    else:
+        content = json.dumps(structured_card(words[0]), ensure_ascii=False)
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "gpt-4o"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 100, "completion_tokens": 50, "total_tokens": 150, "prompt_tokens_details": {"cached_tokens": 80}},
+    }
+
+
+def server_error_due() -> bool:
+    global generation_requests_count
+    with lock:
+        generation_requests_count += 1
+        return settings.error_every > 0 and generation_requests_count % settings.error_every == 0
+
+
+def speech_audio() -> bytes:
+    if settings.speech_file is None:
+        return MP3_AUDIO
+    with open(settings.speech_file, 'rb') as file:
+        return file.read()
+
+
+def batch_object(batch: dict) -> dict:
+    """Completes the batch when its time is over, the output file is created on first request afterwards."""
+    if batch["status"] == "in_progress" and time.time() - batch["created_at"] >= settings.batch_seconds:
+        output_lines = []
+        for line in files[batch["input_file_id"]]["content"].decode("utf-8").splitlines():
+            request = json.loads(line)
+            output_lines.append(json.dumps({
+                "id": f"batch_req_{uuid.uuid4().hex}",
+                "custom_id": request["custom_id"],
+                "response": {"status_code": 200, "request_id": uuid.uuid4().hex, "body": chat_completion(request["body"])},
+                "error": None,
+            }, ensure_ascii=False))
+        batch["output_file_id"] = store_file("batch_output.jsonl", "batch_output", "\n".join(output_lines).encode("utf-8"))
+        batch["request_counts"] = {"total": len(output_lines), "completed": len(output_lines), "failed": 0}
+        batch["status"] = "completed"
+        batch["completed_at"] = int(time.time())
+    return {key: value for key, value in batch.items() if key != "created_at"} | {"created_at": int(batch["created_at"])}
+
+
+def store_file(filename: str, purpose: str, content: bytes) -> str:
+    file_id = f"file-{uuid.uuid4().hex}"
+    files[file_id] = {"id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+                      "filename": filename, "purpose": purpose, "status": "processed", "content": content}
+    return file_id
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        with lock:
+            if match := re.fullmatch(r"/v1/files/([\w-]+)/content", self.path):
+                file = files.get(match.group(1))
+                return self.send(200, file["content"], "application/octet-stream") if file else self.send_json(404, {"error": {"message": "No such file"}})
+            if match := re.fullmatch(r"/v1/batches/([\w-]+)", self.path):
+                batch = batches.get(match.group(1))
+                return self.send_json(200, batch_object(batch)) if batch else self.send_json(404, {"error": {"message": "No such batch"}})
+        if self.path == "/image.png":
+            return self.send(200, PNG_IMAGE, "image/png")
+        self.send_json(200, {"object": "list", "data": []})
+
+    def do_HEAD(self):
+        self.send(200, b"", "application/json")
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path == "/v1/files":
+            return self.upload_file(body)
+        request = json.loads(body or b"{}")
+        if self.path == "/v1/batches":
+            with lock:
+                batch_id = f"batch_{uuid.uuid4().hex}"
+                batches[batch_id] = {"id": batch_id, "object": "batch", "endpoint": request["endpoint"], "input_file_id": request["input_file_id"],
+                                     "completion_window": request["completion_window"], "status": "in_progress", "created_at": time.time(),
+                                     "output_file_id": None, "error_file_id": None, "metadata": request.get("metadata"),
+                                     "request_counts": {"total": 0, "completed": 0, "failed": 0}}
+                return self.send_json(200, batch_object(batches[batch_id]))
+        if self.path in ("/v1/chat/completions", "/v1/images/generations", "/v1/audio/speech") and server_error_due():
+            return self.send_json(502, {"error": {"message": "Bad gateway (stand-in)"}})
+        if self.path == "/v1/chat/completions":
+            return self.send_json(200, chat_completion(request))
+        if self.path == "/v1/images/generations":
+            host, port = self.server.server_address
+            return self.send_json(200, {"created": int(time.time()), "data": [{"url": f"http://{host}:{port}/image.png"}]})
+        if self.path == "/v1/audio/speech":
+            return self.send(200, speech_audio(), "audio/mpeg")
+        self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def upload_file(self, body: bytes):
+        message = BytesParser(policy=HTTP).parsebytes(f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode("utf-8") + body)
+        fields = {part.get_param("name", header="content-disposition"): part for part in message.iter_parts()}
+        file_part = fields["file"]
+        with lock:
+            file_id = store_file(file_part.get_filename(), fields["purpose"].get_content().strip(), file_part.get_payload(decode=True))
+            self.send_json(200, {key: value for key, value in files[file_id].items() if key != "content"})
+
+    def send_json(self, status: int, data: dict):
+        self.send(status, json.dumps(data, ensure_ascii=False).encode("utf-8"), "application/json")
+
+    def send(self, status: int, content: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        print(f"{self.command} {self.path} -> {args[1] if len(args) > 1 else ''}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenAI API")
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--batch_seconds', type=float, help="Time until a batch is completed", default=5.0)
+    parser.add_argument('--invalid_every', type=int, help="Every n-th structured text is invalid, 0 for none", default=0)
+    parser.add_argument('--error_every', type=int, help="Every n-th chat, image or speech request fails with 502, 0 for none", default=0)
+    parser.add_argument('--speech_file', type=str, help="MP3 file returned as speech, e.g. to try the audio processing (default: one silent frame)", default=None)
+    settings = parser.parse_args()
+    print(f"OpenAI stand-in listening on http://127.0.0.1:{settings.port}/v1")
+    ThreadingHTTPServer(("127.0.0.1", settings.port), StandInHandler).serve_forever()
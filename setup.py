@@ -10,6 +10,9 @@ setup(
     name='anki-cards-ai-generator',
     version='0.1.0',
     install_requires=read_requirements(),
+    extras_require={
+        'images': ['Pillow'],
+    },
     python_requires='>=3.10',
     url='https://github.com/ValeriiZhyla/anki-cards-ai-generator',
     packages=find_packages(),